@@ -0,0 +1,442 @@
+from __future__ import print_function
+import sys, os, time, shutil, tempfile, subprocess
+from multiprocessing import cpu_count
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+def timed(cmd, env=None, n=5, setup=None):
+	'''Run the given command `n` times, returns a sorted list of timings.'''
+	res = []
+	with open(os.devnull, 'w') as null:
+		for i in range(n):
+			if setup is not None:
+				setup()
+			start = time.time()
+			subprocess.check_call(cmd, cwd=DIR, env=env, stdout=null)
+			res.append(time.time() - start)
+	return sorted(res)
+
+def report(name, timings):
+	best, median = timings[0], timings[len(timings) // 2]
+	print('%-30s best %7.1f ms   median %7.1f ms' % (
+		name, best * 1000, median * 1000
+	))
+
+def startup(args):
+	'''Compare startup time with a cold and a warm core module cache'''
+	
+	tmp = tempfile.mkdtemp()
+	env = dict(os.environ, RUNA_CACHE_DIR=os.path.join(tmp, 'cache'))
+	cmd = [sys.executable, '-c', 'import runac']
+	clear = lambda: shutil.rmtree(env['RUNA_CACHE_DIR'], True)
+	
+	try:
+		report('import (cold cache)', timed(cmd, env, setup=clear))
+		report('import (warm cache)', timed(cmd, env))
+		nocache = dict(env, RUNA_NO_CACHE='1')
+		report('import (no cache)', timed(cmd, nocache))
+	finally:
+		shutil.rmtree(tmp, True)
+
+def commands(args):
+	'''Time driver commands (with a warm cache) on a small program'''
+	
+	fn = args[0] if args else os.path.join('tests', 'hello.rns')
+	for cmd in ('tokens', 'parse', 'show', 'generate'):
+		argv = [sys.executable, '-m', 'runac', cmd, fn]
+		timed(argv, n=1)
+		report(cmd, timed(argv))
+
+def parser(args):
+	'''Time tokens and parse commands with and without cached LR tables'''
+	
+	fn = args[0] if args else os.path.join('tests', 'hello.rns')
+	tmp = tempfile.mkdtemp()
+	env = dict(os.environ, RUNA_CACHE_DIR=os.path.join(tmp, 'cache'))
+	clear = lambda: shutil.rmtree(env['RUNA_CACHE_DIR'], True)
+	try:
+		for cmd in ('tokens', 'parse'):
+			argv = [sys.executable, '-m', 'runac', cmd, fn]
+			report('%s (tables built)' % cmd, timed(argv, env, setup=clear))
+			report('%s (tables cached)' % cmd, timed(argv, env))
+	finally:
+		shutil.rmtree(tmp, True)
+
+LEXER_SRC = '''# function %i
+def f%i(x: int, s: &Str) -> int:
+	if x > 1 and s == 'abc':
+		return x * 2 + %i
+	
+	return -1
+
+'''
+
+def lexer(args):
+	'''Compare lex() with the rply-based lexer on a large generated source'''
+	
+	sys.path.insert(0, DIR)
+	from runac import parser
+	
+	n = int(args[0]) if args else 20000
+	src = ''.join(LEXER_SRC % (i, i, i) for i in range(n))
+	for name in ('lex_rply', 'lex'):
+		lex, res = getattr(parser, name), []
+		for i in range(3):
+			start = time.time()
+			count = sum(1 for t in lex(src))
+			res.append(time.time() - start)
+		size = len(src) / 1024.0 / 1024
+		report('%s (%.1f MB, %i tokens)' % (name, size, count), sorted(res))
+
+PARSER_SRC = '''def f%i(x: int, s: &Str) -> int:
+	if x > 1 and s == 'abc':
+		return x * 2 + %i
+	while x < 10:
+		x = len(s) + x
+	return x
+
+'''
+
+def parsers(args):
+	'''Compare the LR parser with the hand-written parser on a large
+	generated source (lexing is included; it's also timed on its own)'''
+	
+	sys.path.insert(0, DIR)
+	from runac import parser
+	
+	n = int(args[0]) if args else 5000
+	src = ''.join(PARSER_SRC % (i, i) for i in range(n))
+	tmp = tempfile.mkdtemp()
+	fn = os.path.join(tmp, 'big.rns')
+	with open(fn, 'w') as f:
+		f.write(src)
+	
+	tests = [('lex only', lambda: sum(1 for t in parser.lex(src)))]
+	for kind in parser.PARSERS:
+		tests.append((kind, lambda kind=kind: parser.parse(fn, kind)))
+	
+	parser.build()
+	try:
+		for name, fun in tests:
+			res = []
+			for i in range(3):
+				start = time.time()
+				fun()
+				res.append(time.time() - start)
+			report('%s (%i functions)' % (name, n), sorted(res))
+	finally:
+		shutil.rmtree(tmp, True)
+
+MEMORY_CODE = '''import sys, resource, runac
+if sys.argv[1:]:
+	tree = runac.parse(sys.argv[1])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+def memory(args):
+	'''Peak memory use (RSS) for parsing a large generated source'''
+	
+	lines = int(args[0]) if args else 100000
+	n = lines // PARSER_SRC.count('\n')
+	tmp = tempfile.mkdtemp()
+	fn = os.path.join(tmp, 'big.rns')
+	with open(fn, 'w') as f:
+		f.write(''.join(PARSER_SRC % (i, i) for i in range(n)))
+	
+	runs = [('import only', None, [])]
+	runs += [(kind, kind, [fn]) for kind in ('lr', 'rd')]
+	try:
+		for name, kind, argv in runs:
+			env = dict(os.environ, PYTHONPATH=DIR)
+			if kind is not None:
+				env['RUNA_PARSER'] = kind
+			cmd = [sys.executable, '-c', MEMORY_CODE] + argv
+			peak = int(subprocess.check_output(cmd, env=env))
+			# ru_maxrss is in kB on Linux
+			print('%-30s peak %7.1f MB' % (
+				'%s (%i lines)' % (name, lines), peak / 1024.0
+			))
+	finally:
+		shutil.rmtree(tmp, True)
+
+PIPELINE_CLASS = '''class Range:
+	
+	start: int
+	stop: int
+	
+	def __init__(self, start: int, stop: int):
+		self.start = start
+		self.stop = stop
+	
+	def size(self) -> int:
+		return self.stop - self.start
+
+'''
+
+PIPELINE_SRC = '''def f%i(x: int, y: int) -> int:
+	r = Range(x, y)
+	if x > 1 and y < 10:
+		return r.size() * 2 + %i
+	while x < 10:
+		x = x + y
+	print(r.start)
+	return x
+
+'''
+
+PIPELINE_CODE = '''import sys, time, resource, runac
+from runac import codegen, types, util
+runac.core()
+start = time.time()
+mod = runac.module(sys.argv[1])
+runac.transform(mod)
+codegen.generate(mod)
+elapsed = time.time() - start
+print('%f %i' % (elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+for name in sorted(types.CACHES):
+	print('%s %i %i' % (name, types.STATS[name, 'hit'], types.STATS[name, 'miss']))
+'''
+
+def pipeline(args):
+	'''Time and peak memory use (RSS) for taking a large generated source
+	through the parser, all passes and code generation (also shows hit
+	rates for the type checking caches)'''
+	
+	n = int(args[0]) if args else 2000
+	tmp = tempfile.mkdtemp()
+	fn = os.path.join(tmp, 'big.rns')
+	with open(fn, 'w') as f:
+		f.write(PIPELINE_CLASS)
+		f.write(''.join(PIPELINE_SRC % (i, i) for i in range(n)))
+		f.write('def main():\n\tprint(f%i(1, 2))\n' % (n - 1))
+	
+	env = dict(os.environ, PYTHONPATH=DIR)
+	env['RUNA_CACHE_DIR'] = os.path.join(tmp, 'cache')
+	cmd = [sys.executable, '-c', PIPELINE_CODE, fn]
+	try:
+		res, peak = [], 0
+		for i in range(3):
+			out = subprocess.check_output(cmd, env=env).decode().splitlines()
+			elapsed, rss = out[0].split()
+			res.append(float(elapsed))
+			peak = max(peak, int(rss))
+		
+		report('%i functions' % n, sorted(res))
+		# ru_maxrss is in kB on Linux
+		print('%-30s peak %7.1f MB' % ('%i functions' % n, peak / 1024.0))
+		for line in out[1:]:
+			name, hits, misses = line.split()
+			total = max(int(hits) + int(misses), 1)
+			print('%-30s %7s hits %7s misses (%.1f%% hits)' % (
+				'%s cache' % name, hits, misses, 100.0 * int(hits) / total
+			))
+		
+		# Compare with running the passes after typing separately
+		env['RUNA_NO_FUSE'] = '1'
+		res = []
+		for i in range(3):
+			out = subprocess.check_output(cmd, env=env).decode().splitlines()
+			res.append(float(out[0].split()[0]))
+		report('%i functions, unfused' % n, sorted(res))
+	finally:
+		shutil.rmtree(tmp, True)
+
+BRANCHES_SRC = '''	if a%i > x:
+		a%i = a%i - x
+	else:
+		a%i = a%i + y
+'''
+
+def branches(args):
+	'''Time code generation for a single generated function with thousands
+	of basic blocks (stresses variable origin lookups in the flow graph)'''
+	
+	n = int(args[0]) if args else 1000
+	tmp = tempfile.mkdtemp()
+	fn = os.path.join(tmp, 'branches.rns')
+	with open(fn, 'w') as f:
+		f.write('def f(x: int, y: int) -> int:\n\ta0 = x\n')
+		for i in range(n):
+			f.write(BRANCHES_SRC % (i, i + 1, i, i + 1, i))
+		f.write('\treturn a%i\n\n' % n)
+		f.write('def main():\n\tprint(f(1, 2))\n')
+	
+	env = dict(os.environ, RUNA_NO_CACHE='1')
+	cmd = [sys.executable, '-m', 'runac', 'generate', '--test', fn]
+	try:
+		report('%i branches (~%i blocks)' % (n, 3 * n), timed(cmd, env, n=3))
+	finally:
+		shutil.rmtree(tmp, True)
+
+STEPS_SRC = '''	x = x + y * %i
+	y = x - %i
+'''
+
+def steps(args):
+	'''Time and peak memory use (RSS) for single generated functions with
+	tens of thousands of steps, in one long basic block or spread over
+	thousands of blocks (stresses the flow graph's variable tables)'''
+	
+	n = int(args[0]) if args else 10000
+	tmp = tempfile.mkdtemp()
+	files = []
+	
+	fn = os.path.join(tmp, 'straight.rns')
+	with open(fn, 'w') as f:
+		f.write('def f(x: int, y: int) -> int:\n')
+		f.write(''.join(STEPS_SRC % (i, i) for i in range(n)))
+		f.write('\treturn x\n\ndef main():\n\tprint(f(1, 2))\n')
+	files.append(('1 block, %i steps' % (3 * n), fn))
+	
+	fn = os.path.join(tmp, 'branches.rns')
+	with open(fn, 'w') as f:
+		f.write('def f(x: int, y: int) -> int:\n\ta0 = x\n')
+		for i in range(n // 2):
+			f.write(BRANCHES_SRC % (i, i + 1, i, i + 1, i))
+		f.write('\treturn a%i\n\ndef main():\n\tprint(f(1, 2))\n' % (n // 2))
+	files.append(('%i blocks, %i steps' % (3 * (n // 2), 3 * n), fn))
+	
+	env = dict(os.environ, PYTHONPATH=DIR, RUNA_NO_CACHE='1')
+	try:
+		for name, fn in files:
+			res, peak = [], 0
+			for i in range(3):
+				cmd = [sys.executable, '-c', PIPELINE_CODE, fn]
+				out = subprocess.check_output(cmd, env=env).decode().split()
+				res.append(float(out[0]))
+				peak = max(peak, int(out[1]))
+			report(name, sorted(res))
+			# ru_maxrss is in kB on Linux
+			print('%-30s peak %7.1f MB' % (name, peak / 1024.0))
+	finally:
+		shutil.rmtree(tmp, True)
+
+def batch(args):
+	'''Compare batch compilation of the test suite with 1 and N jobs'''
+	
+	files = sorted(os.listdir(os.path.join(DIR, 'tests')))
+	files = [os.path.join('tests', fn) for fn in files if fn.endswith('.rns')]
+	files = [os.path.join(DIR, fn) for fn in files]
+	tmp = tempfile.mkdtemp()
+	env = dict(os.environ, PYTHONPATH=DIR)
+	try:
+		for jobs in sorted({1, int(args[0]) if args else cpu_count()}):
+			
+			# Failing programs make the build command exit with 1
+			argv = [sys.executable, '-m', 'runac', 'build', '-j', str(jobs)]
+			res = []
+			for i in range(3):
+				start = time.time()
+				with open(os.devnull, 'w') as null:
+					opts = {'stdout': null, 'stderr': null}
+					subprocess.call(argv + files, cwd=tmp, env=env, **opts)
+				res.append(time.time() - start)
+			
+			report('build -j %i (%i files)' % (jobs, len(files)), sorted(res))
+	
+	finally:
+		shutil.rmtree(tmp, True)
+
+def runtime(args):
+	'''Compare run time and size of the test programs at each optimization
+	level, with separately compiled and whole-program builds'''
+	
+	sys.path.insert(0, DIR)
+	import runac
+	
+	tests = os.path.join(DIR, 'tests')
+	files = []
+	for fn in sorted(os.listdir(tests)):
+		base = os.path.join(tests, fn[:-4])
+		if not fn.endswith('.rns') or not os.path.exists(base + '.out'):
+			continue
+		with open(base + '.rns') as f:
+			if f.readline().startswith('# test: '):
+				continue # may need arguments or fail on purpose
+		files.append(base + '.rns')
+	
+	levels = args or runac.OPT_LEVELS
+	tmp = tempfile.mkdtemp()
+	try:
+		for opt, whole in ((o, w) for o in levels for w in (False, True)):
+			
+			dir = os.path.join(tmp, opt + ('w' if whole else ''))
+			os.mkdir(dir)
+			res = runac.compile_many(files, dir=dir, opt=opt, whole=whole)
+			bins = []
+			for fn, elapsed, error in res:
+				bin = os.path.join(dir, os.path.basename(fn)[:-4])
+				if error is None:
+					bins.append(bin)
+			
+			size = sum(os.path.getsize(fn) for fn in bins)
+			timings = [0.0] * 5
+			for bin in bins:
+				for i, t in enumerate(timed([bin], n=len(timings))):
+					timings[i] += t
+			
+			name = '-O%s%s (%i programs, %i kB)' % (
+				opt, ' whole' if whole else '', len(bins), size // 1024
+			)
+			report(name, timings)
+	
+	finally:
+		shutil.rmtree(tmp, True)
+
+def incremental(args):
+	'''Time code generation for a large file after changing one function'''
+	
+	n = int(args[0]) if args else 5000
+	fun = 'def f%i(x: int) -> int:\n\treturn x + %i\n\n'
+	main = 'def main():\n\tprint(f%i(1))\n' % (n - 1)
+	
+	tmp = tempfile.mkdtemp()
+	fn = os.path.join(tmp, 'big.rns')
+	def write(edit):
+		with open(fn, 'w') as f:
+			for i in range(n):
+				f.write(fun % (i, i + 1 if i == edit else i))
+			f.write(main)
+	
+	env = dict(os.environ, RUNA_CACHE_DIR=os.path.join(tmp, 'cache'))
+	cmd = [sys.executable, '-m', 'runac', 'generate', '--test', fn]
+	try:
+		
+		write(None)
+		report('%i functions, no cache' % n, timed(cmd, env, n=1, setup=lambda: (
+			shutil.rmtree(env['RUNA_CACHE_DIR'], True)
+		)))
+		timed(cmd, env, n=1)
+		report('%i functions, unchanged' % n, timed(cmd, env, n=3))
+		
+		edits = iter(range(n // 2, n))
+		setup = lambda: write(next(edits))
+		report('%i functions, one changed' % n, timed(cmd, env, 3, setup))
+		
+		nocache = dict(env, RUNA_NO_CACHE='1')
+		report('%i functions, cache disabled' % n, timed(cmd, nocache, n=1))
+	
+	finally:
+		shutil.rmtree(tmp, True)
+
+BENCHMARKS = {
+	'startup': startup,
+	'commands': commands,
+	'parser': parser,
+	'lexer': lexer,
+	'parsers': parsers,
+	'memory': memory,
+	'pipeline': pipeline,
+	'branches': branches,
+	'steps': steps,
+	'batch': batch,
+	'runtime': runtime,
+	'incremental': incremental,
+}
+
+if __name__ == '__main__':
+	names = sys.argv[1:2] or sorted(BENCHMARKS)
+	for name in names:
+		print('%s: %s' % (name, BENCHMARKS[name].__doc__))
+		BENCHMARKS[name](sys.argv[2:])
+		print()
@@ -45,7 +45,7 @@ def get_rules():
 def get_tokens():
 	
 	tokens = {'INDENT': 'INDENT', 'DEDENT': 'DEDENT'}
-	for rule in parser.LEXER.rules:
+	for rule in parser.lexer().rules:
 		name, pattern = rule.name, rule.re.pattern
 		tokens[rule.name] = rule.re.pattern
 	
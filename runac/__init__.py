@@ -1,9 +1,11 @@
 from __future__ import print_function
 from . import (
-	parser, blocks, liveness, typer, specialize,
-	escapes, destructor, codegen, util, pretty
+	ast, parser, blocks, liveness, typer, specialize, escapes, destructor,
+	codegen, util, pretty, types, cache, incremental, interface, fusion,
+	streaming
 )
-import os, subprocess, collections, re
+import os, subprocess, collections, re, shutil, tempfile, time
+import multiprocessing
 
 PASSES = collections.OrderedDict((
 	('liveness', liveness.liveness),
@@ -21,21 +23,170 @@ def parse(fn):
 	'''Takes a string containing file name, returns an AST File node'''
 	return parser.parse(fn)
 
+def transform(mod, last=None):
+	'''Applies the passes from PASSES to the module `mod`, in order,
+	stopping after the pass named `last` (if given). If all passes run,
+	the passes after type checking run together, one function at a time
+	(see fusion.py).'''
+	fused = fusion.enabled() and last in (None, fusion.PASSES[-1])
+	for name, fun in util.items(PASSES):
+		if fused and name == fusion.PASSES[0]:
+			fusion.fuse(mod)
+			break
+		fun(mod)
+		if name == last:
+			break
+
 def _core():
 	fn = os.path.join(util.CORE_DIR, '__builtins__.rns')
 	base = {t.__name__: t() for t in types.BASE}
 	mod = blocks.Module('Runa.core', parse(fn), base)
-	for name, fun in util.items(PASSES):
-		fun(mod)
+	transform(mod)
 	return mod
 
-CORE = _core()
+def _corekey():
+	'''Cache key for the core module: covers the core library sources,
+	the compiler itself and the target platform.'''
+	files = [os.path.join(util.CORE_DIR, fn) for fn in CORE_FILES]
+	return cache.digest(files + cache.sources(), codegen.triple())
+
+CORE_FILES = '__builtins__.rns', 'rt.ll'
+CORE = None
+CORE_IR = None
+RT_IR = None
+
+def core():
+	'''Returns the typed core module. It is initialized on first use, from
+	the on-disk cache if possible; otherwise it is built from source and
+	saved for later use.'''
+	
+	global CORE
+	if CORE is not None:
+		return CORE
+	
+	key = _corekey()
+	data = cache.load('core', key)
+	if data is not None:
+		types.restore(data['types'])
+		CORE = data['core']
+		return CORE
+	
+	CORE = _core()
+	cache.store('core', key, {'core': CORE, 'types': types.state()})
+	return CORE
+
+def core_ir():
+	'''Returns a tuple of LLVM IR for the core module and the rt library,
+	initializing them (from the cache, where possible) on first use.'''
+	
+	global CORE_IR, RT_IR
+	if CORE_IR is not None:
+		return CORE_IR, RT_IR
+	
+	key = _corekey()
+	data = cache.load('core-ir', key)
+	if data is None:
+		data = codegen.generate(core()), codegen.rt()
+		cache.store('core-ir', key, data)
+	
+	CORE_IR, RT_IR = data
+	return CORE_IR, RT_IR
+
+def imports(node):
+	'''Returns a list of (module name, RelImport node) tuples for imports
+	from other Runa modules (rather than from the declarations in typer.ROOT)
+	in the parsed file `node`.'''
+	res = []
+	for n in node.suite:
+		if isinstance(n, ast.RelImport):
+			name = blocks.dotted(n.base)
+			if name.split('.')[0] not in typer.ROOT.attribs:
+				res.append((name, n))
+	return res
 
-def module(path, name='Runa.__main__'):
-	'''Takes a file (or directory, at some point), returns a Module containing
-	declarations and code objects, to be submitted for further processing.'''
+class Loader(object):
+	'''Loads the modules imported by a program, compiling them if necessary
+	(see interface.py). Modules are searched for in the directory `root`.
+	After loading, `done` maps module names to dicts containing the
+	interface, the IR and the interface digests for the dependencies,
+	in dependency order. Modules are built one at a time, as their imports
+	are resolved; the functions within a module can still be generated in
+	parallel (see parallel.py).'''
+	
+	def __init__(self, root):
+		self.root = root
+		self.done = collections.OrderedDict()
+		self.active = []
+	
+	def path(self, name):
+		return os.path.join(self.root, *name.split('.')) + '.rns'
+	
+	def scope(self, node):
+		'''Returns the parent scope for a module from its syntax tree.'''
+		res = []
+		for name, n in imports(node):
+			res.append((n, self.load(name, n)['interface']))
+		return interface.scope(core().scope, res) if res else core().scope
+	
+	def load(self, name, node):
+		
+		if name in self.done:
+			return self.done[name]
+		elif name in self.active:
+			raise util.Error(node, "circular import of module '%s'" % name)
+		elif name in interface.RESERVED:
+			raise util.Error(node, "module name '%s' is reserved" % name)
+		
+		fn = self.path(name)
+		if not os.path.exists(fn):
+			raise util.Error(node, "module '%s' not found" % name)
+		
+		key = cache.digest([fn], _corekey(), name)
+		known = interface.known(core().scope)
+		self.active.append(name)
+		try:
+			entry = cache.load('module', key, known)
+			if entry is None or not self.valid(entry):
+				entry = self.build(name, fn)
+				cache.store('module', key, entry, known)
+		finally:
+			self.active.pop()
+		
+		self.done[name] = entry
+		return entry
+	
+	def valid(self, entry):
+		'''Check that a cached module's dependencies have not changed.'''
+		for name, digest in util.items(entry['deps']):
+			if name in self.active or not os.path.exists(self.path(name)):
+				return False
+			if self.load(name, None)['interface'].digest != digest:
+				return False
+		return True
+	
+	def build(self, name, fn):
+		
+		node = parser.parse(fn)
+		mod = blocks.Module('Runa.' + name, node, self.scope(node))
+		transform(mod)
+		
+		deps = {k: self.done[k]['interface'].digest for k, n in imports(node)}
+		ir = codegen.generate(mod)
+		return {
+			'interface': interface.summarize(name, mod, core().scope),
+			'ir': ir,
+			'deps': deps,
+		}
+
+def module(path, name='Runa.__main__', loader=None):
+	'''Takes a file name, returns a Module containing declarations and code
+	objects, to be submitted for further processing. Any Runa modules it
+	imports are loaded with `loader` (or a new Loader).'''
 	assert not os.path.isdir(path), path
-	return blocks.Module(name, parser.parse(path), CORE.scope)
+	node = parser.parse(path)
+	if loader is None:
+		loader = Loader(os.path.dirname(os.path.abspath(path)))
+	return blocks.Module(name, node, loader.scope(node))
 
 def show(fn, last):
 	'''Show Runa high-level intermediate representation for the source code
@@ -46,10 +197,7 @@ def show(fn, last):
 	Functions from modules other than the given module are ignored.'''
 	
 	mod = module(fn)
-	for name, fun in util.items(PASSES):
-		fun(mod)
-		if name == last:
-			break
+	transform(mod, last)
 	
 	data = []
 	for name, code in mod.code:
@@ -57,68 +205,354 @@ def show(fn, last):
 	
 	return data
 
-def ir(fn):
+def _ir(fn, loader=None, jobs=None):
+	'''Implementation for ir(), returns a tuple of the IR and a list of
+	names of code objects that were processed (rather than taken from
+	the cache). Imported modules are loaded with `loader`, if given.'''
+	
+	if loader is None:
+		loader = Loader(os.path.dirname(os.path.abspath(fn)))
+	
+	jobs = jobs or 1
+	if cache.directory() is None and jobs > 1:
+		mod = module(fn, loader=loader)
+		res, new, dirty = incremental.generate(mod, {}, {}, jobs)
+		return res, dirty
+	elif cache.directory() is None:
+		mod = module(fn, loader=loader)
+		transform(mod)
+		return codegen.generate(mod), [k for (k, v) in mod.code]
+	
+	# Keys for unchanged functions must change with the interfaces
+	# of the modules they import from.
+	
+	name = 'Runa.__main__'
+	node = parser.parse(fn)
+	scope = loader.scope(node)
+	extra = [_corekey()]
+	for k in sorted(n for (n, imp) in imports(node)):
+		extra.append(loader.done[k]['interface'].digest)
+	
+	keys = incremental.keys(name, node, ' '.join(extra))
+	mod = blocks.Module(name, node, scope)
+	
+	index = cache.digest([], os.path.abspath(fn))
+	entries = cache.load('functions', index) or {}
+	res, new, dirty = incremental.generate(mod, keys, entries, jobs)
+	if new != entries:
+		cache.store('functions', index, new)
+	return res, dirty
+
+def ir(fn, jobs=None):
 	'''Generate LLVM IR for the given module. Takes a string file name and
-	returns a string of LLVM IR, for the host architecture.'''
-	mod = module(fn)
-	for name, fun in util.items(PASSES):
-		fun(mod)
-	return codegen.generate(mod)
+	returns a string of LLVM IR, for the host architecture. Functions that
+	have not changed since the last time this file was compiled are not
+	processed again (see incremental.py); the others are processed in
+	`jobs` worker processes if more than one is given (see parallel.py).'''
+	return _ir(fn, jobs=jobs)[0]
 
-CORE_IR = codegen.generate(CORE)
-RT_IR = codegen.rt()
+def stream(fn, out):
+	'''Generate LLVM IR for the given module, like ir(), but process it one
+	function at a time, writing the IR to the file object `out` (see
+	streaming.py). Uses less memory for large modules, but does not use
+	or update the cache for unchanged functions.'''
+	node = parser.parse(fn)
+	loader = Loader(os.path.dirname(os.path.abspath(fn)))
+	mod = blocks.Module('Runa.__main__', node, loader.scope(node), True)
+	streaming.run(mod, out)
 
-def compile(fn, outfn):
-	'''Compiles LLVM IR into a binary. Takes a string file name and a string
-	output file name. Writes IR to a temporary file for the main module as
-	well as personality, rt, and builtins modules, then calls clang on them.
-	(Fix me: shelling out to clang is pretty inefficient.)'''
+RT_SOURCES = 'personality.c', 'unwind.h'
+
+# Optimization levels, passed on to clang as -O<level>. The release profile
+# is used by default; the debug profile disables all optimizations.
+
+OPT_LEVELS = '0', '1', '2', '3', 's'
+PROFILES = {'debug': '0', 'release': '2'}
+RELEASE = PROFILES['release']
+MSVC_OPT = {'0': '/Od', '1': '/O2', '2': '/O2', '3': '/Ox', 's': '/O1'}
+
+def _clang(triple, opt):
+	'''Returns the base clang command line for the given target triple and
+	optimization level.'''
+	if opt not in OPT_LEVELS:
+		raise ValueError('invalid optimization level %r' % opt)
+	if 'windows-msvc' in triple:
+		return ['clang-cl', '-m64', MSVC_OPT[opt]]
+	bits = '-m64' if triple.split('-')[0] == 'x86_64' else '-m32'
+	return ['clang', bits, '-O' + opt]
+
+def _call(cmd):
+	'''Runs an external tool. If the tool can't be found, the resulting
+	OSError has the tool's name in its filename attribute.'''
+	try:
+		subprocess.check_call(cmd)
+	except OSError as e:
+		if e.errno == 2:
+			e.filename = cmd[0]
+		raise
+
+def _object(src, obj, triple, opt):
+	'''Compiles a single source file (C or LLVM IR) to object code.'''
+	if 'windows-msvc' in triple:
+		_call(_clang(triple, opt) + ['/c', src, '/Fo' + obj])
+	else:
+		_call(_clang(triple, opt) + ['-c', src, '-o', obj])
+
+def runtime(tmp, opt=RELEASE):
+	'''Returns a list of files with compiled code for the run-time support
+	code that every program links against: the personality function, the rt
+	library and the core library. These are compiled only once, into a static
+	archive (or a set of object files, for MSVC) kept in the cache directory
+	and keyed on the sources, the target triple and the optimization level
+	`opt`. Intermediate files go into the scratch directory `tmp`; if the
+	cache is disabled, the results are left there as well.'''
+	
+	triple = codegen.triple()
+	msvc = 'windows-msvc' in triple
+	names = ['personality', 'rt', 'builtins']
+	ext = 'obj' if msvc else 'o'
 	
-	with open('builtins.ll', 'w') as f:
-		f.write(CORE_IR.encode('ascii'))
+	files = [os.path.join(util.CORE_DIR, fn) for fn in RT_SOURCES]
+	key = cache.digest(files, _corekey(), triple, opt)
+	if msvc:
+		dst = [cache.path('runa-' + n, key, ext) for n in names]
+	else:
+		dst = [cache.path('libruna', key, 'a')]
 	
-	# Write LLVM IR for main module to a file, making sure that the file
-	# is cleaned up if an error occurs during code generation.
+	if dst[0] is not None and all(os.path.exists(fn) for fn in dst):
+		return dst
 	
-	name = os.path.basename(fn).rsplit('.rns')[0]
-	mod_fn = name + '.ll'
-	with open(mod_fn, 'w') as f:
-		try:
-			f.write(ir(fn).encode('ascii'))
-		except Exception:
-			os.unlink(mod_fn)
-			raise
+	# Write IR for the rt and core libraries to the scratch directory, then
+	# compile those and the personality function to object code.
+	
+	builtins, rt = core_ir()
+	with open(os.path.join(tmp, 'builtins.ll'), 'w') as f:
+		f.write(builtins.encode('ascii'))
+	with open(os.path.join(tmp, 'rt.ll'), 'w') as f:
+		f.write(rt)
 	
-	# Write LLVM IR for rt library
+	srcs = [files[0]] + [os.path.join(tmp, n + '.ll') for n in names[1:]]
+	objs = [os.path.join(tmp, '%s.%s' % (n, ext)) for n in names]
+	for src, obj in zip(srcs, objs):
+		_object(src, obj, triple, opt)
 	
-	with open('rt.ll', 'w') as f:
-		f.write(RT_IR)
+	if not msvc:
+		lib = os.path.join(tmp, 'libruna.a')
+		_call(['ar', 'rcs', lib] + objs)
+		objs = [lib]
 	
-	# Prepare clang command for compiling, depending on platform
+	if dst[0] is None:
+		return objs
+	
+	for src, fn in zip(objs, dst):
+		with open(src, 'rb') as f:
+			cache.write(fn, f.read())
+	
+	# Fall back to the scratch files if the cache couldn't be written
+	return dst if all(os.path.exists(fn) for fn in dst) else objs
+
+def modules(loader, tmp, opt=RELEASE):
+	'''Returns a list of object files for the modules loaded by `loader`
+	(see Loader). Object code is cached by the hash of the module's IR, so
+	a module is only compiled again after it changes. Intermediate files go
+	into the scratch directory `tmp`.'''
 	
-	eh_fn = os.path.join(util.CORE_DIR, 'personality.c')
-	files = eh_fn, 'rt.ll', 'builtins.ll', mod_fn
 	triple = codegen.triple()
-	if 'windows-msvc' in triple:
-		cmd = ['clang-cl', '-Fe' + outfn, '-m64'] + files
-		cmd += ['/link', 'msvcrt.lib']
-	else:
-		cmd = ['clang', '-o', outfn]
-		cmd.append('-m64' if triple.split('-')[0] == 'x86_64' else '-m32')
-		cmd += files
+	ext = 'obj' if 'windows-msvc' in triple else 'o'
+	res = []
+	for name, entry in util.items(loader.done):
+		
+		key = cache.digest([], entry['ir'], triple, opt)
+		dst = cache.path('object', key, ext)
+		if dst is not None and os.path.exists(dst):
+			res.append(dst)
+			continue
+		
+		src = os.path.join(tmp, name + '.ll')
+		with open(src, 'w') as f:
+			f.write(entry['ir'].encode('ascii'))
+		obj = os.path.join(tmp, '%s.%s' % (name, ext))
+		_object(src, obj, triple, opt)
+		
+		if dst is not None:
+			with open(obj, 'rb') as f:
+				cache.write(dst, f.read())
+		res.append(dst if dst is not None and os.path.exists(dst) else obj)
+	
+	return res
+
+def _compile(fn, outfn, opt=RELEASE, whole=False, rt=None, jobs=None):
+	'''Compiles the program in `fn` to a binary in `outfn` at optimization
+	level `opt`, raising exceptions for any errors. `rt` may be used to pass
+	in the files returned by an earlier runtime() call. Modules imported by
+	the program are compiled separately and linked in (see modules()).
 	
-	# Execute clang, cleaning up as necessary
+	If `whole` is set, the IR for the program is linked together with the
+	IR for the core and rt libraries into a single module by llvm-link,
+	internalizing all symbols from the libraries. This allows LLVM to inline
+	library code into the program and strip any unused library code. The
+	run-time library is then only used for the personality function.
+	The main module is generated in `jobs` worker processes (see ir()).'''
 	
+	triple = codegen.triple()
+	tmp = tempfile.mkdtemp(prefix='runa-')
 	try:
-		subprocess.check_call(cmd)
+		
+		# Write LLVM IR for main module to the scratch directory
+		
+		name = os.path.basename(fn).rsplit('.rns')[0]
+		mod_fn = os.path.join(tmp, name + '.ll')
+		loader = Loader(os.path.dirname(os.path.abspath(fn)))
+		with open(mod_fn, 'w') as f:
+			f.write(_ir(fn, loader, jobs)[0].encode('ascii'))
+		
+		# Execute clang; the run-time library gets its own directory so
+		# that its files can't clash with the main module's name.
+		
+		rt_dir = os.path.join(tmp, 'rt')
+		os.mkdir(rt_dir)
+		if rt is None:
+			rt = runtime(rt_dir, opt)
+		
+		# Imported modules also get their own directory, for the same reason
+		
+		mod_dir = os.path.join(tmp, 'modules')
+		os.mkdir(mod_dir)
+		if whole:
+			
+			srcs = [mod_fn]
+			for dep, entry in util.items(loader.done):
+				srcs.append(os.path.join(mod_dir, dep + '.ll'))
+				with open(srcs[-1], 'w') as f:
+					f.write(entry['ir'].encode('ascii'))
+			
+			libs = [os.path.join(rt_dir, n) for n in ('builtins.ll', 'rt.ll')]
+			for lib_fn, code in zip(libs, core_ir()):
+				with open(lib_fn, 'w') as f:
+					f.write(code.encode('ascii'))
+			
+			mod_fn = os.path.join(tmp, name + '.bc')
+			_call(['llvm-link', '--internalize', '-o', mod_fn] + srcs + libs)
+			deps = []
+		
+		else:
+			deps = modules(loader, mod_dir, opt)
+		
+		files = [mod_fn] + deps + rt
+		if 'windows-msvc' in triple:
+			cmd = _clang(triple, opt) + ['-Fe' + outfn] + files
+			cmd += ['/link', 'msvcrt.lib']
+		else:
+			cmd = _clang(triple, opt) + ['-o', outfn] + files
+		
+		_call(cmd)
+	
+	finally:
+		shutil.rmtree(tmp, True)
+
+def compile(fn, outfn, opt=RELEASE, whole=False, jobs=None):
+	'''Compiles LLVM IR into a binary. Takes a string file name, a string
+	output file name, an optimization level (one of OPT_LEVELS, defaulting
+	to the release profile), a flag for whole-program compilation and the
+	number of worker processes for code generation (see _compile()). Writes
+	IR for the main module to a private scratch directory, then calls clang
+	to compile it and link it against the prebuilt run-time library (see
+	runtime()). Since nothing is written to the current directory except
+	for the output file, any number of compilations can safely run
+	concurrently. Returns False if one of the external tools failed.
+	(Fix me: shelling out to clang is pretty inefficient.)'''
+	try:
+		_compile(fn, outfn, opt, whole, jobs=jobs)
 	except OSError as e:
 		if e.errno == 2:
-			print('error: clang not found')
-		else:
-			raise
+			print('error: %s not found' % (e.filename or 'clang'))
+			return False
+		raise
 	except subprocess.CalledProcessError:
-		pass
+		return False
+	return True
+
+def _build(args):
+	'''Worker function for compile_many(). Returns a tuple of the source
+	file name, the time taken in seconds and an error message (or None).'''
+	
+	fn, outfn, opt, whole, rt = args
+	start = time.time()
+	try:
+		_compile(fn, outfn, opt, whole, rt)
+		msg = None
+	except (util.Error, util.ParseError) as e:
+		msg = e.show()
+	except OSError as e:
+		if e.errno == 2:
+			msg = '%s not found\n' % (e.filename or 'clang')
+		else:
+			msg = '%s\n' % e
+	except subprocess.CalledProcessError as e:
+		tool = os.path.basename(e.cmd[0])
+		msg = '%s failed with exit status %i\n' % (tool, e.returncode)
+	except Exception as e:
+		msg = 'internal error: %s: %s\n' % (e.__class__.__name__, e)
+	
+	return fn, time.time() - start, msg
+
+def compile_many(paths, jobs=None, dir=None, opt=RELEASE, whole=False):
+	'''Compiles a batch of programs. Takes a list of file names, the number
+	of worker processes to use (defaults to the number of CPUs), a directory
+	for the binaries (defaults to the current directory; each binary is named
+	after its source file), an optimization level and a flag for
+	whole-program compilation.
+	
+	The parser, the core module, its IR and the run-time library are set up
+	before the worker pool is started, so that (where processes are forked)
+	the workers share that state instead of each building it again. Parsing,
+	type checking, code generation and the clang invocations for different
+	files then all run concurrently. Returns a list of (file name, seconds,
+	error message or None) tuples, in the order of `paths`. Programs that
+	would be written to the same binary fail without being compiled.'''
+	
+	if jobs is None:
+		jobs = multiprocessing.cpu_count()
+	
+	outputs = []
+	for fn in paths:
+		outfn = os.path.basename(fn).rsplit('.rns')[0]
+		outputs.append(os.path.join(dir or '.', outfn))
+	
+	res, seen = [None] * len(paths), collections.Counter(outputs)
+	for i, (fn, outfn) in enumerate(zip(paths, outputs)):
+		if seen[outfn] > 1:
+			msg = '%s: output file %s would be written by several programs\n'
+			res[i] = fn, 0.0, msg % (fn, outfn)
+	
+	todo = [i for i, r in enumerate(res) if r is None]
+	if not todo:
+		return res
+	
+	parser.build()
+	core_ir()
+	tmp = tempfile.mkdtemp(prefix='runa-')
+	try:
+		
+		try:
+			rt = runtime(tmp, opt)
+		except (OSError, subprocess.CalledProcessError):
+			rt = None # let each worker report the problem
+		
+		work = [(paths[i], outputs[i], opt, whole, rt) for i in todo]
+		if jobs < 2 or len(work) < 2:
+			built = [_build(args) for args in work]
+		else:
+			pool = multiprocessing.Pool(min(jobs, len(work)))
+			try:
+				built = pool.map(_build, work, 1)
+			finally:
+				pool.terminate()
+				pool.join()
+		
+		for i, r in zip(todo, built):
+			res[i] = r
+		return res
+	
 	finally:
-		os.unlink('rt.ll')
-		os.unlink('builtins.ll')
-		os.unlink(mod_fn)
+		shutil.rmtree(tmp, True)
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
 from __future__ import print_function
-import optparse, sys, os
-from runac import util
+import optparse, sys, os, time
+from runac import util, server, timing
 import runac
 
 def tokens(fn, opts):
@@ -23,7 +23,17 @@ def show(fn, opts):
 def generate(fn, opts):
 	'''Print LLVM IR as generated by the code generation process'''
 	
-	ir = runac.ir(fn)
+	if opts.stream and opts.outfile is None:
+		runac.stream(fn, sys.stdout)
+		print()
+		return
+	elif opts.stream:
+		with open(opts.outfile, 'w') as f:
+			runac.stream(fn, f)
+			print(file=f)
+		return
+	
+	ir = runac.ir(fn, opts.jobs)
 	if opts.test:
 		return
 	
@@ -37,7 +47,31 @@ def generate(fn, opts):
 def compile(fn, opts):
 	'''Compile the given program to a binary of the same name'''
 	outfn = os.path.basename(fn).rsplit('.rns')[0]
-	runac.compile(fn, outfn if opts.outfile is None else opts.outfile)
+	outfn = outfn if opts.outfile is None else opts.outfile
+	if not runac.compile(fn, outfn, opts.opt, opts.whole, opts.jobs):
+		sys.exit(1)
+
+def build(files, opts):
+	'''Compile any number of programs in parallel (see --jobs)'''
+	
+	start, failed = time.time(), 0
+	res = runac.compile_many(files, opts.jobs, None, opts.opt, opts.whole)
+	for fn, elapsed, error in res:
+		status = 'ok' if error is None else 'FAILED'
+		print('%-40s %8.1f ms  %s' % (fn, elapsed * 1000, status))
+		if error is not None:
+			sys.stderr.write(error)
+			failed += 1
+	
+	print('built %i files in %.2f s, %i failed' % (
+		len(files), time.time() - start, failed
+	))
+	if failed:
+		sys.exit(1)
+
+def serve(args, opts):
+	'''Run a compiler server, optionally taking a socket path (see runa)'''
+	server.serve(args[0] if args else None)
 
 COMMANDS = {
 	'tokens': tokens,
@@ -45,8 +79,28 @@ COMMANDS = {
 	'show': show,
 	'generate': generate,
 	'compile': compile,
+	'build': build,
+	'serve': serve,
 }
 
+MULTI = {build, serve}
+
+def run(cmd, arg, opts):
+	'''Run a command, reporting the time taken by each phase of the
+	compiler if --time-passes or --trace was given (see timing.py)'''
+	
+	if not opts.time_passes and opts.trace is None:
+		return cmd(arg, opts)
+	
+	with timing.Timer() as timer:
+		try:
+			cmd(arg, opts)
+		finally:
+			if opts.time_passes:
+				sys.stderr.write('\n'.join(timer.report()) + '\n')
+			if opts.trace is not None:
+				timer.trace(opts.trace)
+
 def find(cmd):
 	if cmd in COMMANDS: return COMMANDS[cmd]
 	matched = sorted(i for i in COMMANDS if i.startswith(cmd))
@@ -59,19 +113,46 @@ def find(cmd):
 		print('no command found: %r' % cmd)
 		return lambda x, y: None
 
-if __name__ == '__main__':
+def main(argv):
+	'''Run the compiler driver with the given command line arguments'''
 	
 	parser = optparse.OptionParser()
 	
 	parser.add_option('--last', help='last pass', default='destruct')
 	parser.add_option('-o', '--outfile', help='output file', dest='outfile')
 	parser.add_option('--test', help='no output', action='store_true')
+	parser.add_option('--stream', help='generate IR one function at a time '
+	                  'to save memory', action='store_true')
+	parser.add_option('-O', help='optimization level (%s; default %s)' % (
+		'/'.join(runac.OPT_LEVELS), runac.RELEASE
+	), type='choice', choices=runac.OPT_LEVELS, dest='opt')
+	parser.add_option('--profile', help='build profile (%s)' % (
+		'/'.join(sorted(runac.PROFILES))
+	), type='choice', choices=sorted(runac.PROFILES), default='release')
+	parser.add_option('--whole-program', help='link core library into '
+	                  'the program as a single module', action='store_true',
+	                  dest='whole')
+	parser.add_option('-j', '--jobs', help='number of parallel jobs',
+	                  type='int', dest='jobs')
 	parser.add_option('--traceback', help='show full traceback',
 	                  action='store_true')
-	opts, args = parser.parse_args()
+	parser.add_option('--parser', help='parser implementation (%s; '
+	                  'default lr, or RUNA_PARSER)' % (
+		'/'.join(runac.parser.PARSERS)
+	), type='choice', choices=runac.parser.PARSERS)
+	parser.add_option('--time-passes', help='report time, memory and sizes '
+	                  'for each compiler phase', action='store_true')
+	parser.add_option('--trace', help='write a Chrome trace of the compiler '
+	                  'phases to the given file')
+	opts, args = parser.parse_args(argv)
+	if opts.opt is None:
+		opts.opt = runac.PROFILES[opts.profile]
+	if opts.parser is not None:
+		os.environ['RUNA_PARSER'] = opts.parser
 	
 	if len(args) < 1:
-		print('The Runa compiler. A command takes a single file as an argument.')
+		print('The Runa compiler. A command takes a single file as an argument')
+		print('(build takes any number of files, serve an optional socket path).')
 		print('\nCommands:\n')
 		for cmd, fun in sorted(COMMANDS.items()):
 			print('%s: %s' % (cmd, fun.__doc__))
@@ -80,7 +161,8 @@ if __name__ == '__main__':
 		sys.exit(1)
 	
 	try:
-		find(args[0])(args[1], opts)
+		cmd = find(args[0])
+		run(cmd, args[1:] if cmd in MULTI else args[1], opts)
 	except util.Error as e:
 		if opts.traceback:
 			raise
@@ -89,3 +171,6 @@ if __name__ == '__main__':
 		if opts.traceback:
 			raise
 		sys.stderr.write(e.show())
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
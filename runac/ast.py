@@ -4,6 +4,13 @@ All classes have a `pos` field containing location information. It can be
 None in nodes that have been inserted by the compiler. Classes should have
 a `fields` attribute containing a sequence of properties that either contain
 another AST node or a list of AST nodes, so we can walk the tree somehow.
+Any other attributes (set by the parser or by later passes) are listed in
+`extra`; node classes use `__slots__` derived from these two, so setting
+any attribute not listed in either is an error.
+
+The ``walk()`` function iterates over a tree using the `fields`, and the
+passes walking the tree derive from ``Visitor``, which dispatches on the
+class of each node through a table built once per visitor class.
 
 Some node types are defined in other modules:
 
@@ -16,26 +23,42 @@ For files containing source code, a File node is at the root of the tree.
 '''
 
 from . import util
+import collections
 
 # Base class
 
 IGNORE = {'pos'}
 
 class Registry(type):
+	'''Metaclass for syntax tree nodes: keeps a list of all node classes,
+	and gives each a `__slots__` layout with any of its `fields` and `extra`
+	attributes that are not already in a base class.'''
+	
 	types = []
+	
+	def __new__(meta, name, bases, dict):
+		if '__slots__' not in dict:
+			have = {k for b in bases for k in util.slots(b)}
+			new = []
+			own = dict.get('fields', ()), dict.get('extra', ())
+			for k in util.names(own[0]) + util.names(own[1]):
+				if k not in have and k not in new:
+					new.append(k)
+			dict['__slots__'] = tuple(new)
+		return type.__new__(meta, name, bases, dict)
+	
 	def __init__(cls, name, bases, dict):
 		Registry.types.append(cls)
 
 class Node(util.AttribRepr):
 	__metaclass__ = Registry
+	extra = 'pos',
 	def __init__(self, pos):
 		self.pos = pos
-	def __hash__(self):
-		values = tuple(sorted((k, v) for (k, v) in util.items(self.__dict__)))
-		return hash((self.__class__.__name__,) + values)
 
 class Expr(Node):
 	fields = ()
+	extra = 'type', 'escapes'
 	def __init__(self, pos):
 		Node.__init__(self, pos)
 		self.type = None
@@ -45,26 +68,31 @@ class NoneVal(Expr):
 	pass
 
 class Bool(Expr):
+	extra = 'val',
 	def __init__(self, val, pos):
 		Expr.__init__(self, pos)
 		self.val = True if val == 'True' else False
 
 class Int(Expr):
+	extra = 'val',
 	def __init__(self, num, pos):
 		Expr.__init__(self, pos)
 		self.val = num
 
 class Float(Expr):
+	extra = 'val',
 	def __init__(self, num, pos):
 		Expr.__init__(self, pos)
 		self.val = num
 
 class String(Expr):
+	extra = 'val',
 	def __init__(self, value, pos):
 		Expr.__init__(self, pos)
 		self.val = value
 
 class Name(Expr):
+	extra = 'name',
 	def __init__(self, name, pos):
 		Expr.__init__(self, pos)
 		self.name = name
@@ -73,6 +101,7 @@ class Name(Expr):
 
 class Attrib(Expr):
 	fields = 'obj',
+	extra = 'attrib',
 
 class Elem(Expr):
 	fields = 'obj', 'key'
@@ -142,15 +171,18 @@ class GT(Expr):
 
 class As(Expr):
 	fields = 'left',
+	extra = 'right',
 
 class Tuple(Expr):
 	fields = 'values',
 
 class Call(Expr):
 	fields = 'args',
+	extra = 'name', 'fun', 'virtual', 'callbr'
 
 class NamedArg(Expr):
-	fields = 'val', # plus non-field 'name'
+	fields = 'val',
+	extra = 'name',
 
 # Statement-level
 
@@ -162,9 +194,11 @@ class IAdd(Node):
 
 class Raise(Node):
 	fields = 'value',
+	extra = 'callbr',
 
 class Yield(Node):
 	fields = 'value',
+	extra = 'target',
 
 class Except(Node):
 	fields = 'type', 'suite'
@@ -174,18 +208,21 @@ class Suite(Node):
 
 class Argument(Node):
 	fields = 'name',
+	extra = 'type',
 	def __init__(self, pos):
 		Node.__init__(self, pos)
 		self.type = None
 
 class Decl(Node):
 	fields = 'decor', 'name', 'args', 'rtype'
+	extra = 'irname',
 
 class TryBlock(Node):
 	fields = 'suite', 'catch'
 
 class Function(Node):
 	fields = 'decor', 'name', 'args', 'rtype', 'suite'
+	extra = 'irname', 'flow'
 
 class Break(Node):
 	fields = ()
@@ -227,3 +264,61 @@ class File(Node):
 	fields = 'suite',
 	def __init__(self):
 		self.suite = []
+
+# Tree walking
+
+def method(cls, name):
+	'''Returns the function for the method `name` on class `cls` (rather
+	than an unbound method), or None if there is no such method.'''
+	for c in cls.__mro__:
+		if name in c.__dict__:
+			return c.__dict__[name]
+	return None
+
+class Dispatch(dict):
+	'''Maps node classes to the functions handling them in the visitor class
+	`cls`: the method named after the node class, or its `generic()` method
+	if it has no such method. Entries are looked up on first use.'''
+	
+	def __init__(self, cls):
+		dict.__init__(self)
+		self.cls = cls
+	
+	def __missing__(self, key):
+		fun = method(self.cls, key.__name__) or method(self.cls, 'generic')
+		if fun is None:
+			msg = "'%s' object has no attribute '%s'"
+			raise AttributeError(msg % (self.cls.__name__, key.__name__))
+		self[key] = fun
+		return fun
+
+TABLES = {}
+
+class Visitor(object):
+	'''Base class for the passes walking the syntax tree (or CFG). Nodes are
+	dispatched on their class through a table shared by all instances of a
+	visitor class (see Dispatch), so that handling a node only takes a dict
+	lookup. Subclasses that need extra arguments override visit().'''
+	
+	def __new__(cls, *args, **kwargs):
+		self = object.__new__(cls)
+		self.table = TABLES.get(cls)
+		if self.table is None:
+			self.table = TABLES[cls] = Dispatch(cls)
+		return self
+	
+	def visit(self, node):
+		return self.table[node.__class__](self, node)
+
+def walk(node):
+	'''Yields `node` and all nodes below it, following the `fields` of each
+	node in breadth-first order, without recursion. Lists and tuples in
+	fields are flattened; anything that is not a node is skipped.'''
+	queue = collections.deque([node])
+	while queue:
+		node = queue.popleft()
+		if isinstance(node, (list, tuple)):
+			queue.extend(node)
+		elif hasattr(node, 'fields'):
+			yield node
+			queue.extend(getattr(node, k, None) for k in node.fields)
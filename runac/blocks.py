@@ -20,17 +20,20 @@ and the transformation of the various source-level flow control features
 into a control flow graph of basic blocks.
 '''
 
-from . import ast, util, types
+from . import ast, dataflow, timing, util, types
+import bisect, collections
 
 class SetAttr(ast.Attrib):
 	pass
 
 class Branch(util.AttribRepr):
+	__slots__ = 'label',
 	fields = ()
 	def __init__(self, target):
 		self.label = target
 
 class CondBranch(util.AttribRepr):
+	__slots__ = 'cond', 'tg1', 'tg2'
 	fields = ('cond',)
 	def __init__(self, cond, tg1, tg2):
 		self.cond = cond
@@ -38,6 +41,7 @@ class CondBranch(util.AttribRepr):
 		self.tg2 = tg2
 
 class Phi(util.AttribRepr):
+	__slots__ = 'pos', 'left', 'right', 'type'
 	fields = ()
 	def __init__(self, pos, left, right):
 		self.pos = pos
@@ -46,16 +50,19 @@ class Phi(util.AttribRepr):
 		self.type = None
 
 class Constant(object):
+	__slots__ = 'node', 'type'
 	def __init__(self, node):
 		self.node = node
 
 class LoopSetup(util.AttribRepr):
+	__slots__ = 'loop', 'type'
 	fields = 'loop',
 	def __init__(self, loop):
 		self.loop = loop
 		self.type = None
 
 class LoopHeader(util.AttribRepr):
+	__slots__ = 'ctx', 'lvar', 'tg1', 'tg2'
 	fields = 'ctx', 'lvar'
 	def __init__(self, ctx, lvar, tg1, tg2):
 		self.ctx = ctx
@@ -64,6 +71,7 @@ class LoopHeader(util.AttribRepr):
 		self.tg2 = tg2
 
 class LPad(util.AttribRepr):
+	__slots__ = 'var', 'map', 'fail'
 	fields = ()
 	def __init__(self, var, map, fail):
 		self.var = var
@@ -71,11 +79,15 @@ class LPad(util.AttribRepr):
 		self.fail = fail
 
 class Resume(util.AttribRepr):
+	__slots__ = 'var',
 	fields = ()
 	def __init__(self, var):
 		self.var = var
 
 class Block(util.AttribRepr):
+	__slots__ = (
+		'id', 'anno', 'returns', 'raises', 'steps', 'preds', 'uses', 'escapes'
+	)
 	
 	def __init__(self, id, anno=None):
 		self.id = id
@@ -84,8 +96,8 @@ class Block(util.AttribRepr):
 		self.raises = False
 		self.steps = []
 		self.preds = []
-		self.escapes = {}
-		self.checks = {}
+		self.uses = ()
+		self.escapes = None
 	
 	def push(self, inst):
 		self.steps.append(inst)
@@ -94,95 +106,161 @@ class Block(util.AttribRepr):
 		return not self.steps or not isinstance(self.steps[-1], ast.Return)
 
 class FlowGraph(util.AttribRepr):
+	'''The CFG for a code object. Blocks are kept in a list, indexed by
+	their ids; their predecessors are lists of block ids.
+	
+	Variables are numbered densely (see var()). For each variable id,
+	``sets`` maps block ids (or None, for arguments) to a sorted list of the
+	steps assigning to it, and ``types`` maps them to a parallel list of the
+	assigned types; ``clears`` does the same for the steps using up an owner,
+	for the few variables that have them. Each block has a sorted tuple of
+	the ids of the variables it uses.'''
 	
 	def __init__(self):
-		self.blocks = {0: Block(0, 'entry')}
+		self.blocks = [Block(0, 'entry')]
 		self.edges = {}
 		self.yields = {}
 		self.checks = {}
-		self.vars = {}
+		self.names = []
+		self.ids = {}
+		self.sets = []
+		self.types = []
+		self.clears = {}
+		self.reach = None
 	
 	def block(self, anno=None):
-		id = len(self.blocks)
-		self.blocks[id] = Block(id, anno)
-		return self.blocks[id]
+		self.blocks.append(Block(len(self.blocks), anno))
+		return self.blocks[-1]
 	
 	def edge(self, src, dst, checked=None):
 		self.edges.setdefault(src, []).append(dst)
 		if checked:
 			self.checks[src, dst] = {n.name: chk for (n, chk) in checked}
 	
-	def origins(self, name, cur):
-		
-		# Prepare some data that we need
+	def var(self, name):
+		'''Returns the id for the variable `name`, numbering it if needed.'''
+		id = self.ids.get(name)
+		if id is None:
+			id = self.ids[name] = len(self.names)
+			self.names.append(name)
+			self.sets.append({})
+			self.types.append({})
+		return id
+	
+	def define(self, name, bid, sid, type=None):
+		'''Record an assignment to `name` at step `sid` of block `bid`.'''
+		id = self.var(name)
+		sids = self.sets[id].setdefault(bid, [])
+		types = self.types[id].setdefault(bid, [])
+		i = bisect.bisect_left(sids, sid)
+		if i < len(sids) and sids[i] == sid:
+			types[i] = type
+		else:
+			sids.insert(i, sid)
+			types.insert(i, type)
+		self.reach = None
+	
+	def settype(self, name, bid, sid, type):
+		'''Set the type for the assignment to `name` at step `sid` of
+		block `bid`, which must have been recorded before.'''
+		id = self.ids[name]
+		sids = self.sets[id].get(bid, [])
+		i = bisect.bisect_left(sids, sid)
+		assert i < len(sids) and sids[i] == sid, name
+		self.types[id][bid][i] = type
+	
+	def last(self, name, bid, before=None):
+		'''Returns a tuple of the step and the type for the last assignment
+		to `name` in block `bid` (before step `before`, if given), or None
+		if there is no such assignment.'''
+		id = self.ids[name]
+		sids = self.sets[id].get(bid)
+		if not sids:
+			return None
+		i = len(sids) if before is None else bisect.bisect_left(sids, before)
+		return (sids[i - 1], self.types[id][bid][i - 1]) if i else None
+	
+	def clear(self, name, bid, sid):
+		'''Record that the owner in `name` is used up at step `sid` of
+		block `bid`; this invalidates the reaching definitions table.'''
+		clears = self.clears.setdefault(self.ids[name], {})
+		sids = clears.setdefault(bid, [])
+		i = bisect.bisect_left(sids, sid)
+		if i == len(sids) or sids[i] != sid:
+			sids.insert(i, sid)
+		self.reach = None
+	
+	def reaching(self):
+		'''Compute reaching definitions for all variables at once.
+		
+		Every block assigning to a variable (and the argument pseudo-block
+		``None``) is a definition site, numbered into a bit vector. Blocks
+		that set or clear a variable kill all of its sites; a block that
+		sets after its last clear generates its own site. The result lists
+		the bit range and site keys for each variable id, and the bit vector
+		of sites reaching the entry of each block.'''
+		
+		sites, args, lo = [], 0, 0
+		gen = [0] * len(self.blocks)
+		kill = list(gen)
+		for id, sets in enumerate(self.sets):
+			
+			clears = self.clears.get(id, {})
+			keys = sorted(sets, key=lambda k: -1 if k is None else k)
+			sites.append((lo, keys))
+			
+			mask = ((1 << len(keys)) - 1) << lo
+			for i, key in enumerate(keys):
+				if key is None:
+					args |= 1 << (lo + i)
+					continue
+				kill[key] |= mask
+				clear = clears.get(key)
+				if not clear or sets[key][-1] > clear[-1]:
+					gen[key] |= 1 << (lo + i)
+			
+			for key in clears:
+				kill[key] |= mask
+			lo += len(keys)
 		
-		sets = self.vars[name].get('sets', {})
-		clears = self.vars[name].get('clear', {})
+		entry = dataflow.solve(self, dataflow.genkill(gen, kill), init=args)[0]
+		return sites, entry
+	
+	def origins(self, name, cur):
 		
 		# For current block, find assignments before current step but after
 		# last clear (clearing is done by using up owning references)
 		
-		assigned = sets.get(cur[0], {})
-		cleared = set(i for i in clears.get(cur[0], set()) if i < cur[1])
-		if cleared:
-			cleared = max(cleared)
-			assigned = set(i for i in assigned if i < cur[1] and i > cleared)
-		
-		# If assigned in this block, return from here
-		
-		if assigned and min(assigned) < cur[1]:
-			return {cur[0]}
+		id, (bid, sid) = self.ids[name], cur
+		sets = self.sets[id].get(bid)
+		if sets:
+			i = bisect.bisect_left(sets, sid)
+			clears = self.clears.get(id, {}).get(bid)
+			j = bisect.bisect_left(clears, sid) if clears else 0
+			
+			# If assigned in this block, return from here
+			
+			if i and (not j or sets[i - 1] > clears[j - 1]):
+				return {bid}
 		
-		# If this block does not have any predecessors, return nothing
+		# Otherwise, look up the definitions reaching the block entry. The
+		# current block only counts as its own origin through a self-loop.
 		
-		bl = self.blocks[cur[0]]
-		if not bl.preds and None in sets:
-			return {None} if None in sets else set()
+		if self.reach is None:
+			self.reach = self.reaching()
 		
-		# Check all transitively predecessing blocks for assignments
-		
-		res = set()
-		test = set(bl.preds)
-		seen = {cur[0]} | {b.id for b in test}
-		while test:
-			
-			pred = test.pop()
-			seen.add(pred.id)
-			
-			# If predecessor block sets, check that it sets after clearing
-			# and add it to the set of possible origins for the current step
-			
-			if pred.id in sets:
-				asgt = sets.get(pred.id, set())
-				clear = clears.get(pred.id, set())
-				if not clear or max(asgt) > max(clear):
-					res.add(pred.id)
-			
-			# If predecessor does not set, but does clear, do not process
-			# any of its predecessors, as they will be invisible
-			
-			elif pred.id in clears:
-				continue
-			
-			# If block has no predecessors, check for arguments
-			
-			elif not pred.preds:
-				if None in sets:
-					res.add(None)
-			
-			# Else, add predecessor blocks to the search list
-			
-			else:
-				for b in pred.preds:
-					if b.id not in seen:
-						test.add(b)
-						seen.add(b.id)
+		sites, entry = self.reach
+		lo, keys = sites[id]
+		bits = entry[bid] >> lo
+		res = set(k for (i, k) in enumerate(keys) if bits & (1 << i))
+		if bid in res and bid not in self.blocks[bid].preds:
+			res.discard(bid)
 		
 		return res
 
 ATOMIC = ast.NoneVal, ast.Bool, ast.Int, ast.Float, ast.Name
 
-class FlowFinder(object):
+class FlowFinder(ast.Visitor):
 	
 	def __init__(self):
 		self.flow = FlowGraph()
@@ -195,9 +273,6 @@ class FlowFinder(object):
 		self.tmp += 1
 		return '$%s' % (self.tmp - 1)
 	
-	def visit(self, node):
-		return getattr(self, node.__class__.__name__)(node)
-	
 	def append(self, node):
 		
 		node = self.visit(node)
@@ -435,7 +510,6 @@ class FlowFinder(object):
 					checked.append((cond.left, False))
 					check = True
 				
-				prevcond.checks = {n.name: chk for (n, chk) in checked}
 				self.flow.edge(prevcond.id, self.cur.id, checked)
 				self.cur.push(CondBranch(condvar, None, None))
 				self.cur, prevcond = tmp, self.cur
@@ -453,7 +527,6 @@ class FlowFinder(object):
 					checked.append((cond.left, False))
 					check = True
 				
-				self.cur.checks = {n.name: chk for (n, chk) in checked}
 				self.flow.edge(self.cur.id, block.id, checked)
 				self.cur.push(CondBranch(condvar, block.id, None))
 				prevcond = self.cur
@@ -461,7 +534,6 @@ class FlowFinder(object):
 			elif cond is None:
 				assert isinstance(prevcond.steps[-1], CondBranch)
 				prevcond.steps[-1].tg2 = block.id
-				prevcond.checks = {n.name: chk for (n, chk) in checked}
 				self.flow.edge(prevcond.id, block.id, checked)
 				prevcond = None
 			
@@ -556,8 +628,8 @@ class FlowFinder(object):
 		self.caught = []
 		self.visit(node.suite)
 		if self.cur.anno == 'try-continue':
-			assert not self.cur.steps
-			del self.flow.blocks[self.cur.id]
+			assert not self.cur.steps and self.cur is self.flow.blocks[-1]
+			self.flow.blocks.pop()
 			self.flow.edges[self.caught[-1][0]].remove(self.cur.id)
 		
 		pad = self.flow.block('landing-pad')
@@ -594,7 +666,7 @@ class FlowFinder(object):
 		self.visit(node.suite)
 		flow = node.flow = self.flow
 		
-		final = flow.blocks[len(flow.blocks) - 1]
+		final = flow.blocks[-1]
 		callbr, branch = False, False
 		if final.steps:
 			last = final.steps[-1]
@@ -610,7 +682,7 @@ class FlowFinder(object):
 		
 		for src, dsts in util.items(flow.edges):
 			for dst in dsts:
-				flow.blocks[dst].preds.append(flow.blocks[src])
+				flow.blocks[dst].preds.append(src)
 
 FINAL = (
 	ast.Return, ast.Raise, ast.Yield,
@@ -621,7 +693,8 @@ class Scope(object):
 	
 	def __init__(self, parent=None):
 		self.parent = parent or {}
-		self.data = {}
+		self.data = collections.OrderedDict()
+		self.log = None
 	
 	def __contains__(self, key):
 		if key in self.data:
@@ -635,6 +708,8 @@ class Scope(object):
 	
 	def __setitem__(self, key, val):
 		self.data[key] = val
+		if self.log is not None:
+			self.log.append((key, val))
 	
 	def get(self, key, default=None):
 		if key in self.data:
@@ -651,20 +726,36 @@ class Scope(object):
 		return key in self.data
 	
 	def allitems(self):
-		for k, v in util.items(self.parent):
+		if isinstance(self.parent, Scope):
+			parent = self.parent.allitems()
+		else:
+			parent = util.items(self.parent)
+		for k, v in parent:
 			yield k, v
 		for k, v in util.items(self):
 			yield k, v
 
+def dotted(node):
+	'''Returns the dotted name (as a string) for a Name or Attrib node.'''
+	res = []
+	while isinstance(node, ast.Attrib):
+		res.append(node.attrib)
+		node = node.obj
+	res.append(node.name)
+	return '.'.join(reversed(res))
+
 class Module(object):
 	
-	def __init__(self, name, node, parent=None):
+	def __init__(self, name, node, parent=None, defer=False):
 		self.name = name
 		self.names = {}
 		self.code = []
 		self.defined = set()
 		self.scope = Scope(parent)
-		self.add(node)
+		self.resolved = {}
+		self.defer = defer
+		with timing.phase('blocks', name, obj=self):
+			self.add(node)
 	
 	def __repr__(self):
 		contents = sorted(util.items(self.__dict__))
@@ -684,6 +775,30 @@ class Module(object):
 		return self.names.items()
 	
 	def type(self, t, stubs={}):
+		'''Returns the type described by `t`, which can be a syntax tree
+		node, a type name like '$Array[Str]' or a type. Results for type
+		names are memoized; scope entries made while resolving a name are
+		set again on every call, so that they appear in the scope log.'''
+		
+		if not isinstance(t, str) or stubs:
+			return self.resolve(t, stubs)
+		
+		if t not in self.resolved:
+			log, self.scope.log = self.scope.log, []
+			try:
+				obj = self.resolve(t, stubs)
+			finally:
+				sets, self.scope.log = self.scope.log, log
+			if not isinstance(obj, types.ReprId):
+				return obj
+			self.resolved[t] = obj, sets
+		
+		obj, sets = self.resolved[t]
+		for k, v in sets:
+			self.scope[k] = v
+		return obj
+	
+	def resolve(self, t, stubs):
 		if t is None:
 			return types.void()
 		elif t == '...':
@@ -724,6 +839,8 @@ class Module(object):
 			return obj
 		elif isinstance(t, ast.Mut):
 			t = self.type(t.value, stubs)
+			if isinstance(t, types.ref):
+				return types.ref(t.over, True)
 			t.mut = True
 			return t
 		elif isinstance(t, ast.Owner):
@@ -747,18 +864,7 @@ class Module(object):
 			if isinstance(n, ast.RelImport):
 				for name in n.names:
 					
-					if isinstance(n.base, ast.Name):
-						base = n.base.name
-					else:
-						start = n.base
-						res = []
-						while isinstance(start, ast.Attrib):
-							res.append(start.attrib)
-							start = start.obj
-						res.append(start.name)
-						base = '.'.join(reversed(res))
-					
-					self[name.name] = base + '.' + name.name
+					self[name.name] = dotted(n.base) + '.' + name.name
 			
 			elif isinstance(n, ast.Class):
 				self[n.name.name] = n
@@ -783,5 +889,12 @@ class Module(object):
 		
 		for name, node in code:
 			self.defined.add(name)
-			FlowFinder().find_flow(node)
+			if not self.defer:
+				FlowFinder().find_flow(node)
 			self.code.append((name, node))
+	
+	def build(self, name, node):
+		'''Builds the CFG for the code object `node`, called `name`. Only
+		needed for modules created with `defer` set (see streaming.py).'''
+		with timing.phase('blocks', self.name, name, node):
+			FlowFinder().find_flow(node)
@@ -0,0 +1,196 @@
+'''A small content-addressed cache for compiler artifacts.
+
+Building the core library (parsing ``core/__builtins__.rns``, running all
+passes over it and generating its IR) is expensive compared to the cost of
+compiling a small program, and its result only depends on a handful of
+inputs. This module stores such artifacts on disk, keyed by a hash over
+everything they were derived from, so that later processes can skip the
+work entirely.
+
+The cache lives in ``$RUNA_CACHE_DIR`` if that is set, or in ``runa``
+below the user's cache directory otherwise. Setting ``RUNA_NO_CACHE``
+disables it. Cache entries are never invalidated explicitly: changing any
+of the inputs yields a different key.
+
+Pickling a typed module is slightly involved, because the type system
+creates new Python classes at run time (see ``types.create()`` and friends).
+The standard pickle machinery can only refer to classes by name, so
+dynamically created classes are written out separately: a header with
+their names and bases is used to create empty class shells first,
+after which the pickled objects are loaded and the class attributes are
+filled in. Objects that the loading process already has (like the types
+from the core library) can be passed in as a dict of `known` objects, in
+which case only their keys are written out.
+'''
+
+from . import util
+import os, sys, io, hashlib, tempfile, pickle
+
+try:
+	import cPickle
+except ImportError:
+	cPickle = None
+
+VERSION = 1
+SOURCES = os.path.dirname(os.path.abspath(__file__))
+SKIP = {'__module__', '__dict__', '__weakref__', '__doc__', '__qualname__'}
+
+def directory():
+	'''Returns the directory used for cache files, or None if disabled.'''
+	if os.environ.get('RUNA_NO_CACHE'):
+		return None
+	if os.environ.get('RUNA_CACHE_DIR'):
+		return os.environ['RUNA_CACHE_DIR']
+	base = os.environ.get('XDG_CACHE_HOME')
+	if not base:
+		base = os.path.join(os.path.expanduser('~'), '.cache')
+	return os.path.join(base, 'runa')
+
+def digest(files, *extra):
+	'''Hash the contents of the given files and any extra strings.'''
+	h = hashlib.sha1(('runa-cache-%i' % VERSION).encode('ascii'))
+	h.update(sys.version.encode('ascii', 'replace'))
+	for fn in files:
+		h.update(fn.encode('utf-8'))
+		with open(fn, 'rb') as f:
+			h.update(f.read())
+	for s in extra:
+		h.update(b'\0' + s.encode('utf-8'))
+	return h.hexdigest()
+
+def sources():
+	'''Returns the list of source files for the compiler itself.'''
+	names = sorted(fn for fn in os.listdir(SOURCES) if fn.endswith('.py'))
+	return [os.path.join(SOURCES, fn) for fn in names]
+
+def path(kind, key, ext='pickle'):
+	base = directory()
+	if base is None:
+		return None
+	return os.path.join(base, '%s-%s.%s' % (kind, key, ext))
+
+def write(fn, data):
+	'''Atomically write `data` (bytes) to `fn`, ignoring failures: an
+	unwritable cache directory should never break compilation.'''
+	try:
+		dir = os.path.dirname(fn)
+		if not os.path.isdir(dir):
+			os.makedirs(dir)
+		fd, tmp = tempfile.mkstemp(dir=dir, prefix='.tmp-')
+		with os.fdopen(fd, 'wb') as f:
+			f.write(data)
+		os.rename(tmp, fn)
+	except (IOError, OSError):
+		pass
+
+def read(fn):
+	if fn is None or not os.path.exists(fn):
+		return None
+	try:
+		with open(fn, 'rb') as f:
+			return f.read()
+	except (IOError, OSError):
+		return None
+
+# Pickling of objects with dynamically created classes
+
+def dynamic(cls):
+	'''Check whether `cls` was created at run time (as opposed to being
+	importable by name, which is all that pickle can handle).'''
+	mod = sys.modules.get(cls.__module__)
+	return getattr(mod, cls.__name__, None) is not cls
+
+class Pickler(pickle.Pickler):
+
+	def __init__(self, f, known=None):
+		pickle.Pickler.__init__(self, f, 2)
+		self.classes = []
+		self.ids = {}
+		self.known = {id(v): k for (k, v) in util.items(known or {})}
+	
+	def persistent_id(self, obj):
+		if id(obj) in self.known:
+			return 'obj:' + self.known[id(obj)]
+		if not isinstance(obj, type) or not dynamic(obj):
+			return None
+		if id(obj) not in self.ids:
+			self.ids[id(obj)] = len(self.classes)
+			self.classes.append(obj)
+		return 'cls:%i' % self.ids[id(obj)]
+
+def dumps(obj, known=None):
+	'''Pickle `obj` into a string, including any dynamic classes.'''
+	
+	limit = sys.getrecursionlimit()
+	sys.setrecursionlimit(max(limit, 20000))
+	try:
+		
+		body = io.BytesIO()
+		pickler = Pickler(body, known)
+		pickler.dump(obj)
+		
+		# Writing class contents may pull in more dynamic classes
+		
+		done = 0
+		while done < len(pickler.classes):
+			attrs = util.items(pickler.classes[done].__dict__)
+			pickler.dump({k: v for (k, v) in attrs if k not in SKIP})
+			done += 1
+		
+		classes = pickler.classes
+		shells = [(c.__name__, c.__bases__, c.__module__) for c in classes]
+		return pickle.dumps(shells, 2) + body.getvalue()
+	
+	finally:
+		sys.setrecursionlimit(limit)
+
+def loads(data, known=None):
+	'''Reverse of dumps().'''
+	
+	f = io.BytesIO(data)
+	shells = []
+	for name, bases, module in pickle.load(f):
+		shells.append(type(name, bases, {'__module__': module}))
+	
+	def load(pid):
+		if pid.startswith('obj:'):
+			return known[pid[4:]]
+		assert pid.startswith('cls:'), pid
+		return shells[int(pid[4:])]
+	
+	if cPickle is not None:
+		unpickler = cPickle.Unpickler(f)
+		unpickler.persistent_load = load
+	else:
+		unpickler = Unpickler(f, load)
+	
+	obj = unpickler.load()
+	for cls in shells:
+		for k, v in util.items(unpickler.load()):
+			setattr(cls, k, v)
+	
+	return obj
+
+class Unpickler(pickle.Unpickler):
+
+	def __init__(self, f, load):
+		pickle.Unpickler.__init__(self, f)
+		self.load_id = load
+	
+	def persistent_load(self, pid):
+		return self.load_id(pid)
+
+def load(kind, key, known=None):
+	'''Load a cached object, or return None if it's not available.'''
+	data = read(path(kind, key))
+	if data is None:
+		return None
+	try:
+		return loads(data, known)
+	except Exception:
+		return None
+
+def store(kind, key, obj, known=None):
+	fn = path(kind, key)
+	if fn is not None:
+		write(fn, dumps(obj, known))
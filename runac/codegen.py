@@ -3,7 +3,8 @@
 Code generation is done by another CFG walker.
 Each node method will generate LLVM IR using Python string formatting and
 a small set of helper functions.
-All of the IR is appended to a Python list and then returned as a string.
+All of the IR is appended to a Python list and then returned as a string
+(or, in streaming mode, written out one function at a time; see ``Writer``).
 
 Most methods will return a ``Value`` object,
 which contains the IR-level name and the Runa-level type.
@@ -21,8 +22,8 @@ over the life of one Runa process would be important.
 which is important.)
 '''
 
-from . import ast, types, blocks, typer, util
-import os, sys, copy, platform
+from . import ast, types, blocks, typer, timing, util
+import os, sys, copy, platform, shutil, tempfile
 
 ESCAPES = {'\\n': '\\0a', '\\0': '\\00'}
 EH_TYPES = (
@@ -65,7 +66,7 @@ class Frame(object):
 	def get(self, key, default=None):
 		return self[key] if key in self else default
 
-class CodeGen(object):
+class CodeGen(ast.Visitor):
 	
 	def __init__(self, mod, word):
 		self.mod = mod
@@ -76,11 +77,12 @@ class CodeGen(object):
 		self.vars = 0
 		self.labels = {}
 		self.typedecls = None
+		self.frame = None
 		self.intercept = None
 		self.buf = []
 	
 	def visit(self, node, frame):
-		return getattr(self, node.__class__.__name__)(node, frame)
+		return self.table[node.__class__](self, node, frame)
 	
 	def generate(self):
 		self.Module(self.mod)
@@ -234,7 +236,7 @@ class CodeGen(object):
 		
 		ptrt = self.mod.type('&byte')
 		wrap = self.alloca(types.unwrap(trait))
-		vtt = '%' + trait.over.name + '.vt'
+		vtt = '%' + trait.over.qname + '.vt'
 		vt = self.varname()
 		self.writeline('%s = alloca %s' % (vt, vtt))
 		
@@ -767,7 +769,8 @@ class CodeGen(object):
 		res = self.varname()
 		personality = 'i8* bitcast (%s @__runa_personality to i8*)'
 		clause = 'catch %s* @%%s.size' % self.word
-		clauses = ' '.join(clause % t.name for t in node.map)
+		names = [self.mod.type(t.name).qname for t in node.map]
+		clauses = ' '.join(clause % name for name in names)
 		bits = res, 'personality ' + (personality % EH_TYPES[2]), clauses
 		self.writeline('%s = landingpad { i8*, i32 } %s %s' % bits)
 		frame[node.var] = res
@@ -877,7 +880,7 @@ class CodeGen(object):
 			
 			t = types.unwrap(node.fun.type.over[1][0])
 			vtp = self.gep(wrapped, 0, 0)
-			vtt = '%%%s.vt*' % t.name
+			vtt = '%%%s.vt*' % t.qname
 			vt = self.varname()
 			self.writeline('%s = load %s* %s' % (vt, vtt, vtp))
 			fp = self.gep((vtt, vt), 0, 0)
@@ -976,7 +979,7 @@ class CodeGen(object):
 				self.store((arg.type, '%' + arg.name.name), addr.var)
 		
 		self.main = node if node.irname == 'main' else None
-		for i, block in sorted(util.items(node.flow.blocks)):
+		for block in node.flow.blocks:
 			self.visit(block, frame)
 		
 		self.dedent()
@@ -1070,46 +1073,47 @@ class CodeGen(object):
 				ftype.over = ftype.over[0], atypes
 				mtypes.append(ftype.ir)
 		
-		self.writeline('%%%s.vt = type { %s }' % (t.name, ', '.join(mtypes)))
-		self.writeline('%%%s.wrap = type { %%%s.vt*, i8* }' % (t.name, t.name))
+		self.writeline('%%%s.vt = type { %s }' % (t.qname, ', '.join(mtypes)))
+		self.writeline('%%%s.wrap = type { %%%s.vt*, i8* }' % (t.qname, t.qname))
 		self.newline()
 	
 	def ctx(self, mod, t):
 		
-		name = t.name[len(mod.name) + 1:-4].split('.')
-		key = name[0] if len(name) == 1 else tuple(name)
-		fun = None
-		for k, v in mod.code:
-			if k == key:
-				fun = v
-				break
+		# Contexts for generators processed in streaming mode have already
+		# been laid out (see Writer), since their code has been released.
+		
+		if '$label' not in t.attribs:
+			
+			name = t.name[len(mod.name) + 1:-4].split('.')
+			key = name[0] if len(name) == 1 else tuple(name)
+			fun = None
+			for k, v in mod.code:
+				if k == key:
+					fun = v
+					break
+			
+			assert fun is not None
+			self.context(t, fun)
+		
+		self.type(t, external=not mod.scope.local(t.name))
+	
+	def context(self, t, fun):
+		'''Lays out the context type `t` for the generator `fun`, with
+		a slot for every variable used in it.'''
 		
-		assert fun is not None
 		vars = {}
-		for i, bl in util.items(fun.flow.blocks):
-			for step in bl.steps:
-				nodes = [step]
-				node = nodes.pop(0)
-				while node:
-					
-					if isinstance(node, ast.Name):
-						vars[node.name] = node.type
-					
-					if not node.fields:
-						node = None if not nodes else nodes.pop(0)
-						continue
-					
-					fields = list(node.fields)
-					nodes += [getattr(node, k) for k in fields]
-					node = None if not nodes else nodes.pop(0)
+		for bl in fun.flow.blocks:
+			for node in (n for step in bl.steps for n in ast.walk(step)):
+				if isinstance(node, ast.Name):
+					vars[node.name] = node.type
 		
 		t.attribs['$label'] = 0, self.mod.type('&byte')
 		for i, (name, type) in enumerate(util.items(vars)):
 			t.attribs[name] = i + 1, type
-		
-		self.type(t)
 	
-	def Module(self, mod):
+	def declarations(self, mod):
+		'''Writes out the module-level declarations: functions from other
+		modules and all the types needed by the module.'''
 		
 		# Declare functions not defined in this module
 		
@@ -1159,8 +1163,9 @@ class CodeGen(object):
 			# Determine type dependencies for the type's attributes
 			atypes = {a[1] for a in util.values(v.attribs)}
 			tdeps = {types.unwrap(t) for t in atypes}
-			deps[v.name] = v, {t for t in tdeps if t.name not in types.BASIC}
+			deps[v.qname] = v, {t for t in tdeps if t.name not in types.BASIC}
 		
+		own = types.qualifier(mod.name)
 		remains = set(deps)
 		while remains:
 			
@@ -1169,12 +1174,13 @@ class CodeGen(object):
 			done = set()
 			for k in remains:
 				if not deps[k][1]:
-					self.type(deps[k][0], external=not mod.scope.local(k))
-					done.add(deps[k][0])
+					t = deps[k][0]
+					self.type(t, external=t.module != own)
+					done.add(t)
 			
 			# Remove the processed types from dependency lists
 			
-			remains -= {t.name for t in done}
+			remains -= {t.qname for t in done}
 			for k in remains:
 				for t in done:
 					if t in deps[k][1]:
@@ -1191,21 +1197,25 @@ class CodeGen(object):
 		for ctx in ctxs:
 			self.ctx(mod, ctx)
 		
-		# Setup root frame and add constants to it
-		
-		frame = Frame()
+	def constants(self, mod):
+		'''Sets up the root frame and adds the module's constants to it.'''
+		self.frame = Frame()
 		for k, v in util.items(mod.scope):
 			if isinstance(v, blocks.Constant):
-				self.const(k, v.node, frame)
-		
+				self.const(k, v.node, self.frame)
+	
+	def Module(self, mod):
+		self.declarations(mod)
+		self.constants(mod)
 		self.typedecls = self.buf
 		self.buf = []
-		
-		# Generate IR for code objects
-		
 		self.newline()
-		for k, v in mod.code:
-			self.visit(v, frame)
+	
+	def function(self, node):
+		'''Generate IR for a single code object, returns it as a string.'''
+		self.visit(node, self.frame)
+		res, self.buf = ''.join(self.buf), []
+		return res
 
 TRIPLES = {
 	('64bit', 'darwin'): 'x86_64-apple-macosx{os_version}.0',
@@ -1218,7 +1228,7 @@ TRIPLE_FMT = 'target triple = "%s"\n\n'
 
 def triple():
 	
-	arch, os_key = platform.architecture()[0], sys.platform
+	arch, os_key = '%ibit' % types.WORD_SIZE, sys.platform
 	os_key = 'linux' if os_key.startswith('linux') else os_key
 	triple = TRIPLES[arch, os_key]
 	
@@ -1229,16 +1239,67 @@ def triple():
 	return triple
 
 def rt():
-	arch = platform.architecture()[0]
 	with open(os.path.join(util.CORE_DIR, 'rt.ll')) as f:
-		src = f.read().replace('{{ WORD }}', 'i' + arch[:2])
-		src = src.replace('{{ BYTES }}', str(int(arch[:2]) // 8))
+		src = f.read().replace('{{ WORD }}', 'i%i' % types.WORD_SIZE)
+		src = src.replace('{{ BYTES }}', str(types.WORD_SIZE // 8))
 		return TRIPLE_FMT % triple() + src
 
+def functions(mod, cached={}):
+	'''Generate IR for the given module. Returns a tuple of the module-level
+	IR (type declarations, constants and the like) and a list of IR strings
+	for the code objects in `mod.code`. Where `cached` contains IR for the
+	name of a code object, that is used instead of generating it again.'''
+	
+	gen = CodeGen(mod, 'i%i' % types.WORD_SIZE)
+	with timing.phase('codegen', mod.name):
+		gen.generate()
+	header, gen.buf = gen.typedecls + gen.buf, []
+	
+	code = []
+	for k, v in mod.code:
+		if k in cached:
+			code.append(cached[k])
+			continue
+		with timing.phase('codegen', mod.name, k, v):
+			code.append(gen.function(v))
+	
+	return ''.join([TRIPLE_FMT % triple()] + header), code
+
 def generate(mod):
-	gen = CodeGen(mod, 'i' + platform.architecture()[0][:2])
-	gen.generate()
-	code = [TRIPLE_FMT % triple()]
-	code += gen.typedecls
-	code += gen.buf
-	return ''.join(code)
+	header, code = functions(mod)
+	return header + ''.join(code)
+
+class Writer(object):
+	'''Writes IR for the module `mod` to the file `out`, one code object at
+	a time (see streaming.py). The module-level IR depends on the types used
+	by all functions, so function definitions are spooled to a temporary
+	file until close() writes out the module-level IR, followed by them.'''
+	
+	def __init__(self, mod, out):
+		self.mod = mod
+		self.out = out
+		self.gen = CodeGen(mod, 'i%i' % types.WORD_SIZE)
+		self.gen.constants(mod)
+		self.consts, self.gen.buf = self.gen.buf, []
+		self.spool = tempfile.TemporaryFile('w+')
+	
+	def function(self, k, fun):
+		'''Generate IR for the code object `fun`, called `k`. Generator
+		contexts are laid out here, before their code is released.'''
+		if fun.flow.yields:
+			self.gen.context(self.mod.scope[fun.irname + '$ctx'], fun)
+		with timing.phase('codegen', self.mod.name, k, fun):
+			self.spool.write(self.gen.function(fun))
+	
+	def close(self):
+		
+		gen = self.gen
+		try:
+			with timing.phase('codegen', self.mod.name):
+				gen.declarations(self.mod)
+			header, gen.buf = gen.buf + self.consts + ['\n'], []
+			self.out.write(''.join([TRIPLE_FMT % triple()] + header))
+			self.spool.seek(0)
+			shutil.copyfileobj(self.spool, self.out)
+		finally:
+			self.spool.close()
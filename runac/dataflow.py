@@ -0,0 +1,110 @@
+'''A generic solver for dataflow problems over ``FlowGraph`` objects.
+
+Analyses describe their lattice values as bit vectors (plain integers,
+where set bits represent facts such as "variable 3 may be tracked here")
+and provide a transfer function for a single block.
+The solver iterates to a fixed point using a worklist ordered by
+the reverse postorder of the CFG (or its reverse for backward problems),
+so that most blocks see all of their inputs before they are processed
+and acyclic graphs need only a single sweep.
+
+Values from neighbouring blocks are combined using bitwise or;
+this suits the may-analyses done in the compiler (reaching definitions,
+reachability of returns, escaping variables).
+'''
+
+import heapq
+
+def order(flow):
+	'''Returns block ids in reverse postorder, starting from the entry
+	block. Blocks that are not reachable from the entry follow in order
+	of their ids.'''
+	
+	succs = successors(flow)
+	post, seen = [], [False] * len(flow.blocks)
+	stack, seen[0] = [(0, iter(succs[0]))], True
+	while stack:
+		
+		id, it = stack[-1]
+		for next in it:
+			if not seen[next]:
+				seen[next] = True
+				stack.append((next, iter(succs[next])))
+				break
+		else:
+			stack.pop()
+			post.append(id)
+	
+	post.reverse()
+	return post + [id for (id, s) in enumerate(seen) if not s]
+
+def successors(flow):
+	'''Returns a list with the successor ids for each block, derived from
+	the predecessor lists in the blocks.'''
+	succs = [[] for bl in flow.blocks]
+	for bl in flow.blocks:
+		for p in bl.preds:
+			succs[p].append(bl.id)
+	return succs
+
+def bits(val):
+	'''Yields the indexes of the bits set in the bit vector `val`.'''
+	while val:
+		low = val & -val
+		yield low.bit_length() - 1
+		val ^= low
+
+def genkill(gen, kill):
+	'''Returns a transfer function for the classic gen/kill problems,
+	from lists with a bit vector for each block.'''
+	return lambda id, val: gen[id] | (val & ~kill[id])
+
+def solve(flow, transfer, forward=True, init=0):
+	'''Solve a dataflow problem on `flow`. The `transfer` function takes a
+	block id and the value at the start of the block (at the end, for
+	backward problems) and returns the value at the other end. Blocks
+	without predecessors (successors, for backward problems) start out
+	with `init`.
+	
+	Returns two lists with the values before and after applying the
+	transfer function for each block.'''
+	
+	ids = order(flow)
+	succs = successors(flow)
+	preds = [bl.preds for bl in flow.blocks]
+	if not forward:
+		ids.reverse()
+		preds, succs = succs, preds
+	
+	pos = [0] * len(ids)
+	for i, id in enumerate(ids):
+		pos[id] = i
+	
+	before = [0 if p else init for p in preds]
+	after = [0] * len(ids)
+	work, queued = list(enumerate(ids)), [True] * len(ids)
+	while work:
+		
+		id = heapq.heappop(work)[1]
+		queued[id] = False
+		
+		if preds[id]:
+			val = 0
+			for p in preds[id]:
+				val |= after[p]
+			before[id] = val
+		
+		# Every block starts out queued, so successors only need to be
+		# queued again if the value flowing into them has changed
+		
+		val = transfer(id, before[id])
+		if val == after[id]:
+			continue
+		
+		after[id] = val
+		for s in succs[id]:
+			if not queued[s]:
+				queued[s] = True
+				heapq.heappush(work, (pos[s], s))
+	
+	return before, after
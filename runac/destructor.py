@@ -12,41 +12,51 @@ This pass inserts ``Free`` nodes into the CFG,
 which are then expanded into function calls during the code generation phase.
 '''
 
-from . import ast, blocks, types, util
+from . import ast, blocks, dataflow, timing, types, util
 
 class Free(util.AttribRepr):
+	__slots__ = 'value',
 	fields = 'value',
 	def __init__(self, value):
 		self.value = value
 
-def destructify(mod, code):
+class Destructor(object):
+	'''Finds the owner values to free in the code object `code`, one block
+	at a time (see block()), then inserts the ``Free`` nodes (finish()).
+	Blocks must be processed in order of their ids, after escape analysis
+	for that block.'''
 	
-	returns, reassign, left = {}, [], {}
-	for i, bl in util.items(code.flow.blocks):
+	def __init__(self, mod, code):
 		
-		# For each block that returns, find the set of transitive
-		# predecessor blocks; these assignments will need freeing.
+		self.mod = mod
+		self.code = code
+		self.reassign, self.left = [], {}
 		
-		if bl.returns:
-			returns[i], q = set(), {i}
-			while q:
-				cur = q.pop()
-				returns[i].add(cur)
-				for p in code.flow.blocks[cur].preds:
-					if p.id in returns[i] or p.id in q:
-						continue
-					q.add(p.id)
+		# For each block, find the set of returning blocks reachable from it
+		# (as a bit vector, indexed like `returns`); assignments in it will
+		# need freeing before these.
+		
+		flow = code.flow
+		self.returns = [bl.id for bl in flow.blocks if bl.returns]
+		gen = [0] * len(flow.blocks)
+		for n, i in enumerate(self.returns):
+			gen[i] = 1 << n
+		self.reach = dataflow.solve(flow, lambda i, val: val | gen[i], False)[1]
+		
+		self.setters = [[] for bl in flow.blocks]
+		for id, sets in enumerate(flow.sets):
+			for i, sids in util.items(sets):
+				if i is not None:
+					self.setters[i].append((flow.names[id], sids))
+	
+	def block(self, i, bl):
 		
 		# Find assignments to owner variables; the last assignment
 		# will be freed before return, earlier ones before next assign.
 		
-		for var, data in util.items(code.flow.vars):
-			
-			if bl.id not in data.get('sets', {}):
-				continue
-			
-			assigns = sorted(data['sets'][bl.id])
-			for idx, sid in enumerate(assigns):
+		left = self.left
+		for var, assigns in self.setters[i]:
+			for sid in assigns:
 				
 				step = bl.steps[sid]
 				if isinstance(step, blocks.LoopHeader):
@@ -57,11 +67,11 @@ def destructify(mod, code):
 				if not isinstance(type, types.owner):
 					continue
 				
-				if code.flow.origins(var, (bl.id, sid)) - {None}:
-					reassign.append((var, i, sid, type))
+				if self.code.flow.origins(var, (bl.id, sid)) - {None}:
+					self.reassign.append((var, i, sid, type))
 					continue
 				
-				if var in bl.escapes:
+				if bl.escapes and var in bl.escapes:
 					continue
 				
 				left.setdefault(var, (type, set()))[1].add(i)
@@ -80,25 +90,40 @@ def destructify(mod, code):
 				if isinstance(step.right.right[1].type, types.owner):
 					left.pop(step.right.right[1].name, None)
 	
-	if code.irname == 'main' and code.args:
-		left['args'] = mod.type('$Array[Str]'), {None}
-	
-	for name, bid, sid, type in reassign:
-		node = ast.Name(name, None)
-		node.type = type
-		code.flow.blocks[bid].steps.insert(sid, Free(node))
-	
-	for name, (type, abls) in sorted(util.items(left)):
-		for rbli, reachable in sorted(util.items(returns)):
-			
-			if not (abls & reachable):
-				continue
-			
+	def finish(self):
+		
+		code, left = self.code, self.left
+		if code.irname == 'main' and code.args:
+			left['args'] = self.mod.type('$Array[Str]'), {None}
+		
+		for name, bid, sid, type in self.reassign:
 			node = ast.Name(name, None)
 			node.type = type
-			rbl = code.flow.blocks[rbli]
-			rbl.steps.insert(-1, Free(node))
+			code.flow.blocks[bid].steps.insert(sid, Free(node))
+		
+		for name, (type, abls) in sorted(util.items(left)):
+			
+			reachable = 0
+			for i in abls:
+				reachable |= self.reach[i] if i is not None else 0
+			
+			for n, rbli in enumerate(self.returns):
+				
+				if not reachable & (1 << n):
+					continue
+				
+				node = ast.Name(name, None)
+				node.type = type
+				rbl = code.flow.blocks[rbli]
+				rbl.steps.insert(-1, Free(node))
+
+def destructify(mod, name, code):
+	destructor = Destructor(mod, code)
+	for bl in code.flow.blocks:
+		destructor.block(bl.id, bl)
+	destructor.finish()
 
 def destruct(mod):
 	for name, code in mod.code:
-		destructify(mod, code)
+		with timing.phase('destruct', mod.name, name, code):
+			destructify(mod, name, code)
@@ -14,19 +14,22 @@ where data on survival requirements becomes part of the function type.
 For example, "argument 3 must live at least as long as argument 1".
 '''
 
-from . import ast, blocks, types, util
+from . import ast, blocks, dataflow, timing, types
 
-class EscapeFinder(object):
+class EscapeFinder(ast.Visitor):
 	
 	def __init__(self, mod, fun):
 		self.mod = mod
 		self.fun = fun
 		self.cfg = fun.flow
 		self.track = set()
+		self.names = []
+		self.index = {}
 		self.cur = None
+		self.dry = False
 	
 	def visit(self, node, escape=None):
-		getattr(self, node.__class__.__name__)(node, escape)
+		self.table[node.__class__](self, node, escape)
 	
 	# Constants
 	
@@ -43,7 +46,9 @@ class EscapeFinder(object):
 		pass
 	
 	def String(self, node, escape=None):
-		if not escape:
+		if self.dry:
+			return
+		elif not escape:
 			node.type = self.mod.type('&Str')
 		else:
 			node.escapes = True
@@ -116,7 +121,7 @@ class EscapeFinder(object):
 		self.visit(node.value, True)
 	
 	def Init(self, node, escape=None):
-		if escape:
+		if escape and not self.dry:
 			node.escapes = True
 	
 	def As(self, node, escape=None):
@@ -190,7 +195,7 @@ class EscapeFinder(object):
 			else:
 				self.visit(node.args[i])
 		
-		if not escape:
+		if not escape or self.dry:
 			return
 		
 		if node.fun.name == 'Runa.rt.malloc':
@@ -216,19 +221,57 @@ class EscapeFinder(object):
 	
 	def note(self, val):
 		
-		if isinstance(val, ast.String):
+		if self.dry or isinstance(val, ast.String):
 			return
 		
 		assert isinstance(val, ast.Name), val
+		if self.cur[0].escapes is None:
+			self.cur[0].escapes = {}
 		ls = self.cur[0].escapes.setdefault(val.name, [])
 		ls.append((self.cur[1], val.type))
 	
+	def block(self, id, val):
+		'''Visit the steps of a block backwards, starting from the set of
+		names tracked at its end (as a bit vector); returns the names
+		tracked at its start.'''
+		
+		self.track = set(self.names[i] for i in dataflow.bits(val))
+		bl = self.cfg.blocks[id]
+		for i, step in reversed(list(enumerate(bl.steps))):
+			self.cur = bl, i
+			self.visit(step)
+		
+		for name in self.track:
+			if name not in self.index:
+				self.index[name] = len(self.names)
+				self.names.append(name)
+			val |= 1 << self.index[name]
+		return val
+	
+	def solve(self):
+		'''Returns a list with the names tracked at the end of each block,
+		found without changing any nodes. Passing these to block() marks
+		the escaping values; blocks can be visited in any order.'''
+		self.dry = True
+		try:
+			return dataflow.solve(self.cfg, self.block, False)[0]
+		finally:
+			self.dry = False
+	
 	def find(self):
-		for bl in reversed(list(util.values(self.cfg.blocks))):
-			for i, step in reversed(list(enumerate(bl.steps))):
-				self.cur = bl, i
-				self.visit(step)
+		
+		# Tracking a name makes everything assigned to it escape. First find
+		# the names tracked at the end of each block, then make a single pass
+		# to mark escaping values.
+		
+		tracked = self.solve()
+		for id in reversed(range(len(self.cfg.blocks))):
+			self.block(id, tracked[id])
+
+def find(mod, name, code):
+	EscapeFinder(mod, code).find()
 
 def escapes(mod):
 	for name, code in mod.code:
-		EscapeFinder(mod, code).find()
+		with timing.phase('escapes', mod.name, name, code):
+			find(mod, name, code)
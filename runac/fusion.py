@@ -0,0 +1,62 @@
+'''Runs the passes after type checking together, one function at a time.
+
+Run separately, the ``specialize``, ``escapes`` and ``destruct`` passes
+each sweep over every block of every function in the module. For large
+modules, this means that each function's CFG has long been evicted from the
+CPU caches by the time the next pass gets to it. In fused mode, all three
+run on one function before moving on to the next.
+
+Not everything can be done in a single traversal:
+
+- specialization propagates types backwards through the function (and its
+  results are needed by the other passes), so it runs first, on its own;
+- escape analysis needs the names tracked at the end of every block, found
+  by a fixed point over the whole function (see ``EscapeFinder.solve()``);
+- inserting destructors needs the escaping names for each block, and all
+  blocks to be processed before inserting ``Free`` nodes.
+
+Marking escaping values and finding the values to free only need
+per-block information, so these share a single sweep over the blocks.
+The results are the same as running the passes separately. Set the
+``RUNA_NO_FUSE`` environment variable to run them separately.
+'''
+
+from . import destructor, escapes, specialize, timing
+import os
+
+PASSES = 'specialize', 'escapes', 'destruct'
+
+def enabled():
+	'''Returns False if fused mode has been disabled.'''
+	return not os.environ.get('RUNA_NO_FUSE')
+
+def run(mod, name, code, logs=None):
+	'''Runs the fused passes over the code object `code`, called `name`.
+	If `logs` is given, scope changes made by each pass are appended to
+	``logs[pass]`` (see incremental.py).'''
+	
+	def start(phase):
+		if logs is not None:
+			mod.scope.log = logs[phase]
+		return timing.phase(phase, mod.name, name, code)
+	
+	with start('specialize'):
+		specialize.propagate(mod, name, code)
+	
+	with start('escapes'):
+		finder = escapes.EscapeFinder(mod, code)
+		tracked = finder.solve()
+	
+	# Mark escaping values and find the values to free in a single sweep
+	
+	with start('destruct'):
+		destruct = destructor.Destructor(mod, code)
+		for bl in code.flow.blocks:
+			finder.block(bl.id, tracked[bl.id])
+			destruct.block(bl.id, bl)
+		destruct.finish()
+
+def fuse(mod):
+	'''Runs the fused passes over all code objects in the module.'''
+	for name, code in mod.code:
+		run(mod, name, code)
@@ -0,0 +1,313 @@
+'''Incremental code generation, reusing IR for functions that have not
+changed since a file was last compiled.
+
+After parsing, every function (or method) is assigned a key: a hash over
+its syntax tree and over the signatures of all the module-level names it
+depends on (transitively, through those signatures: calling a function makes
+a function depend on the types in its signature, using a class makes it
+depend on the class attributes and method signatures). Source positions are
+left out, so moving a function around doesn't invalidate it.
+
+The module-level declarations are always processed again, but functions
+whose key is found in the cache skip all of the per-function passes and
+code generation; their IR is taken from the cache. The only effect these
+passes have outside of the function itself is that they may add types (like
+tuples or template instances) to the module scope, which the module-level
+IR depends on. All additions are recorded when a function is processed, in
+a form that allows them to be replayed later (see ``spec()``). Functions for
+which that isn't possible (like generators, whose context type depends on
+their typed contents) are always processed from scratch.
+
+The cache entries for a file are stored together, in a single cache file.
+'''
+
+from . import (
+	ast, blocks, codegen, liveness, typer, specialize,
+	escapes, destructor, fusion, timing, types, util
+)
+import hashlib
+
+PASSES = (
+	('liveness', liveness.annotate),
+	('typer', typer.check),
+	('specialize', specialize.propagate),
+	('escapes', escapes.find),
+	('destruct', destructor.destructify),
+)
+
+def passes(mod, name, code, logs=None):
+	'''Runs all passes over the code object `code`, called `name`, one after
+	the other. If `logs` is given, scope changes made by each pass are
+	appended to ``logs[pass]``.'''
+	
+	fused = fusion.enabled()
+	try:
+		for k, fun in PASSES:
+			if fused and k == fusion.PASSES[0]:
+				fusion.run(mod, name, code, logs)
+				break
+			if logs is not None:
+				mod.scope.log = logs[k]
+			with timing.phase(k, mod.name, name, code):
+				fun(mod, name, code)
+	finally:
+		mod.scope.log = None
+
+def canonical(obj, names):
+	'''Returns a string representation of (part of) a syntax tree that does
+	not depend on source positions or the iteration order of sets. All
+	names used in the tree are added to the set `names`.'''
+	if isinstance(obj, ast.Node):
+		if isinstance(obj, ast.Name):
+			names.add(obj.name)
+		bits = [
+			'%s=%s' % (k, canonical(v, names))
+			for (k, v) in util.attribs(obj) if k not in ast.IGNORE
+		]
+		return '%s(%s)' % (obj.__class__.__name__, ', '.join(bits))
+	elif isinstance(obj, (list, tuple)):
+		return '[%s]' % ', '.join([canonical(v, names) for v in obj])
+	elif isinstance(obj, (set, frozenset)):
+		return '{%s}' % ', '.join(sorted(canonical(v, names) for v in obj))
+	else:
+		return repr(obj)
+
+def summary(obj):
+	'''Returns a tuple of canonical(obj) and the names used in it.'''
+	names = set()
+	return canonical(obj, names), names
+
+def signature(fun):
+	'''Returns the parts of the function `fun` that its users depend on.
+	The context type of a generator is laid out from its body, so users
+	of a generator depend on all of it.'''
+	if any(isinstance(n, ast.Yield) for n in ast.walk(fun.suite)):
+		return fun
+	return [fun.decor, fun.name, fun.args, fun.rtype]
+
+def declarations(node):
+	'''Returns a dict mapping module-level names to a tuple of their
+	signature (as a string) and the set of names used in the signature.'''
+	
+	decls = {}
+	for n in node.suite:
+		
+		if isinstance(n, ast.RelImport):
+			for name in n.names:
+				decls[name.name] = canonical(n, set()), set()
+		elif isinstance(n, ast.Class):
+			sig = [n.decor, n.name, n.params, n.attribs]
+			decls[n.name.name] = summary(sig + [
+				[signature(m) for m in n.methods]
+			])
+		elif isinstance(n, ast.Function):
+			decls[n.name.name] = summary(signature(n))
+		elif isinstance(n, ast.Assign):
+			decls[n.left.name] = summary(n)
+		elif isinstance(n, (ast.Trait, ast.Decl)):
+			decls[n.name.name] = summary(n)
+	
+	return decls
+
+def keys(name, node, extra):
+	'''Computes keys for all code objects in the parsed file `node`, for a
+	module called `name`. Must be called before the syntax tree is turned
+	into a Module. Returns a dict mapping code object names (as used in
+	`Module.code`) to keys; `extra` is included in all keys.'''
+	
+	decls = declarations(node)
+	code = []
+	for n in node.suite:
+		if isinstance(n, ast.Function):
+			code.append((n.name.name, n, set()))
+		elif isinstance(n, ast.Class):
+			for m in n.methods:
+				code.append(((n.name.name, m.name.name), m, {n.name.name}))
+	
+	res, seen = {}, set()
+	for k, fun, deps in code:
+		
+		# Overloaded functions share a name; don't try to cache them
+		
+		if k in seen:
+			res.pop(k, None)
+			continue
+		
+		seen.add(k)
+		body = canonical(fun, deps)
+		queue = list(deps)
+		while queue:
+			for dep in decls.get(queue.pop(), ('', ()))[1]:
+				if dep not in deps:
+					deps.add(dep)
+					queue.append(dep)
+		
+		h = hashlib.sha1(('%s\0%s\0' % (extra, name)).encode('utf-8'))
+		h.update(body.encode('utf-8'))
+		for dep in sorted(deps):
+			if dep in decls:
+				h.update(('\0%s\0%s' % (dep, decls[dep][0])).encode('utf-8'))
+		res[k] = h.hexdigest()
+	
+	return res
+
+# Recording and replaying additions to the module scope
+
+def spec(mod, obj, names, lookup=True):
+	'''Returns a picklable description of a scope key or type `obj` from
+	which it can be rebuilt (see build()). Types are found by name if they
+	are in `names`, which should only contain names from the module's
+	declarations. Raises ValueError if no description can be found.'''
+	
+	if isinstance(obj, str):
+		return 's', obj
+	elif isinstance(obj, tuple):
+		return 't', tuple(spec(mod, v, names) for v in obj)
+	elif isinstance(obj, types.owner):
+		return 'owner', spec(mod, obj.over, names)
+	elif isinstance(obj, types.ref):
+		return 'ref', (spec(mod, obj.over, names), obj.mut)
+	elif isinstance(obj, types.opt):
+		return 'opt', spec(mod, obj.over, names)
+	
+	kinds = types.base, types.trait, types.template
+	if not isinstance(obj, kinds):
+		raise ValueError(obj)
+	elif lookup and obj.name in names and mod.scope.get(obj.name) == obj:
+		return 'n', obj.name
+	elif isinstance(obj, types.concrete) and obj.name.startswith('tuple['):
+		return 'tuple', spec(mod, obj.params, names)
+	elif isinstance(obj, types.concrete) and '[' in obj.name:
+		tpl = obj.name.split('[', 1)[0]
+		if tpl not in names:
+			raise ValueError(obj)
+		return 'apply', (tpl, spec(mod, obj.params, names))
+	
+	raise ValueError(obj)
+
+def build(mod, spec):
+	'''Rebuild a scope key or type from its description, see spec().'''
+	kind, val = spec
+	if kind == 's':
+		return val
+	elif kind == 't':
+		return tuple(build(mod, v) for v in val)
+	elif kind == 'owner':
+		return types.owner(build(mod, val))
+	elif kind == 'ref':
+		return types.ref(build(mod, val[0]), val[1])
+	elif kind == 'opt':
+		return types.opt(build(mod, val))
+	elif kind == 'n':
+		return mod.scope[val]
+	elif kind == 'tuple':
+		return types.build_tuple(build(mod, val))
+	elif kind == 'apply':
+		return types.apply(mod.scope[val[0]], build(mod, val[1]))
+	assert False, spec
+
+def record(mod, log, names):
+	'''Turns a log of scope assignments into a list of descriptions. Raises
+	ValueError if any of them can't be rebuilt.'''
+	res = []
+	for k, v in log:
+		res.append((spec(mod, k, names), spec(mod, v, names, False)))
+		if build(mod, res[-1][0]) != k or build(mod, res[-1][1]) != v:
+			raise ValueError(v)
+	return res
+
+def declared(mod):
+	'''Returns the set of names in the scope of the module `mod`, after its
+	declarations have been processed (see typer.declare()).'''
+	names, scope = set(), mod.scope
+	while isinstance(scope, blocks.Scope):
+		names |= set(scope.data)
+		scope = scope.parent
+	return names | set(scope)
+
+def generate(mod, keys, entries, jobs=1):
+	'''Runs all passes over the module `mod` and generates IR for it. `keys`
+	contains the keys for its code objects (see keys()), `entries` the cache
+	entries from earlier runs, indexed by key. Code objects not found in the
+	cache are processed in `jobs` worker processes (see parallel.py).
+	
+	Returns a tuple of the IR, the cache entries for the current version
+	of the module and a list with the names of the code objects which had
+	to be processed.'''
+	
+	with timing.phase('typer', mod.name):
+		typer.declare(mod)
+	names = declared(mod)
+	
+	clean = {}
+	for k, fun in mod.code:
+		if keys.get(k) in entries and not fun.flow.yields:
+			clean[k] = entries[keys[k]]
+	
+	# Results from worker processes are replayed like cache entries
+	
+	from . import parallel # imports this module
+	with timing.phase('parallel', mod.name):
+		todo = set(k for (k, fun) in mod.code if k not in clean)
+		done = parallel.run(mod, names, todo, jobs)
+	replay = dict(clean)
+	replay.update(done)
+	
+	# In fused mode, the passes after type checking are run by the first
+	# of them (see fusion.py); scope changes are still logged per pass.
+	
+	fused = fusion.enabled()
+	logs = {}
+	for name, fun in PASSES:
+		
+		group = name,
+		if fused and name in fusion.PASSES:
+			if name != fusion.PASSES[0]:
+				continue
+			group = fusion.PASSES
+		
+		for k, code in mod.code:
+			
+			if k in replay:
+				for n in group:
+					for kspec, vspec in replay[k]['scope'][n]:
+						mod.scope[build(mod, kspec)] = build(mod, vspec)
+				continue
+			
+			log = logs.setdefault(k, {})
+			log.update((n, []) for n in group)
+			try:
+				if len(group) > 1:
+					fusion.run(mod, k, code, log)
+					continue
+				mod.scope.log = log[name]
+				with timing.phase(name, mod.name, k, code):
+					fun(mod, k, code)
+			finally:
+				mod.scope.log = None
+	
+	cached = {k: v['ir'] for (k, v) in util.items(replay)}
+	header, code = codegen.functions(mod, cached)
+	
+	new, dirty = {}, []
+	for (k, fun), ir in zip(mod.code, code):
+		
+		if k in clean:
+			new[keys[k]] = clean[k]
+			continue
+		
+		dirty.append(k)
+		if k not in keys or fun.flow.yields:
+			continue
+		elif k in done:
+			new[keys[k]] = done[k]
+			continue
+		
+		try:
+			scope = {n: record(mod, logs[k][n], names) for n, f in PASSES}
+		except ValueError:
+			continue
+		
+		new[keys[k]] = {'ir': ir, 'scope': scope}
+	
+	return header + ''.join(code), new, dirty
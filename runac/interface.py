@@ -0,0 +1,115 @@
+'''Interface summaries for separately compiled modules.
+
+A program can be split over several files: ``from shapes import Point``
+imports ``Point`` from the module in ``shapes.rns``, and dotted module names
+map to subdirectories. Modules are found relative to the directory that
+contains the program's main file. Each module is compiled on its own, to its
+own IR and object file, with its functions named ``Runa.<module>.<name>``.
+
+Along with the IR, compiling a module yields an interface: the types of
+everything the module defines at the top level (function declarations,
+classes with their layout and methods, traits, and the context types that
+importers need to iterate over its generators), plus any other types these
+refer to. Importing modules are type checked against the interfaces of their
+dependencies only, so the dependencies don't have to be parsed again. The
+imported names are put in a scope between the core library and the module
+scope; all types from the interfaces are added there as well, under dotted
+names that can't be referenced from source code, so that code generation
+can declare them.
+
+Every interface has a digest over a description of its contents. A module
+only has to be processed again if its source changes or if the digest
+for one of its dependencies does; since function bodies are not part of
+the interface, changing them doesn't affect any importers.
+'''
+
+from . import blocks, types, util
+import hashlib
+
+KINDS = types.base, types.trait, types.template
+RESERVED = {'core', 'rt', '__main__'}
+
+class Interface(util.AttribRepr):
+
+	def __init__(self, name, names, types):
+		self.name = name
+		self.names = names
+		self.types = types
+		self.digest = digest(names, types)
+
+def describe(obj):
+	'''Returns a string describing a declaration or type, including all
+	parts of it that importers depend on.'''
+	if isinstance(obj, types.FunctionDecl):
+		return repr(obj)
+	attribs = sorted(util.items(obj.attribs))
+	methods = sorted(util.items(obj.methods))
+	params = getattr(obj, 'params', ())
+	return '%r %r %r %r' % (obj, params, attribs, methods)
+
+def digest(names, types):
+	bits = ['%s=%s' % (k, describe(v)) for (k, v) in util.items(names)]
+	bits += ['%r:%s' % (k, describe(v)) for (k, v) in util.items(types)]
+	h = hashlib.sha1()
+	for s in sorted(bits):
+		h.update((s + '\0').encode('utf-8'))
+	return h.hexdigest()
+
+def known(core):
+	'''Returns a dict of the types in the core scope `core`, to be passed
+	to the cache functions so that interfaces refer to these instead of
+	containing copies of them.'''
+	res = {}
+	for k, v in core.allitems():
+		if isinstance(k, str) and isinstance(v, KINDS):
+			res[k] = v
+			res[k + '.class'] = v.__class__
+	return res
+
+def summarize(name, mod, core):
+	'''Build the Interface for the typed module `mod`, which was imported
+	as `name`. `core` is the scope of the core library. Code must already
+	have been generated for the module, so that the context types for its
+	generators have been laid out; importers need these to iterate over
+	the generators.'''
+	
+	names, found = {}, {}
+	for k, v in util.items(mod.scope):
+		if isinstance(v, KINDS) and v.name.endswith('$ctx'):
+			found[k] = v
+		elif isinstance(k, str) and isinstance(v, types.FunctionDecl):
+			names[k] = v
+		elif isinstance(v, KINDS):
+			if isinstance(k, str):
+				names[k] = v
+				k = '%s.%s' % (name, k)
+			found[k] = v
+	
+	# Pass on the types from this module's own imports
+	
+	scope = mod.scope.parent
+	while isinstance(scope, blocks.Scope) and scope is not core:
+		for k, v in util.items(scope):
+			if isinstance(v, KINDS) and (isinstance(k, tuple) or '.' in k):
+				found[k] = v
+		scope = scope.parent
+	
+	return Interface(name, names, found)
+
+def scope(core, imports):
+	'''Returns a scope for a module with the given `imports`, a list of
+	(RelImport node, Interface) pairs. Its parent is the core scope.'''
+	
+	res = blocks.Scope(core)
+	for node, iface in imports:
+		for k, v in util.items(iface.types):
+			res[k] = v
+	
+	for node, iface in imports:
+		for name in node.names:
+			if name.name not in iface.names:
+				msg = "module '%s' has no name '%s'"
+				raise util.Error(name, msg % (iface.name, name.name))
+			res[name.name] = iface.names[name.name]
+	
+	return res
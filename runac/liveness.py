@@ -12,22 +12,18 @@ all the analyses we have to do
 still need somewhat accurate data on variable usage.
 '''
 
-from . import ast, util
+from . import ast, timing
 
-class Analyzer(object):
+class Analyzer(ast.Visitor):
 	
 	def __init__(self):
 		self.vars = None
 		
 	def visit(self, node):
-		
-		if node is None:
-			return
-		
-		if hasattr(self, node.__class__.__name__):
-			getattr(self, node.__class__.__name__)(node)
-			return
-		
+		if node is not None:
+			self.table[node.__class__](self, node)
+	
+	def generic(self, node):
 		for k in node.fields:
 			self.visit(getattr(node, k))
 	
@@ -75,29 +71,30 @@ class Analyzer(object):
 		self.visit(node.left[1])
 		self.visit(node.right[1])
 
-def liveness(mod):
+def annotate(mod, fname, code, analyzer=None):
 	
-	analyzer = Analyzer()
-	for fname, code in mod.code:
-		
-		vars = code.flow.vars
-		for arg in code.args:
-			name = arg.name.name
-			sets = vars.setdefault(name, {}).setdefault('sets', {})
-			sets[None] = {-1: None}
+	analyzer = Analyzer() if analyzer is None else analyzer
+	flow = code.flow
+	for arg in code.args:
+		flow.define(arg.name.name, None, -1)
+	
+	for bl in flow.blocks:
 		
-		blocks = sorted(util.items(code.flow.blocks))
-		for id, bl in blocks:
+		uses = set()
+		for i, step in enumerate(bl.steps):
 			
-			for i, step in enumerate(bl.steps):
-				
-				analyzer.vars = set(), set()
-				analyzer.visit(step)
-				
-				for name in analyzer.vars[0]:
-					uses = vars.setdefault(name, {}).setdefault('uses', {})
-					uses.setdefault(id, set()).add(i)
-				
-				for name in analyzer.vars[1]:
-					sets = vars.setdefault(name, {}).setdefault('sets', {})
-					sets.setdefault(id, {})[i] = None
+			analyzer.vars = set(), set()
+			analyzer.visit(step)
+			uses.update(flow.var(name) for name in analyzer.vars[0])
+			for name in analyzer.vars[1]:
+				flow.define(name, bl.id, i)
+		
+		bl.uses = tuple(sorted(uses))
+	
+	flow.reach = None
+
+def liveness(mod):
+	analyzer = Analyzer()
+	for fname, code in mod.code:
+		with timing.phase('liveness', mod.name, fname, code):
+			annotate(mod, fname, code, analyzer)
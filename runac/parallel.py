@@ -0,0 +1,117 @@
+'''Parallel type checking and code generation for the functions in a module.
+
+Once ``typer.declare()`` has filled in the module scope (the signatures of
+all functions and the layouts of all classes), type checking a function, the
+passes after it and code generation mostly only touch the function itself.
+They are farmed out to a pool of worker processes, forked from the compiler
+after the declarations have been processed. Each worker returns the IR for a
+function, along with the changes it made to the module scope, recorded as for
+the cache of unchanged functions (see incremental.py). The results are then
+used just like cache entries: scope changes are replayed in the order the
+functions would have been processed in, and the IR for the functions is
+stitched together in the order of ``Module.code``, so the output is the
+same as when compiling sequentially.
+
+Shared state in the module scope is handled as follows:
+
+- Types created while processing a function (tuples, template instances)
+  are created separately in each worker and rebuilt from their descriptions
+  in the compiler; types are interned, so the same type is only defined once.
+- The context type for a generator is created when the generator is typed
+  and laid out from its code. Each worker processes the generators in order,
+  before the functions after them, so that later functions can iterate over
+  them. Generators themselves are always processed by the compiler.
+- Overloaded functions, functions whose scope changes can't be recorded and
+  any function with a compile error are processed by the compiler, in
+  order, so that errors are reported as they would be sequentially. Such
+  fallbacks from a worker are counted as ``fallback`` phases (see
+  timing.py). Other exceptions in a worker are internal errors and are
+  passed on to the compiler.
+'''
+
+from . import codegen, incremental, timing, types, util
+import collections, multiprocessing
+
+class Worker(object):
+	'''Processes functions from the module `mod`, which must already have
+	been declared. `names` contains the names from the module declarations
+	(see incremental.spec()).'''
+	
+	def __init__(self, mod, names):
+		self.mod = mod
+		self.names = names
+		self.gen = None
+		self.done = 0
+	
+	def generators(self, end):
+		'''Processes and lays out the generators before index `end`.'''
+		
+		mod = self.mod
+		if self.gen is None:
+			gen = codegen.CodeGen(mod, 'i%i' % types.WORD_SIZE)
+			gen.constants(mod)
+			self.gen, gen.buf = gen, []
+		
+		for k, fun in mod.code[self.done:end]:
+			if fun.flow.yields:
+				incremental.passes(mod, k, fun)
+				self.gen.context(mod.scope[fun.irname + '$ctx'], fun)
+		self.done = max(self.done, end)
+	
+	def process(self, i):
+		'''Processes the code object at index `i`. Returns a tuple of `i`
+		and an entry like those in the cache, or None if it failed.'''
+		
+		k, fun = self.mod.code[i]
+		logs = dict((name, []) for (name, f) in incremental.PASSES)
+		try:
+			self.generators(i)
+			incremental.passes(self.mod, k, fun, logs)
+			ir = self.gen.function(fun)
+			scope = dict(
+				(n, incremental.record(self.mod, logs[n], self.names))
+				for n in logs
+			)
+		except (util.Error, ValueError): # see incremental.record()
+			if self.gen is not None:
+				self.gen.buf = []
+			return i, None
+		
+		return i, {'ir': ir, 'scope': scope}
+
+WORKER = None
+
+def init(mod, names):
+	global WORKER
+	WORKER = Worker(mod, names)
+
+def process(i):
+	return WORKER.process(i)
+
+def run(mod, names, todo, jobs):
+	'''Processes the code objects in `mod` named in `todo` in a pool of
+	`jobs` worker processes. Returns a dict mapping the names of the code
+	objects processed successfully to entries like those in the cache.'''
+	
+	counts = collections.Counter(k for (k, fun) in mod.code)
+	work = [
+		i for (i, (k, fun)) in enumerate(mod.code)
+		if k in todo and counts[k] == 1 and not fun.flow.yields
+	]
+	if jobs < 2 or len(work) < 2:
+		return {}
+	
+	jobs = min(jobs, len(work))
+	chunk = max(1, len(work) // (4 * jobs))
+	pool = multiprocessing.Pool(jobs, init, (mod, names))
+	try:
+		res = {}
+		for i, entry in pool.imap_unordered(process, work, chunk):
+			if entry is not None:
+				res[mod.code[i][0]] = entry
+			else:
+				timing.count('fallback', mod.name, mod.code[i][0])
+		return res
+	finally:
+		pool.terminate()
+		pool.join()
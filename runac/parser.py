@@ -1,5 +1,10 @@
-from . import ast, util
-import rply
+from . import ast, util, cache, timing
+import os, re, rply
+from rply.errors import LexingError
+from rply.token import SourcePosition
+from rply.grammar import Grammar
+from rply.parser import LRParser
+from rply.parsergenerator import LRTable
 
 NAME_LIKE = {
 	'and', 'as', 'break', 'class', 'continue', 'def', 'elif', 'else',
@@ -7,65 +12,70 @@ NAME_LIKE = {
 	'pass', 'raise', 'return', 'trait', 'try', 'while', 'yield',
 }
 
+# Lexer rules, in order of precedence: at each position, the first rule that
+# matches determines the token type (rather than the longest match).
+
+RULES = [
+	('ARROW', '->'),
+	('IADD', '\+='),
+	('EQ', '=='),
+	('NE', '!='),
+	('GE', '>='),
+	('LE', '<='),
+	('LBRA', '\['),
+	('RBRA', '\]'),
+	('PLUS', '\+'),
+	('MINUS', '-'),
+	('MUL', '\*'),
+	('DIV', '/'),
+	('LACC', '{'),
+	('RACC', '}'),
+	('LT', '<'),
+	('GT', '>'),
+	('DOT', '\.'),
+	('AMP', '&'),
+	('DOLLAR', '\$'),
+	('PIPE', '\|'),
+	('CARET', '\^'),
+	('TILDE', '~'),
+	('MOD', '%'),
+	('LPAR', '\('),
+	('RPAR', '\)'),
+	('ASGT', '='),
+	('COMMA', ','),
+	('COLON', ':'),
+	('QM', '\?'),
+	('STR', r"'(.*?)'"),
+	('STR', r'"(.*?)"'),
+	('BOOL', 'True|False'),
+	('NONE', 'None'),
+	('NAME', r'[a-zA-Z_][a-zA-Z0-9_]*'),
+	('NUM', r'[-+?[0-9]*\.?[0-9]+'),
+	('NL', r'\n'),
+	('COM', r'#(.*)'),
+	('TABS', r'\t+'),
+]
+
+IGNORE = r' +'
+
 def lexer():
 	lg = rply.LexerGenerator()
-	lg.add('ARROW', '->')
-	lg.add('IADD', '\+=')
-	lg.add('EQ', '==')
-	lg.add('NE', '!=')
-	lg.add('GE', '>=')
-	lg.add('LE', '<=')
-	lg.add('LBRA', '\[')
-	lg.add('RBRA', '\]')
-	lg.add('PLUS', '\+')
-	lg.add('MINUS', '-')
-	lg.add('MUL', '\*')
-	lg.add('DIV', '/')
-	lg.add('LACC', '{')
-	lg.add('RACC', '}')
-	lg.add('LT', '<')
-	lg.add('GT', '>')
-	lg.add('DOT', '\.')
-	lg.add('AMP', '&')
-	lg.add('DOLLAR', '\$')
-	lg.add('PIPE', '\|')
-	lg.add('CARET', '\^')
-	lg.add('TILDE', '~')
-	lg.add('MOD', '%')
-	lg.add('LPAR', '\(')
-	lg.add('RPAR', '\)')
-	lg.add('ASGT', '=')
-	lg.add('COMMA', ',')
-	lg.add('COLON', ':')
-	lg.add('QM', '\?')
-	lg.add('STR', r"'(.*?)'")
-	lg.add('STR', r'"(.*?)"')
-	lg.add('BOOL', 'True|False')
-	lg.add('NONE', 'None')
-	lg.add('NAME', r'[a-zA-Z_][a-zA-Z0-9_]*')
-	lg.add('NUM', r'[-+?[0-9]*\.?[0-9]+')
-	lg.add('NL', r'\n')
-	lg.add('COM', r'#(.*)')
-	lg.add('TABS', r'\t+')
-	lg.ignore(r' +')
+	for name, pattern in RULES:
+		lg.add(name, pattern)
+	lg.ignore(IGNORE)
 	return lg.build()
 
-LEXER = lexer()
+LEXER = None
 
-def lex(src):
-	'''Takes a string containing source code and returns a generator over
-	tokens, represented by a three-element tuple:
+def lex_rply(src):
+	'''Equivalent to lex(), but built on rply's lexer, which tries each of
+	the rules in turn for every token. This is much slower; it's kept as
+	a reference implementation for testing lex().'''
 	
-	- Token type (from the list in lexer(), above)
-	- The literal token contents
-	- Position, as a tuple of line and column (both 1-based)
+	global LEXER
+	if LEXER is None:
+		LEXER = lexer()
 	
-	This is mostly a wrapper around the rply lexer, but it reprocesses
-	TABS tokens (which should only appear at the start of a line) into
-	INDENT and DEDENT tokens, which only appear if the indentation
-	level increases or decreases.
-	
-	Comment tokens do not appear in the output generator.'''
 	level = 0
 	hold = []
 	for t in LEXER.lex(src):
@@ -93,14 +103,124 @@ def lex(src):
 			t.name = t.value.upper()
 		
 		yield t
-
+	
 	for t in hold:
 		yield t
-
+	
 	while level > 0:
 		yield rply.Token('DEDENT', '', t.source_pos)
 		level -= 1
 
+def scanner():
+	'''Compiles all of the lexer rules into a single regular expression.
+	Alternatives are tried in order, which gives the same result as trying
+	each rule in turn. Returns the expression and a dict mapping group names
+	to token types.'''
+	parts, names = [], {}
+	for i, (name, pattern) in enumerate(RULES):
+		names['t%i' % i] = name
+		parts.append('(?P<t%i>%s)' % (i, pattern))
+	return re.compile('|'.join(parts)), names
+
+SCANNER = None
+SPACES = re.compile(IGNORE)
+
+# Any number of lines containing only whitespace and comments
+BLANK = re.compile(r'(?:[ \t]*(?:#.*)?\n)+')
+
+def lex(src):
+	'''Takes a string containing source code and returns a generator over
+	tokens, represented by a three-element tuple:
+	
+	- Token type (from the list in RULES, above)
+	- The literal token contents
+	- Position, as a tuple of line and column (both 1-based)
+	
+	TABS tokens (which should only appear at the start of a line) are
+	reprocessed into INDENT and DEDENT tokens, which only appear if the
+	indentation level increases or decreases. To find out, newlines are held
+	back until the next significant token. Lines containing only whitespace
+	and comments are skipped in one go, keeping only the last newline.
+	
+	Comment tokens do not appear in the output generator.
+	
+	All rules are matched with a single regular expression (see scanner()),
+	which is compiled the first time this is called. Tokens and positions
+	are the same as with rply's lexer (see lex_rply()).'''
+	
+	global SCANNER
+	if SCANNER is None:
+		SCANNER = scanner()
+	
+	match, names = SCANNER[0].match, SCANNER[1]
+	blank, spaces = BLANK.match, SPACES.match
+	Token, Pos = rply.Token, SourcePosition
+	
+	idx, end, lineno, colno, bol = 0, len(src), 1, 1, 0
+	level, hold, last = 0, [], None
+	while idx < end:
+		
+		if src[idx] == ' ':
+			idx = spaces(src, idx).end()
+			continue
+		
+		m = match(src, idx)
+		if m is None:
+			raise LexingError(None, Pos(idx, lineno, colno))
+		
+		name, start, idx = names[m.lastgroup], idx, m.end()
+		colno = start - bol + 1
+		last = start, lineno, colno
+		
+		if name == 'NL':
+			
+			# Fast path: skip any following blank lines
+			
+			skip = blank(src, idx)
+			if skip is not None:
+				lineno += skip.group().count('\n')
+				start = skip.end() - 1
+				bol = src.rfind('\n', 0, start) + 1
+				colno = start - bol + 1
+				last = start, lineno, colno
+				idx = skip.end()
+			
+			t = Token('NL', '\n', Pos(start, lineno, colno))
+			lineno, bol = lineno + 1, start + 1
+			hold = [t]
+			continue
+		
+		elif name == 'COM':
+			continue
+		
+		t = Token(name, m.group(), Pos(start, lineno, colno))
+		if name == 'TABS' and hold:
+			hold.append(t)
+			continue
+		
+		if hold:
+			yield hold[0]
+			cur = len(hold[1].value) if len(hold) > 1 else 0
+			pos = hold[1 if len(hold) > 1 else 0].source_pos
+			for i in range(abs(cur - level)):
+				type = 'INDENT' if cur > level else 'DEDENT'
+				yield Token(type, '', pos)
+				level = cur
+			hold = []
+		
+		if name == 'NAME' and t.value in NAME_LIKE:
+			t.name = t.value.upper()
+		
+		yield t
+	
+	for t in hold:
+		yield t
+		last = t.source_pos.idx, t.source_pos.lineno, t.source_pos.colno
+	
+	while level > 0:
+		yield Token('DEDENT', '', Pos(*last))
+		level -= 1
+
 pg = rply.ParserGenerator([
 		'AMP', 'AND', 'ARROW', 'AS', 'ASGT',
 		'BOOL', 'BREAK',
@@ -755,7 +875,441 @@ def none(s, p):
 def error(s, t):
 	raise util.ParseError(s.fn, t, s.pos(t))
 
-parser = pg.build()
+PARSER = None
+TABLES = 'lr_action', 'lr_goto', 'default_reductions'
+
+def grammar():
+	'''Returns the rply Grammar for the productions defined above, without
+	doing any of the analysis needed to compute the parse tables.'''
+	g = Grammar(pg.tokens)
+	for level, (assoc, terms) in enumerate(pg.precedence, 1):
+		for term in terms:
+			g.set_precedence(term, assoc, level)
+	for name, syms, func, prec in pg.productions:
+		g.add_production(name, syms, func, prec)
+	g.set_start()
+	return g
+
+def build():
+	'''Returns the LR parser for the grammar defined above. Building the
+	parse tables takes a while, so this is only done on first use, and
+	the tables are saved in the cache (see cache.py), keyed on the
+	tokens, the precedence list and the productions.'''
+	
+	global PARSER
+	if PARSER is not None:
+		return PARSER
+	
+	rules = [(name, syms, prec) for (name, syms, f, prec) in pg.productions]
+	grammar_repr = repr((pg.tokens, pg.precedence, rules))
+	key = cache.digest([], rply.__version__, grammar_repr)
+	data = cache.load('parser', key)
+	if data is None:
+		PARSER = pg.build()
+		tables = {k: getattr(PARSER.lr_table, k) for k in TABLES}
+		cache.store('parser', key, tables)
+		return PARSER
+	
+	# Conflicts were already reported when the tables were built
+	
+	lr_action, lr_goto, reductions = (data[k] for k in TABLES)
+	table = LRTable(grammar(), lr_action, lr_goto, reductions, [], [])
+	PARSER = LRParser(table, pg.error_handler)
+	return PARSER
+
+# Hand-written parser: recursive descent for everything down to expressions,
+# which are handled by a Pratt parser (see doc/notes.rst). It calls the same
+# production functions as the LR parser, so the syntax tree is the same.
+
+LEVELS = {
+	term: level
+	for (level, (assoc, terms)) in enumerate(pg.precedence, 1)
+	for term in terms
+}
+
+BINARY = {
+	'OR': or_, 'AND': and_, 'AMP': bwand, 'PIPE': bwor, 'CARET': bwxor,
+	'IS': is_, 'EQ': eq, 'NE': ne, 'LT': lt, 'GT': gt, 'LE': le, 'GE': ge,
+	'PLUS': plus, 'MINUS': minus, 'MUL': mul, 'DIV': div, 'MOD': mod,
+}
+
+LITERALS = {
+	'NAME': var, 'STR': string, 'NUM': number, 'BOOL': bool_, 'NONE': none,
+}
+
+# Tokens that can follow a type (see Parser.type())
+
+TYPE_FOLLOW = set(BINARY) | {
+	'AS', 'COLON', 'COMMA', 'DOT', 'ELSE', 'IF', 'LPAR', 'NL', 'RBRA', 'RPAR',
+}
+
+# Returned after the last token, like the LR parser does
+
+END = rply.Token('$end', '$end')
+
+class Parser(object):
+	'''Parses a stream of tokens into the same syntax tree as the LR parser,
+	raising ParseError on the same token in most cases.
+	
+	In the LR parser, a call has lower precedence than any operator: the
+	expression to the left of an opening parenthesis is reduced as far as
+	possible before it is shifted, so ``a + b(c)`` calls ``a + b``. Calls
+	are only parsed at the top level of expr() to get the same result.'''
+	
+	def __init__(self, state, tokens):
+		self.s = state
+		self.tokens = iter(tokens)
+		self.ahead = []
+		self.i = 0
+		self.t = next(self.tokens, END)
+		self.last = None
+	
+	def next(self):
+		'''Consumes the current token and returns it. Like the LR parser,
+		this reads tokens from the lexer as needed, so that a parse error is
+		found before any lexing errors further on.'''
+		t = self.last = self.t
+		self.i += 1
+		self.t = self.ahead.pop() if self.ahead else next(self.tokens, END)
+		return t
+	
+	def peek(self):
+		'''Returns the token after the current one.'''
+		if not self.ahead:
+			self.ahead.append(next(self.tokens, END))
+		return self.ahead[0]
+	
+	def expect(self, name):
+		if self.t.name != name:
+			error(self.s, self.t)
+		return self.next()
+	
+	def name(self):
+		return var(self.s, [self.expect('NAME')])
+	
+	# Top level
+	
+	def module(self):
+		if self.t.name == 'NL':
+			self.next()
+		elems = [self.module_elem()]
+		while self.t.name != '$end':
+			elems.append(self.module_elem())
+		return module(self.s, [elems])
+	
+	def module_elem(self):
+		name, s = self.t.name, self.s
+		if name == 'DEF':
+			return self.definition()
+		elif name == 'CLASS':
+			return self.cls()
+		elif name == 'TRAIT':
+			return self.trait()
+		elif name == 'FROM':
+			t, base = self.next(), self.name()
+			if self.t.name == 'DOT':
+				base = dotted_attr(s, [base, self.next(), self.expect('NAME')])
+			p = [t, base, self.expect('IMPORT'), self.names()]
+			return from_import(s, p + [self.expect('NL')])
+		
+		start = self.i
+		left = self.lvals(start, self.expr())
+		p = [left, self.expect('ASGT'), self.expr_tuple()]
+		return asgt(s, p + [self.expect('NL')])
+	
+	def names(self):
+		res = [self.name()]
+		while self.t.name == 'COMMA':
+			self.next()
+			res.append(self.name())
+		return res
+	
+	def definition(self, decl=True, body=True):
+		'''Parses a function (if `body`) or a function declaration (if
+		`decl`), depending on what follows the signature.'''
+		
+		p = [self.expect('DEF'), self.name(), self.formals()]
+		if self.t.name == 'ARROW':
+			self.next()
+			p.append(self.type())
+		else:
+			p.append(None)
+		
+		if decl and (self.t.name == 'NL' or not body):
+			return function_decl(self.s, p + [self.expect('NL')])
+		return function(self.s, p + [self.expect('COLON'), self.suite()])
+	
+	def formals(self):
+		self.expect('LPAR')
+		res = []
+		if self.t.name == 'RPAR':
+			self.next()
+			return res
+		
+		while True:
+			n = self.name()
+			if self.t.name == 'COLON':
+				p = [n, self.next(), self.type()]
+				res.append(typed_formal(self.s, p))
+			else:
+				res.append(untyped_formal(self.s, [n]))
+			if self.t.name != 'COMMA':
+				break
+			self.next()
+		self.expect('RPAR')
+		return res
+	
+	def params(self):
+		'''Parses a list of type parameters. The grammar only allows one
+		parameter per pair of brackets: ``[[A], B]`` or ``[, A]``.'''
+		if self.t.name != 'LBRA':
+			return []
+		self.next()
+		if self.t.name in ('LBRA', 'COMMA'):
+			res = self.params()
+			self.expect('COMMA')
+			res.append(self.type())
+		else:
+			res = [self.type()]
+		self.expect('RBRA')
+		return res
+	
+	def cls(self):
+		s = self.s
+		p = [self.next(), self.name(), self.params(), self.expect('COLON')]
+		p += [self.expect('NL'), self.expect('INDENT')]
+		attribs, methods = [], []
+		if self.t.name == 'PASS':
+			self.next()
+			self.expect('NL')
+		elif self.t.name not in ('NAME', 'DEF'):
+			error(s, self.t)
+		else:
+			while self.t.name == 'NAME':
+				attr = [self.name(), self.expect('COLON'), self.type()]
+				attribs.append(attr_decl(s, attr + [self.expect('NL')]))
+			while self.t.name == 'DEF':
+				methods.append(self.definition(decl=False))
+		
+		return cls(s, p + [(attribs, methods), self.expect('DEDENT')])
+	
+	def trait(self):
+		p = [self.next(), self.name(), self.params(), self.expect('COLON')]
+		p += [self.expect('NL'), self.expect('INDENT')]
+		methods = [self.definition(body=False)]
+		while self.t.name == 'DEF':
+			methods.append(self.definition(body=False))
+		return trait(self.s, p + [methods, self.expect('DEDENT')])
+	
+	# Statements
+	
+	def suite(self):
+		self.expect('NL')
+		self.expect('INDENT')
+		res = statements_single(self.s, [self.stmt()])
+		while self.t.name != 'DEDENT':
+			res.stmts.append(self.stmt())
+		self.next()
+		return res
+	
+	def stmt(self):
+		
+		s, name = self.s, self.t.name
+		if name == 'IF':
+			p = [self.next(), self.ternary(), self.expect('COLON')]
+			res = simple_if_suite(s, p + [self.suite()])
+			while self.t.name == 'ELIF':
+				p = [self.next(), self.ternary(), self.expect('COLON')]
+				res.blocks.append(elif_(s, p + [self.suite()]))
+			if self.t.name == 'ELSE':
+				self.next()
+				self.expect('COLON')
+				res.blocks.append((None, self.suite()))
+			return res
+		
+		elif name == 'FOR':
+			t, start = self.next(), self.i
+			p = [t, self.lvals(start, self.expr()), self.expect('IN')]
+			p += [self.expr_tuple(), self.expect('COLON')]
+			return for_stmt(s, p + [self.suite()])
+		elif name == 'WHILE':
+			p = [self.next(), self.ternary(), self.expect('COLON')]
+			return while_stmt(s, p + [self.suite()])
+		elif name == 'TRY':
+			p = [self.next(), self.expect('COLON'), self.suite()]
+			p += [self.expect('EXCEPT'), self.name(), self.expect('COLON')]
+			return try_stmt(s, p + [self.suite()])
+		elif name == 'RETURN':
+			t = self.next()
+			if self.t.name == 'NL':
+				return void_return(s, [t, self.next()])
+			return value_return(s, [t, self.expr_tuple(), self.expect('NL')])
+		elif name == 'YIELD':
+			t = self.next()
+			return value_yield(s, [t, self.expr_tuple(), self.expect('NL')])
+		elif name == 'RAISE':
+			return raise_(s, [self.next(), self.ternary(), self.expect('NL')])
+		elif name == 'BREAK':
+			return break_(s, [self.next(), self.expect('NL')])
+		elif name == 'CONTINUE':
+			return continue_(s, [self.next(), self.expect('NL')])
+		elif name == 'PASS':
+			return pass_(s, [self.next(), self.expect('NL')])
+		
+		start = self.i
+		left = self.expr()
+		if self.t.name == 'NL':
+			return expr_stmt(s, [left, self.next()])
+		
+		left = self.lvals(start, left)
+		if self.t.name == 'IADD':
+			p = [left, self.next(), self.expr_tuple()]
+			return iadd(s, p + [self.expect('NL')])
+		
+		p = [left, self.expect('ASGT'), self.expr_tuple()]
+		return asgt(s, p + [self.expect('NL')])
+	
+	def lvals(self, start, left):
+		'''Takes an expression `left`, which was parsed starting at token
+		index `start`, and parses any further comma-separated targets.'''
+		self.lval(start, left)
+		while self.t.name == 'COMMA':
+			t, start = self.next(), self.i
+			right = self.expr()
+			self.lval(start, right)
+			left = lval_tuple(self.s, [left, t, right])
+		return left
+	
+	def lval(self, start, node):
+		'''Raises ParseError unless the expression `node` (parsed from token
+		index `start`) is a single name or ends in an attribute lookup;
+		these are the only expressions the grammar allows as assignment
+		targets. An expression that ends in a name can only result in an
+		Attrib node if the name is part of an attribute lookup.'''
+		if self.last.name != 'NAME':
+			error(self.s, self.t)
+		elif self.i != start + 1 and not isinstance(node, ast.Attrib):
+			error(self.s, self.t)
+	
+	# Expressions
+	
+	def expr_tuple(self):
+		left = self.ternary()
+		if self.t.name != 'COMMA':
+			return left
+		return expr_tuple_multi(self.s, [left, self.next(), self.ternary()])
+	
+	def ternary(self):
+		left = self.expr()
+		if self.t.name != 'IF':
+			return left
+		p = [left, self.next(), self.expr(), self.expect('ELSE')]
+		return actual_ternary(self.s, p + [self.expr()])
+	
+	def expr(self, rbp=0):
+		'''Parses an expression containing only operators that bind more
+		tightly than `rbp` (a level from the precedence list).'''
+		
+		s, t = self.s, self.next()
+		name = t.name
+		if name in LITERALS:
+			left = LITERALS[name](s, [t])
+		elif name == 'LPAR':
+			left = parenthesized(s, [t, self.ternary(), self.expect('RPAR')])
+		elif name == 'NOT':
+			left = not_(s, [t, self.expr(LEVELS['NOT'])])
+		else:
+			error(s, t)
+		
+		while True:
+			
+			t = self.t
+			name = t.name
+			if name == 'LPAR' and not rbp:
+				self.next()
+				p = [left, t, self.actuals(), self.expect('RPAR')]
+				left = call(s, p)
+				continue
+			
+			level = LEVELS.get(name, 0)
+			if level <= rbp:
+				break
+			elif name in BINARY:
+				self.next()
+				left = BINARY[name](s, [left, t, self.expr(level)])
+			elif name == 'DOT':
+				self.next()
+				left = attr_expr(s, [left, t, self.expect('NAME')])
+			elif name == 'LBRA':
+				self.next()
+				left = elem(s, [left, t, self.expr(), self.expect('RBRA')])
+			elif name == 'AS':
+				self.next()
+				left = as_(s, [left, t, self.type()])
+			else:
+				break
+		
+		return left
+	
+	def actuals(self):
+		'''Parses a list of arguments. As with type parameters, the grammar
+		allows a comma before the first argument: ``f(, a)``.'''
+		
+		res = []
+		if self.t.name == 'RPAR':
+			return res
+		elif self.t.name == 'COMMA':
+			self.next()
+		
+		while True:
+			if self.t.name == 'NAME' and self.peek().name == 'ASGT':
+				p = [self.name(), self.next(), self.ternary()]
+				res.append(named_actual(self.s, p))
+			else:
+				res.append(self.ternary())
+			if self.t.name != 'COMMA':
+				break
+			self.next()
+		return res
+	
+	# Types
+	
+	def type(self):
+		s, name = self.s, self.t.name
+		if name == 'QM':
+			return opt_type(s, [self.next(), self.type()])
+		elif name == 'TILDE':
+			return mut_type(s, [self.next(), self.ptr_type()])
+		elif name in ('DOLLAR', 'AMP'):
+			return self.ptr_type()
+		elif name != 'LPAR':
+			return self.vtype()
+		
+		t = self.next()
+		p = [self.type(), self.expect('COMMA'), self.type()]
+		res = two_type_tuple(s, p)
+		while self.t.name == 'COMMA':
+			
+			# type_tuple() fails, but the LR parser only gets there if a type
+			# ending in a name is followed by a token that can follow a type
+			
+			p = [res, self.next(), self.type()]
+			if self.last.name == 'NAME' and self.t.name not in TYPE_FOLLOW:
+				error(s, self.t)
+			res = type_tuple(s, p)
+		return tuple_type(s, [t, res, self.expect('RPAR')])
+	
+	def ptr_type(self):
+		if self.t.name == 'DOLLAR':
+			return owner_type(self.s, [self.next(), self.vtype()])
+		return ref_type(self.s, [self.expect('AMP'), self.vtype()])
+	
+	def vtype(self):
+		res = self.name()
+		if self.t.name != 'LBRA':
+			return res
+		p = [res, self.next(), self.type(), self.expect('RBRA')]
+		return param_type(self.s, p)
 
 class State(object):
 
@@ -763,29 +1317,46 @@ class State(object):
 		self.fn = fn
 		with open(fn) as f:
 			self.src = f.read()
-		self.lines = self.src.splitlines()
+		self.source = util.Source(fn, self.src)
 	
 	def pos(self, t):
 		'''Reprocess location information (see parse() for more details).'''
 		ln = t.source_pos.lineno - 1
 		if t.value and t.value[0] == '\n':
 			ln -= 1
-
+		
 		col = t.source_pos.colno - 1
-		line = self.lines[ln] if ln < len(self.lines) else ''
-		return (ln, col), (ln, col + len(t.value)), line, self.fn
+		return self.source, ln, col, col + len(t.value)
+
+PARSERS = 'lr', 'rd'
 
-def parse(fn):
+def parse(fn, kind=None):
 	'''Takes a file name and returns the AST corresponding to the source
 	contained in the file. The State thing is here mostly to reprocess
 	location information from rply into something easier to use. AST nodes
 	get a pos field containing a 4-element tuple:
 	
-	- Tuple of start location, as 0-based line and column numbers
-	- Tuple of end location, as 0-based line and column numbers
-	- The full line
-	- The file name
+	- The util.Source for the file, which has the file name and contents
+	- The line number (0-based)
+	- Start and end column numbers (0-based)
+	
+	This should be everything we need to build good error messages. The
+	Source is shared by all nodes from the same file, so positions take
+	little memory; the source line is only looked up to show an error.
+	
+	`kind` selects the parser, from PARSERS: the LR parser generated by
+	rply ('lr', the default) or the hand-written Parser ('rd'). If it is
+	not given, the RUNA_PARSER environment variable is used.'''
+	
+	kind = kind or os.environ.get('RUNA_PARSER') or 'lr'
+	if kind not in PARSERS:
+		raise ValueError('unknown parser %r' % kind)
 	
-	This should be everything we need to build good error messages.'''
-	state = State(fn)
-	return parser.parse(lex(state.src), state=state)
+	with timing.phase('parse', fn) as phase:
+		state = State(fn)
+		if kind == 'rd':
+			node = Parser(state, lex(state.src)).module()
+		else:
+			node = build().parse(lex(state.src), state=state)
+		phase.obj = node
+	return node
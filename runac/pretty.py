@@ -6,9 +6,9 @@ during compiler development, and can be invoked using the compiler driver's
 `show` command (parametrized with the last pass to run before printing.
 '''
 
-from . import types, util
+from . import ast, types, util
 
-class PrettyPrinter(object):
+class PrettyPrinter(ast.Visitor):
 	
 	def __init__(self):
 		self.buf = []
@@ -28,7 +28,7 @@ class PrettyPrinter(object):
 		if isinstance(node, types.base):
 			self.type(node)
 		else:
-			getattr(self, node.__class__.__name__)(node)
+			self.table[node.__class__](self, node)
 	
 	def build(self, name, fun):
 		
@@ -48,7 +48,7 @@ class PrettyPrinter(object):
 		self.write(':')
 		self.newline()
 		
-		for i, bl in sorted(util.items(fun.flow.blocks)):
+		for i, bl in enumerate(fun.flow.blocks):
 			self.writeline('  %2i: # %s' % (i, bl.anno))
 			for sid, step in enumerate(bl.steps):
 				self.write(' {%02i} ' % sid)
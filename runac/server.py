@@ -0,0 +1,225 @@
+'''A long-running compiler server and the client to talk to it.
+
+Most of the time spent compiling a small program goes into setting up the
+compiler: building the parser, loading the core library and its IR. The
+server does all of that once, then listens on a Unix domain socket for
+driver command lines. Each request is handled in a forked child process,
+so it starts out with all of the state already in place, while anything
+a request changes (including the working directory) is thrown away
+afterwards.
+
+The protocol is as simple as possible: the client sends a JSON object with
+the command line arguments and working directory, then shuts down its side
+of the connection. The server answers with a JSON object containing the
+exit status and whatever the command wrote to stdout and stderr.
+
+The server keeps a hash of the compiler and core library sources; if they
+change, it shuts itself down instead of handling the request, and the client
+falls back to compiling in-process. The ``runa`` script uses the client.
+
+By default, the socket lives in a directory in the system's temporary
+directory that belongs to the current user and is inaccessible to others;
+neither the server nor the client will use it otherwise.
+'''
+
+from __future__ import print_function
+from . import util, cache
+import os, sys, json, errno, signal, socket, stat, tempfile, traceback
+
+try:
+	import SocketServer as socketserver
+	from StringIO import StringIO
+except ImportError:
+	import socketserver
+	from io import StringIO
+
+TIMEOUT = 5, 600 # seconds to connect, and to wait for a response
+
+def directory():
+	'''Returns the per-user directory for the server socket.'''
+	name = 'runac-%s' % getattr(os, 'getuid', lambda: 'server')()
+	return os.path.join(tempfile.gettempdir(), name)
+
+def address():
+	'''Returns the path for the server socket.'''
+	if os.environ.get('RUNA_SOCKET'):
+		return os.environ['RUNA_SOCKET']
+	return os.path.join(directory(), 'server.sock')
+
+def secure(path, create=False):
+	'''Check that the socket at `path` can be trusted. Sockets in the
+	default location must be in a directory that belongs to the current
+	user and is inaccessible to others; if `create` is set, the directory
+	is created if necessary.'''
+	
+	base = os.path.dirname(path)
+	if base != directory():
+		return True
+	
+	if create:
+		try:
+			os.mkdir(base, 0o700)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+	
+	try:
+		st = os.lstat(base)
+	except OSError:
+		return False
+	if not stat.S_ISDIR(st.st_mode) or st.st_mode & 0o077:
+		return False
+	return not hasattr(os, 'getuid') or st.st_uid == os.getuid()
+
+def fingerprint():
+	'''Hash over the compiler and core library sources.'''
+	files = sorted(os.listdir(util.CORE_DIR))
+	files = [os.path.join(util.CORE_DIR, fn) for fn in files]
+	return cache.digest(cache.sources() + files)
+
+def recv(sock):
+	data = []
+	while True:
+		bit = sock.recv(65536)
+		if not bit:
+			break
+		data.append(bit)
+	return json.loads(b''.join(data).decode('utf-8'))
+
+def run(argv):
+	'''Run the compiler driver in-process, capturing its output. Returns a
+	dict with the exit status and the contents of stdout and stderr.
+	External tools (like clang) write to the process's file descriptors
+	directly; their output is captured as well, and comes first.'''
+	
+	from . import __main__ as driver
+	stdout, stderr = sys.stdout, sys.stderr
+	sys.stdout, sys.stderr = StringIO(), StringIO()
+	stdout.flush()
+	stderr.flush()
+	
+	files = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+	saved = os.dup(1), os.dup(2)
+	for fd, f in zip((1, 2), files):
+		os.dup2(f.fileno(), fd)
+	
+	try:
+		try:
+			driver.main(argv)
+			status = 0
+		except SystemExit as e:
+			status = e.code if isinstance(e.code, int) else 1
+		except Exception:
+			sys.stderr.write(traceback.format_exc())
+			status = 1
+		
+		tools = []
+		for f in files:
+			f.seek(0)
+			tools.append(f.read().decode('utf-8', 'replace'))
+		return {
+			'status': status,
+			'out': tools[0] + sys.stdout.getvalue(),
+			'err': tools[1] + sys.stderr.getvalue(),
+		}
+	
+	finally:
+		for fd, old in zip((1, 2), saved):
+			os.dup2(old, fd)
+			os.close(old)
+		for f in files:
+			f.close()
+		sys.stdout, sys.stderr = stdout, stderr
+
+class Handler(socketserver.BaseRequestHandler):
+
+	def handle(self):
+		req = recv(self.request)
+		argv = req['argv']
+		if sys.version_info[0] < 3:
+			argv = [s.encode('utf-8') for s in argv]
+		os.chdir(req['cwd'])
+		res = run(argv)
+		self.request.sendall(json.dumps(res).encode('utf-8'))
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+
+	def __init__(self, path):
+		socketserver.UnixStreamServer.__init__(self, path, Handler)
+		self.key = fingerprint()
+		self.stale = False
+	
+	def verify_request(self, request, client):
+		self.stale = fingerprint() != self.key
+		return not self.stale
+
+def serve(path=None):
+	'''Set up the compiler state, then handle requests on the socket at
+	`path` until the compiler sources change.'''
+	
+	import runac
+	runac.parser.build()
+	runac.core_ir()
+	
+	path = address() if path is None else path
+	if not secure(path, True):
+		print('error: %s is not private to this user' % os.path.dirname(path))
+		return
+	elif os.path.exists(path):
+		try:
+			socket.socket(socket.AF_UNIX).connect(path)
+		except socket.error:
+			os.unlink(path) # stale socket
+		else:
+			print('error: server already running at %s' % path)
+			return
+	
+	server = Server(path)
+	signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+	print('listening on %s' % path)
+	sys.stdout.flush()
+	try:
+		while not server.stale:
+			server.handle_request()
+	finally:
+		server.server_close()
+		os.unlink(path)
+
+def request(argv, path=None):
+	'''Send a command line to the server. Returns the server's response,
+	or None if no (current) server is available (see TIMEOUT).'''
+	
+	path = address() if path is None else path
+	if not secure(path):
+		return None
+	
+	sock = socket.socket(socket.AF_UNIX)
+	try:
+		sock.settimeout(TIMEOUT[0])
+		sock.connect(path)
+		sock.settimeout(TIMEOUT[1])
+		req = {'argv': argv, 'cwd': os.getcwd()}
+		sock.sendall(json.dumps(req).encode('utf-8'))
+		sock.shutdown(socket.SHUT_WR)
+		return recv(sock)
+	except (socket.error, ValueError):
+		return None
+	finally:
+		sock.close()
+
+def main(argv):
+	'''Run a driver command through the server if possible, or in-process
+	if no server is running.'''
+	
+	res = None if argv[:1] == ['serve'] else request(argv)
+	if res is None:
+		from . import __main__ as driver
+		driver.main(argv)
+		return
+	
+	sys.stdout.write(res['out'])
+	sys.stderr.write(res['err'])
+	sys.exit(res['status'])
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
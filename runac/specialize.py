@@ -10,9 +10,9 @@ see if it makes sense to change int to be ``i32``. Currently, we only have
 a single float type; it seems like ``float`` == ``f64`` might make sense.
 '''
 
-from . import ast, types, util
+from . import ast, timing, types
 
-class Specializer(object):
+class Specializer(ast.Visitor):
 	
 	def __init__(self, mod, fun):
 		self.mod = mod
@@ -21,7 +21,7 @@ class Specializer(object):
 		self.track = {}
 	
 	def visit(self, node, type=None):
-		getattr(self, node.__class__.__name__)(node, type)
+		self.table[node.__class__](self, node, type)
 	
 	def specialize(self, node, dst):
 		if node.type == dst:
@@ -276,10 +276,14 @@ class Specializer(object):
 		pass
 	
 	def propagate(self):
-		for i, bl in util.items(self.cfg.blocks):
+		for bl in self.cfg.blocks:
 			for step in reversed(bl.steps):
 				self.visit(step)
 
+def propagate(mod, name, code):
+	Specializer(mod, code).propagate()
+
 def specialize(mod):
 	for name, code in mod.code:
-		Specializer(mod, code).propagate()
+		with timing.phase('specialize', mod.name, name, code):
+			propagate(mod, name, code)
@@ -0,0 +1,46 @@
+'''Streaming compilation, keeping only one function in memory at a time.
+
+Normally, the CFG for every function in a module is built up front, every
+pass runs over all of them and the IR for the whole module is collected
+before it is written out; the memory needed grows with the size of the
+program. In streaming mode, the module-level declarations are processed
+first (``typer.declare()`` does not look at the contents of functions).
+Each function then goes through CFG construction, all of the passes and
+code generation before the next one is started. Its IR is written out and
+its CFG and syntax tree are released, so that the memory used for them is
+bounded by the largest function rather than the whole module.
+
+The module-level IR (type declarations and the like) depends on the types
+used in all of the functions, so the IR for the functions is spooled to a
+temporary file until it can be written out (see ``codegen.Writer``). The
+result is the same as for ``codegen.generate()``. Note that parsing still
+produces the syntax tree for the whole file.
+
+Functions are processed in order, so generators must be defined before
+the functions that iterate over them, as in the regular pipeline. If more
+than one function has errors, the error reported may differ from the one
+reported by the regular pipeline, which runs each pass over all functions.
+'''
+
+from . import codegen, incremental, timing, typer
+
+def release(fun):
+	'''Drop the CFG and the body for the code object `fun`.'''
+	fun.flow = None
+	fun.suite = None
+
+def run(mod, out):
+	'''Processes the module `mod`, which must have been created with
+	`defer` set, one function at a time, writing IR for it to `out`.'''
+	
+	with timing.phase('typer', mod.name):
+		typer.declare(mod)
+	
+	writer = codegen.Writer(mod, out)
+	for k, fun in mod.code:
+		mod.build(k, fun)
+		incremental.passes(mod, k, fun)
+		writer.function(k, fun)
+		release(fun)
+	
+	writer.close()
@@ -0,0 +1,262 @@
+'''Instrumentation for the compiler pipeline.
+
+Parsing, the transformation passes and code generation each run inside a
+``phase()``, for a whole module (or file) or for a single code object. While a
+``Timer`` is active, every phase is recorded as an event with its wall
+time, the memory allocated while it ran and the number of syntax tree nodes
+and basic blocks in the object it processed. Without an active timer,
+phases cost next to nothing.
+
+Use the timer as a context manager::
+
+	with timing.Timer() as timer:
+		runac.ir(fn)
+	print('\\n'.join(timer.report()))
+	timer.trace('trace.json')
+
+The driver does the same for the ``--time-passes`` and ``--trace``
+options. Memory use is measured with ``tracemalloc``, where available
+(Python 3.4 and later). Otherwise, the change in the resident set size of
+the process is used, from ``/proc/self/statm`` if that exists or from the
+peak resident set size reported by ``getrusage()``; this includes memory
+that was freed and reused while a phase ran. The trace is written
+in the Chrome trace event format, which can be loaded into
+``chrome://tracing`` or Perfetto to show a timeline.
+'''
+
+from . import ast, util
+import collections, json, os, sys, time
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+ACTIVE = None
+
+def rss():
+	'''Returns the resident set size of the process in bytes, or its peak
+	resident set size if the current one isn't available, or None.'''
+	
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (IOError, OSError, ValueError, AttributeError):
+		pass
+	
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak if sys.platform == 'darwin' else peak * 1024
+
+def label(name):
+	'''Returns a string for a code object name (a string or a tuple).'''
+	return '.'.join(name) if isinstance(name, tuple) else name
+
+def size(obj):
+	'''Returns a tuple of the number of syntax tree nodes and basic blocks
+	in `obj`: a module, a code object or any syntax tree node.'''
+	
+	if isinstance(getattr(obj, 'code', None), list):
+		res = [size(code) for (name, code) in obj.code]
+		return sum(r[0] for r in res), sum(r[1] for r in res)
+	
+	flow = getattr(obj, 'flow', None)
+	if flow is None:
+		return sum(1 for node in ast.walk(obj)), 0
+	
+	steps = [s for bl in flow.blocks for s in bl.steps]
+	return sum(1 for node in ast.walk(steps)), len(flow.blocks)
+
+class Event(object):
+
+	def __init__(self, name, mod, fun, obj):
+		self.name = name
+		self.mod = mod
+		self.fun = fun
+		self.obj = obj
+		self.start = self.elapsed = 0.0
+		self.memory = None
+		self.size = None
+
+class Null(object):
+	'''Stands in for a phase if no timer is active.'''
+	def __setattr__(self, name, value):
+		pass
+	def __enter__(self):
+		return self
+	def __exit__(self, *args):
+		pass
+
+NULL = Null()
+
+class Timer(object):
+	'''Records the phases run while it is active (see the module docs).
+	If `memory` is set, memory use is measured as well: allocations are
+	traced with tracemalloc if it's available, see rss() otherwise.'''
+	
+	def __init__(self, memory=True):
+		self.memory = memory and (tracemalloc is not None or rss() is not None)
+		self.events = []
+		self.started = False
+		self.prev = None
+		self.origin = None
+	
+	def __enter__(self):
+		
+		global ACTIVE
+		self.prev, ACTIVE = ACTIVE, self
+		if self.memory and tracemalloc and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self.started = True
+		
+		self.origin = time.time()
+		return self
+	
+	def __exit__(self, *args):
+		global ACTIVE
+		ACTIVE = self.prev
+		if self.started:
+			tracemalloc.stop()
+			self.started = False
+	
+	def used(self):
+		if tracemalloc is not None:
+			return tracemalloc.get_traced_memory()[0]
+		return rss()
+	
+	def enter(self, ev):
+		ev.start = time.time()
+		if self.memory:
+			ev.memory = self.used()
+	
+	def exit(self, ev):
+		ev.elapsed = time.time() - ev.start
+		if self.memory:
+			ev.memory = self.used() - ev.memory
+		if ev.obj is not None:
+			ev.size = size(ev.obj)
+			ev.obj = None
+		self.events.append(ev)
+	
+	def phases(self):
+		'''Returns a list of (name, calls, time, memory, nodes, blocks)
+		tuples, one for each phase in the order they first ran. Sizes
+		are taken from the last run of the phase for each object.'''
+		
+		res = collections.OrderedDict()
+		sizes = {}
+		for ev in sorted(self.events, key=lambda e: e.start):
+			calls, elapsed, memory = res.get(ev.name, (0, 0.0, None))
+			if ev.memory is not None:
+				memory = (memory or 0) + ev.memory
+			res[ev.name] = calls + 1, elapsed + ev.elapsed, memory
+			if ev.size is not None:
+				sizes.setdefault(ev.name, {})[ev.mod, ev.fun] = ev.size
+		
+		out = []
+		for name, (calls, elapsed, memory) in util.items(res):
+			counts = list(util.values(sizes.get(name, {})))
+			nodes = sum(c[0] for c in counts) if counts else None
+			blocks = sum(c[1] for c in counts) if counts else None
+			out.append((name, calls, elapsed, memory, nodes, blocks))
+		return out
+	
+	def functions(self):
+		'''Returns a list of (function, time, {phase: time}) tuples for the
+		code objects processed one at a time, slowest first.'''
+		res = {}
+		for ev in self.events:
+			if ev.fun is None:
+				continue
+			fun = res.setdefault('%s.%s' % (ev.mod, ev.fun), {})
+			fun[ev.name] = fun.get(ev.name, 0.0) + ev.elapsed
+		out = [(k, sum(util.values(v)), v) for (k, v) in util.items(res)]
+		return sorted(out, key=lambda x: (-x[1], x[0]))
+	
+	def report(self, top=10):
+		'''Returns a list of lines summarizing the phases, followed by the
+		`top` slowest functions.'''
+		
+		fmt = '%-16s %6s %10s %10s %9s %7s'
+		lines = [fmt % ('phase', 'calls', 'time (ms)', 'mem (kB)',
+		                'nodes', 'blocks')]
+		dash = lambda v, f='%i': '-' if v is None else f % v
+		for name, calls, elapsed, memory, nodes, blocks in self.phases():
+			lines.append(fmt % (
+				name, calls, '%.1f' % (elapsed * 1000),
+				dash(None if memory is None else memory // 1024),
+				dash(nodes), dash(blocks),
+			))
+		
+		funs = self.functions()[:top]
+		if funs:
+			lines.append('')
+			lines.append('%-40s %10s  %s' % ('function', 'time (ms)', 'slowest'))
+		for fun, elapsed, phases in funs:
+			worst = max(sorted(phases), key=lambda k: phases[k])
+			lines.append('%-40s %10.1f  %s (%.1f)' % (
+				fun, elapsed * 1000, worst, phases[worst] * 1000
+			))
+		
+		return lines
+	
+	def trace(self, fn):
+		'''Write the recorded events to the file `fn`, as a Chrome trace.'''
+		
+		pid, events = os.getpid(), []
+		for ev in sorted(self.events, key=lambda e: e.start):
+			args = {}
+			if ev.mod is not None:
+				args['module'] = ev.mod
+			if ev.fun is not None:
+				args['function'] = ev.fun
+			if ev.memory is not None:
+				args['memory'] = ev.memory
+			if ev.size is not None:
+				args['nodes'], args['blocks'] = ev.size
+			events.append({
+				'name': '%s %s' % (ev.name, ev.fun or ev.mod),
+				'cat': 'function' if ev.fun is not None else 'module',
+				'ph': 'X', 'pid': pid, 'tid': 0,
+				'ts': int((ev.start - self.origin) * 1e6),
+				'dur': int(ev.elapsed * 1e6),
+				'args': args,
+			})
+		
+		with open(fn, 'w') as f:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+class Phase(object):
+
+	def __init__(self, timer, ev):
+		self.timer = timer
+		self.ev = ev
+	
+	def __enter__(self):
+		self.timer.enter(self.ev)
+		return self.ev
+	
+	def __exit__(self, *args):
+		self.timer.exit(self.ev)
+
+def phase(name, mod=None, fun=None, obj=None):
+	'''Returns a context manager for a phase named `name`, run for the
+	module (or file) named `mod` or for its code object named `fun`,
+	processing `obj`. The object can also be set on the result of
+	entering the phase.'''
+	if ACTIVE is None:
+		return NULL
+	fun = None if fun is None else label(fun)
+	return Phase(ACTIVE, Event(name, mod, fun, obj))
+
+def count(name, mod=None, fun=None):
+	'''Records an empty phase named `name`, so that the report shows how
+	often something happened (see phase()).'''
+	with phase(name, mod, fun):
+		pass
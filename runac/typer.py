@@ -36,7 +36,7 @@ Error messages should try to return good location information and
 provide enough context to be actionable.
 '''
 
-from . import types, ast, blocks, util
+from . import types, ast, blocks, timing, util
 import copy
 
 class Init(ast.Expr):
@@ -94,7 +94,7 @@ ROOT = Declarations('', {
 	}),
 })
 
-class TypeChecker(object):
+class TypeChecker(ast.Visitor):
 	
 	def __init__(self, mod, fun, scope):
 		self.mod = mod
@@ -105,14 +105,11 @@ class TypeChecker(object):
 		self.checked = {}
 	
 	def check(self):
-		for i, b in sorted(util.items(self.flow.blocks)):
+		for b in self.flow.blocks:
 			for sid, step in enumerate(b.steps):
 				self.cur = b, sid
 				self.visit(step)
 	
-	def visit(self, node):
-		getattr(self, node.__class__.__name__)(node)
-	
 	def checkopt(self, posnode, val):
 		if self.checked.get((self.cur[0].id, val.name)):
 			val.type = val.type.over
@@ -133,10 +130,7 @@ class TypeChecker(object):
 			raise util.Error(posnode, msg % val.type.name)
 	
 	def settype(self, name, type):
-		bid, sid = self.cur[0].id, self.cur[1]
-		sets = self.flow.vars[name]['sets']
-		assert sid in sets.get(bid, {}), name
-		sets[bid][sid] = type
+		self.flow.settype(name, self.cur[0].id, self.cur[1], type)
 	
 	# Constants
 	
@@ -153,14 +147,13 @@ class TypeChecker(object):
 			if self.cur[0].id < id:
 				continue
 			
-			sets = self.flow.vars[node.name]['sets'][id]
-			if id == self.cur[0].id:
-				if self.cur[1] <= min(sets):
-					continue
-				sets = {s: t for (s, t) in util.items(sets) if s < self.cur[1]}
+			before = self.cur[1] if id == self.cur[0].id else None
+			last = self.flow.last(node.name, id, before)
+			if last is None:
+				continue
 			
 			blocks.append(id)
-			defined.append(sets[max(sets)])
+			defined.append(last[1])
 		
 		if not strict:
 			defined = [i for i in defined if i is not None]
@@ -529,9 +522,8 @@ class TypeChecker(object):
 				if not isinstance(node.args[i], ast.Name):
 					continue
 				
-				var_data = self.flow.vars[node.args[i].name]
-				clear = var_data.setdefault('clear', {})
-				clear.setdefault(self.cur[0].id, set()).add(self.cur[1])
+				bid, sid = self.cur[0].id, self.cur[1]
+				self.flow.clear(node.args[i].name, bid, sid)
 	
 	def CondBranch(self, node):
 		self.visit(node.cond)
@@ -692,9 +684,7 @@ def process(mod, base, fun, cls):
 		if not isinstance(arg.type, types.base):
 			arg.type = mod.type(arg.type, stubs)
 		
-		var_data = fun.flow.vars.setdefault(arg.name.name, {})
-		assert -1 in var_data.get('sets', {})[None]
-		var_data.setdefault('sets', {})[None] = {-1: arg.type}
+		fun.flow.settype(arg.name.name, None, -1, arg.type)
 	
 	# If this is a generator, prepare a context class to hold state
 	# across invocations. This will contain all the live variables.
@@ -719,13 +709,16 @@ def process(mod, base, fun, cls):
 	
 	TypeChecker(mod, fun, base).check()
 
-def typer(mod):
+def declare(mod):
+	'''Set up the module scope with types and declarations for everything
+	defined in the module, without looking at the contents of functions.'''
 	
 	# Start by adding types to type dictionary
 	
+	module = types.qualifier(mod.name)
 	for k, v in util.items(mod):
 		if isinstance(v, (ast.Class, ast.Trait)):
-			mod.scope[k] = types.create(v)
+			mod.scope[k] = types.create(v, module)
 	
 	# Next, set up module scope and imported redirections
 	
@@ -734,8 +727,11 @@ def typer(mod):
 		if not isinstance(obj, str):
 			continue
 		
-		ns = ROOT
 		path = obj.split('.')
+		if path[0] not in ROOT.attribs:
+			continue # imported from a Runa module (see interface.py)
+		
+		ns = ROOT
 		while len(path) > 1:
 			ns = ns.attribs[path.pop(0)]
 		
@@ -816,9 +812,18 @@ def typer(mod):
 			else:
 				fun.args[0].type = types.ref(mod.scope[k[0]])
 	
+def check(mod, k, fun):
+	'''Type check the given function, after declare() has been called.'''
+	cls = mod.type(k[0]) if isinstance(k, tuple) else None
+	process(mod, mod.scope, fun, cls)
+
+def typer(mod):
+	
 	# Handle type checking and inferencing of actual function code
 	# (needs to be done after add function declarations for each function)
 	
+	with timing.phase('typer', mod.name):
+		declare(mod)
 	for k, fun in mod.code:
-		cls = mod.type(k[0]) if isinstance(k, tuple) else None
-		process(mod, mod.scope, fun, cls)
+		with timing.phase('typer', mod.name, k, fun):
+			check(mod, k, fun)
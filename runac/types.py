@@ -16,9 +16,9 @@ concrete variants; these are used for traits and generics support.
 '''
 
 from . import ast, util
-import copy, platform
+import collections, copy, struct, weakref
 
-WORD_SIZE = int(platform.architecture()[0][:2])
+WORD_SIZE = struct.calcsize('P') * 8
 
 BASIC = {
 	'bool': 'i1',
@@ -45,22 +45,108 @@ INTEGERS = {
 
 BASIC_FLOATS = {'float': 64}
 
+# Types are interned: constructing a type from the same arguments (compared
+# by identity) yields the same object, as do applying a template to the same
+# parameters and building a tuple from the same types. Each interned type
+# keeps its `origin` (a tuple of the kind of type and the arguments) and its
+# `rid`, the repr() string used to compare it with other types.
+
+INTERNED = weakref.WeakValueDictionary()
+
+def ident(obj):
+	if isinstance(obj, tuple):
+		return tuple(ident(v) for v in obj)
+	return id(obj) if isinstance(obj, ReprId) else obj
+
+def intern(kind, args, make):
+	'''Returns the type for `kind` and `args`, calling `make()` to create
+	it if there is none yet. The type refers to its arguments through its
+	`origin`, so their ids remain valid as long as the entry exists.'''
+	key = ident((kind, args))
+	obj = INTERNED.get(key)
+	if obj is None:
+		obj = make()
+		obj.origin = kind, args
+		if obj.rid is None:
+			obj.rid = repr(obj)
+		INTERNED[key] = obj
+	return obj
+
+def unpickle(origin, cls, state):
+	'''Unpickles an interned type (see ReprId.__reduce_ex__()). The state
+	includes the `rid`, which can't be computed yet if the type's class is
+	a dynamic class that has not been filled in yet (see cache.py).'''
+	def make():
+		obj = cls.__new__(cls)
+		obj.__dict__.update(state)
+		return obj
+	return intern(origin[0], origin[1], make)
+
+class Interned(type):
+	'''Metaclass for types: calling a type class returns an interned object
+	(see intern()), unless the class sets `interned` to False. Arguments are
+	passed through the class's `normalize()` first, so that default values
+	are part of the key.'''
+	def __call__(cls, *args):
+		if not cls.interned:
+			return type.__call__(cls, *args)
+		args = cls.normalize(*args)
+		return intern(cls, args, lambda: type.__call__(cls, *args))
+
+def qualify(t, name):
+	return name if t.module is None else '%s.%s' % (t.module, name)
+
 class Type(object):
 	def __eq__(self, other):
 		return self.__class__ == other.__class__
 
 class ReprId(object):
 	
+	__metaclass__ = Interned
+	interned = True
+	origin = rid = None
+	module = None
+	
+	@property
+	def qname(self):
+		'''The name qualified with the module that defined the type, if
+		it's not from the core library; used for IR symbols.'''
+		if self.module is None:
+			return self.name
+		return '%s.%s' % (self.module, self.name)
+	
+	@staticmethod
+	def normalize(*args):
+		return args
+	
+	def __reduce_ex__(self, proto):
+		if self.origin is None:
+			return object.__reduce_ex__(self, proto)
+		return unpickle, (self.origin, self.__class__, self.__dict__)
+	
 	def __hash__(self):
-		return hash(repr(self))
+		return hash(self.rid or repr(self))
 	
 	def __eq__(self, other):
-		return repr(self) == repr(other)
+		if self is other:
+			return True
+		rid = getattr(other, 'rid', None) or repr(other)
+		return (self.rid or repr(self)) == rid
 	
 	def __ne__(self, other):
 		return not self.__eq__(other)
 	
 	def select(self, node, name, positional, named):
+		'''Selects the overload of method `name` for the given argument
+		types. Results are cached, except for failures.'''
+		key = cachekey((self, positional))
+		if named or key is None:
+			return self.overload(node, name, positional, named)
+		args = node, name, positional, named
+		keep = self, tuple(positional)
+		return cached('select', key + (name,), keep, self.overload, *args)
+	
+	def overload(self, node, name, positional, named):
 		
 		if name not in self.methods:
 			msg = "%s does not have a method '%s'"
@@ -129,10 +215,10 @@ class base(ReprId):
 	
 	@property
 	def ir(self):
-		return '%' + self.name
+		return '%' + self.qname
 	
 	def __repr__(self):
-		return '<type: %s>' % self.__class__.__name__
+		return '<type: %s>' % qualify(self, self.__class__.__name__)
 
 class trait(ReprId):
 	
@@ -147,10 +233,10 @@ class trait(ReprId):
 	
 	@property
 	def ir(self):
-		return '%%%s.wrap' % self.name
+		return '%%%s.wrap' % self.qname
 	
 	def __repr__(self):
-		return '<trait: %s>' % self.name
+		return '<trait: %s>' % self.qname
 
 class concrete(base):
 	attribs = {}
@@ -172,7 +258,7 @@ class template(ReprId):
 		assert False, '%s is not a concrete type' % self.name
 	
 	def __repr__(self):
-		return '<template: %s>' % self.__class__.__name__
+		return '<template: %s>' % qualify(self, self.__class__.__name__)
 
 class iter(template):
 	params = 'T',
@@ -204,6 +290,7 @@ class anyfloat(base):
 		assert False, 'not a concrete type'
 
 class module(base):
+	interned = False
 	def __init__(self, path=None):
 		self.path = path
 		self.functions = {}
@@ -227,6 +314,10 @@ class owner(base):
 
 class ref(base):
 	
+	@staticmethod
+	def normalize(over, mut=False):
+		return over, mut
+	
 	def __init__(self, over, mut=False):
 		self.over = over
 		self.mut = mut
@@ -265,8 +356,29 @@ FLOATS = {anyfloat()}
 WRAPPERS = owner, ref
 BASE = void, anyint, anyfloat, iter
 
+def state():
+	'''Returns module-level type data that is filled in while typing the core
+	library, so that it can be saved together with the core module.'''
+	return {
+		'SINTS': SINTS, 'UINTS': UINTS, 'INTS': INTS, 'FLOATS': FLOATS,
+		'methods': {t.__name__: t.methods for t in BASE},
+	}
+
+def restore(data):
+	'''Reverse of state(): re-install saved module-level type data.'''
+	for name in ('SINTS', 'UINTS', 'INTS', 'FLOATS'):
+		dst = globals()[name]
+		dst.clear()
+		dst.update(data[name])
+	for t in BASE:
+		t.methods.clear()
+		t.methods.update(data['methods'][t.__name__])
+	clear()
+
 class function(base):
 	
+	interned = False
+	
 	def __init__(self, rtype, formal):
 		self.over = rtype, formal
 		self.args = None
@@ -301,7 +413,62 @@ def wrangle(s):
 	s = s.replace(']', 'ET')
 	return s
 
+# Results of compat(), conforms() and ReprId.select() are cached. The keys
+# contain the ids of interned types; the values hold on to the types, so
+# that the ids remain valid. Since fill() changes the methods of types that
+# already exist, it clears the caches. STATS counts hits and misses.
+
+CACHES = {'compat': {}, 'conforms': {}, 'select': {}}
+STATS = collections.Counter()
+
+def cachekey(obj):
+	'''Returns a key for a type or a sequence of types, or None if it
+	contains anything other than interned types.'''
+	if isinstance(obj, (tuple, list)):
+		keys = tuple(cachekey(v) for v in obj)
+		return None if None in keys else keys
+	elif isinstance(obj, ReprId) and obj.origin is not None:
+		return id(obj)
+	return None
+
+def cached(name, key, keep, fun, *args):
+	'''Returns `fun(*args)`, cached under `key` in the named cache, along
+	with `keep` (the types whose ids are in the key).'''
+	cache = CACHES[name]
+	if key in cache:
+		STATS[name, 'hit'] += 1
+		return cache[key][1]
+	STATS[name, 'miss'] += 1
+	res = fun(*args)
+	cache[key] = keep, res
+	return res
+
+def clear():
+	for cache in util.values(CACHES):
+		cache.clear()
+
 def compat(a, f, mode='default'):
+	'''Checks whether a value of type `a` may be used where a value of
+	type `f` is expected. Both can also be sequences of types; these are
+	not cached themselves, but their elements are.'''
+	
+	if a is f:
+		return True
+	elif getattr(a, 'origin', None) is None:
+		return check(a, f, mode)
+	elif getattr(f, 'origin', None) is None:
+		return check(a, f, mode)
+	
+	key, cache = (id(a), id(f), mode), CACHES['compat']
+	if key in cache:
+		STATS['compat', 'hit'] += 1
+		return cache[key][1]
+	
+	STATS['compat', 'miss'] += 1
+	res = cache[key] = (a, f), check(a, f, mode)
+	return res[1]
+
+def check(a, f, mode):
 	
 	assert mode in {'default', 'args', 'return'}
 	if isinstance(a, concrete) and isinstance(f, concrete):
@@ -336,6 +503,14 @@ def compat(a, f, mode='default'):
 	if not isinstance(f, trait):
 		return False
 	
+	key = cachekey((a, f))
+	if key is None:
+		return conforms(a, f, mode)
+	return cached('conforms', key + (mode,), (a, f), conforms, a, f, mode)
+
+def conforms(a, f, mode):
+	'''Checks whether type `a` implements the methods of trait `f`.'''
+	
 	for k, malts in util.items(f.methods):
 		
 		if k not in a.methods:
@@ -417,7 +592,15 @@ class FunctionDecl(util.AttribRepr):
 		irname = 'main' if irname == 'Runa.__main__.main' else irname
 		return cls(irname, funtype)
 
-def create(node):
+def qualifier(name):
+	'''Returns the qualifier for types defined in the module called `name`:
+	the module name, except for the core library.'''
+	return None if name == 'Runa.core' else name
+
+def create(node, module=None):
+	'''Creates the type for a class or trait declaration `node`. Types
+	defined outside the core library are qualified with their `module`,
+	so that they are distinct from same-named types in other modules.'''
 	
 	if isinstance(node, ast.Trait):
 		parent = trait
@@ -436,11 +619,16 @@ def create(node):
 	if node.name.name in BASIC:
 		fields['ir'] = BASIC[node.name.name]
 		fields['byval'] = True
+	if module is not None:
+		fields['module'] = module
 	
 	return type(node.name.name, (parent,), fields)()
 
 def build_tuple(params):
 	params = tuple(params)
+	return intern('tuple', params, lambda: make_tuple(params))
+
+def make_tuple(params):
 	name = 'tuple[%s]' % ', '.join(p.name for p in params)
 	internal = name.replace('%', '_').replace('.', '_')
 	return type(internal, (concrete,), {
@@ -452,14 +640,18 @@ def build_tuple(params):
 	})()
 
 def apply(tpl, params):
-	
 	assert isinstance(params, tuple)
+	return intern('apply', (tpl, params), lambda: make_applied(tpl, params))
+
+def make_applied(tpl, params):
+	
 	name = '%s[%s]' % (tpl.name, ', '.join(p.name for p in params))
 	internal = name.replace('$', '_').replace('.', '_')
 	cls = type(internal, (concrete,), {
-		'ir': '%' + tpl.name + '$' + '.'.join(t.name for t in params),
+		'ir': '%' + tpl.qname + '$' + '.'.join(t.qname for t in params),
 		'name': name,
 		'params': params,
+		'module': tpl.module,
 		'methods': {},
 		'attribs': {},
 	})
@@ -492,6 +684,7 @@ def apply(tpl, params):
 
 def fill(mod, node):
 	
+	clear()
 	obj = mod.scope[node.name.name]
 	cls, stubs = obj.__class__, {}
 	if not isinstance(node, ast.Trait):
@@ -19,13 +19,60 @@ else:
 	def items(d):
 		return d.items()
 
+def names(seq):
+	'''Normalizes a sequence of attribute names, which may also be given
+	as a single string (as in `__slots__`), into a tuple.'''
+	return (seq,) if isinstance(seq, str) else tuple(seq)
+
+SLOTS = {}
+
+def slots(cls):
+	'''Returns a tuple of the names of all slots in `cls` and its bases.'''
+	if cls not in SLOTS:
+		res = []
+		for base in reversed(cls.__mro__):
+			res += names(base.__dict__.get('__slots__', ()))
+		SLOTS[cls] = tuple(k for k in res if k not in ('__dict__', '__weakref__'))
+	return SLOTS[cls]
+
+def attribs(obj):
+	'''Returns a sorted list of (name, value) pairs for all attributes
+	set on `obj`, whether they are kept in slots or in a `__dict__`.'''
+	res = dict(getattr(obj, '__dict__', ()))
+	for k in slots(obj.__class__):
+		try:
+			res[k] = getattr(obj, k)
+		except AttributeError:
+			pass
+	return sorted(items(res))
+
 class AttribRepr(object):
 	'''Helper class to provide a nice __repr__ for other classes'''
+	__slots__ = ()
 	def __repr__(self):
-		contents = sorted(items(self.__dict__))
+		contents = attribs(self)
 		show = ('%s=%r' % (k, v) for (k, v) in contents if k not in IGNORE)
 		return '<%s(%s)>' % (self.__class__.__name__, ', '.join(show))
 
+class Source(object):
+	'''Source code of a file, shared by the positions of all nodes parsed
+	from it. Positions are tuples of a Source, the 0-based line number, and
+	the 0-based start and end columns (see parser.State.pos()); the lines
+	themselves are only split out when needed to show an error.'''
+	
+	def __init__(self, fn, src):
+		self.fn = fn
+		self.src = src
+		self.lines = None
+	
+	def __getstate__(self):
+		return {'fn': self.fn, 'src': self.src, 'lines': None}
+	
+	def line(self, ln):
+		if self.lines is None:
+			self.lines = self.src.splitlines()
+		return self.lines[ln] if ln < len(self.lines) else ''
+
 def error(fn, msg, pos):
 	'''Helper function to print useful error messages.
 	
@@ -37,13 +84,15 @@ def error(fn, msg, pos):
 	if pos is None:
 		return '%s: %s\n' % (fn, msg)
 	
-	col = len(pos[2][:pos[0][1]].replace('\t', ' ' * 4)) + 1
-	desc = '%s [%s.%s]: %s' % (fn, pos[0][0] + 1, col, msg)
-	if not pos[2]:
+	src, ln, col = pos[:3]
+	text = src.line(ln)
+	shown = len(text[:col].replace('\t', ' ' * 4)) + 1
+	desc = '%s [%s.%s]: %s' % (fn, ln + 1, shown, msg)
+	if not text:
 		return desc + '\n'
 	
-	line = pos[2].replace('\t', ' ' * 4).rstrip()
-	spaces = pos[0][1] + 3 * min(pos[0][1], pos[2].count('\t'))
+	line = text.replace('\t', ' ' * 4).rstrip()
+	spaces = col + 3 * min(col, text.count('\t'))
 	return '\n'.join((desc, line, ' ' * spaces + '^')) + '\n'
 
 class Error(Exception):
@@ -55,7 +104,7 @@ class Error(Exception):
 		self.msg = msg
 	
 	def show(self):
-		fn = os.path.basename(self.node.pos[3])
+		fn = os.path.basename(self.node.pos[0].fn)
 		return error(fn, self.msg, getattr(self.node, 'pos', None))
 
 class ParseError(Exception):
@@ -67,6 +116,6 @@ class ParseError(Exception):
 		self.pos = pos
 	
 	def show(self):
-		fn = os.path.basename(self.pos[3])
+		fn = os.path.basename(self.pos[0].fn)
 		msg = 'unexpected token %s (%r)' % (self.t.name, self.t.value)
 		return error(fn, msg, self.pos)
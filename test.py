@@ -1,11 +1,19 @@
 from __future__ import print_function
-import sys, os, unittest, subprocess, json
+import sys, os, unittest, subprocess, json, shutil, tempfile
 from runac import util
 import runac
 
 DIR = os.path.dirname(__file__)
 TEST_DIR = os.path.join(DIR, 'tests')
 
+def missing(*tools):
+	'''Returns the first of the given tools that is not on the PATH.'''
+	dirs = os.environ.get('PATH', '').split(os.pathsep)
+	for tool in tools:
+		if not any(os.access(os.path.join(d, tool), os.X_OK) for d in dirs):
+			return tool
+	return None
+
 class RunaTest(unittest.TestCase):
 
 	def __init__(self, fn):
@@ -14,7 +22,7 @@ class RunaTest(unittest.TestCase):
 		self.base = self.fn.rsplit('.rns', 1)[0]
 		self.bin = self.base + '.test'
 		self.opts = self.getspec()
-
+	
 	def getspec(self):
 		with open(self.fn) as f:
 			h = f.readline()
@@ -66,6 +74,746 @@ class RunaTest(unittest.TestCase):
 			self.assertEqual(expected[1], res[1])
 			self.assertEqual(expected[0], res[0])
 
+IMPORT_CHECK = '''
+import time
+start = time.time()
+import runac
+print('%.6f' % (time.time() - start))
+print('%s %s' % (runac.parser.SCANNER is None, runac.parser.PARSER is None))
+print('%s %s' % (runac.CORE is None, runac.CORE_IR is None))
+'''
+
+class ImportTest(unittest.TestCase):
+	'''Importing the compiler package must stay cheap: the lexer, the
+	parser tables, the core module and its IR are only built on first use.'''
+	
+	BUDGET = 0.25
+	
+	def runTest(self):
+		
+		cmd = [sys.executable, '-c', IMPORT_CHECK]
+		opts = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+		proc = subprocess.Popen(cmd, cwd=DIR or '.', **opts)
+		out, err = proc.communicate()
+		self.assertEqual(0, proc.returncode, err)
+		
+		lines = out.decode().splitlines()
+		self.assertEqual(['True True', 'True True'], lines[1:])
+		self.assertLess(float(lines[0]), self.BUDGET)
+
+LEXER_CASES = [
+	'', 'x = 3-4\n', 'Trueish = None\n', "'unterminated\n",
+	'def f():\n\t\tx\n\n\t# comment\n\t \ty\nz', 'if x:\n\ty\n\t# end',
+]
+
+class LexerTest(unittest.TestCase):
+	'''Check that lex() yields the same tokens (including positions) as the
+	reference implementation on top of rply.'''
+	
+	def tokens(self, lex, src):
+		res = []
+		try:
+			for t in lex(src):
+				pos = t.source_pos
+				res.append((t.name, t.value, pos.idx, pos.lineno, pos.colno))
+		except runac.parser.LexingError as e:
+			pos = e.source_pos
+			res.append(('error', pos.idx, pos.lineno, pos.colno))
+		return res
+	
+	def runTest(self):
+		
+		srcs = list(LEXER_CASES)
+		for dir in (TEST_DIR, util.CORE_DIR):
+			for fn in sorted(os.listdir(dir)):
+				if fn.endswith('.rns'):
+					with open(os.path.join(dir, fn)) as f:
+						srcs.append(f.read())
+		
+		for src in srcs:
+			expected = self.tokens(runac.parser.lex_rply, src)
+			self.assertEqual(expected, self.tokens(runac.parser.lex, src))
+
+PARSER_CASES = [
+	'def f():\n\treturn a + b(c) * d, not e.f[g] as $T[U] if h else i\n',
+	'def f():\n\tx, y.z = f(, k = a if b else c)(d).e\n\ty += 1\n',
+	'class A[[T], U]:\n\tx: ?~$T[U]\n\tdef f(self, y: (T, U)):\n\t\tpass\n',
+	'def f():\n\t(a) = b\n', 'def f(a,)\n', 'f()\n', '', 'x = 1',
+	'def f() -> (T, U, V)\n', 'def f() -> (T, U, V W)\n',
+]
+
+class ParserTest(unittest.TestCase):
+	'''Check that the hand-written parser builds the same syntax tree as the
+	LR parser (including positions), or fails in the same way.'''
+	
+	def dump(self, obj):
+		if isinstance(obj, runac.ast.Node):
+			attrs = util.attribs(obj)
+			return type(obj).__name__, [(k, self.dump(v)) for (k, v) in attrs]
+		elif isinstance(obj, (list, tuple)):
+			return [self.dump(v) for v in obj]
+		elif isinstance(obj, set):
+			return sorted(self.dump(v) for v in obj)
+		elif isinstance(obj, util.Source):
+			return obj.fn
+		return obj
+	
+	def parse(self, fn, kind):
+		try:
+			return self.dump(runac.parser.parse(fn, kind))
+		except util.ParseError as e:
+			return 'error', e.t.name, self.dump(e.pos)
+		except Exception as e:
+			return type(e).__name__
+	
+	def runTest(self):
+		
+		tmp = tempfile.mkdtemp()
+		try:
+			
+			files = []
+			for i, src in enumerate(PARSER_CASES):
+				files.append(os.path.join(tmp, 'case-%i.rns' % i))
+				with open(files[-1], 'w') as f:
+					f.write(src)
+			
+			for dir in (TEST_DIR, util.CORE_DIR):
+				for fn in sorted(os.listdir(dir)):
+					if fn.endswith('.rns'):
+						files.append(os.path.join(dir, fn))
+			
+			for fn in files:
+				expected = self.parse(fn, 'lr')
+				self.assertEqual(expected, self.parse(fn, 'rd'), fn)
+		
+		finally:
+			shutil.rmtree(tmp, True)
+
+class NodeTest(unittest.TestCase):
+	'''Check that syntax tree nodes have a fixed layout (see ast.Registry)
+	and are hashed by identity.'''
+	
+	@unittest.skipIf(sys.version_info[0] > 2, 'uses a Python 2 metaclass')
+	def runTest(self):
+		
+		for cls in runac.ast.Registry.types:
+			self.assertEqual(cls.__dictoffset__, 0, cls.__name__)
+		
+		a, b = runac.ast.Name('x', None), runac.ast.Name('x', None)
+		self.assertEqual(len({a, b}), 2)
+		self.assertEqual(repr(a), repr(b))
+		self.assertRaises(AttributeError, setattr, a, 'foo', 1)
+
+class Names(runac.ast.Visitor):
+	
+	def __init__(self):
+		self.names = []
+	
+	def Name(self, node):
+		self.names.append(node.name)
+	
+	def generic(self, node):
+		for k in node.fields:
+			self.visit(getattr(node, k))
+
+class VisitorTest(unittest.TestCase):
+	'''Check dispatching through the per-class tables and ast.walk().'''
+	
+	def runTest(self):
+		
+		ast = runac.ast
+		x, y, z = [ast.Name(n, None) for n in 'xyz']
+		node = ast.Add(None)
+		node.left, node.right = ast.Mul(None), z
+		node.left.left, node.left.right = x, y
+		walked = [n.__class__.__name__ for n in ast.walk(node)]
+		self.assertEqual(walked, ['Add', 'Mul', 'Name', 'Name', 'Name'])
+		
+		v = Names()
+		v.visit(node.left)
+		self.assertEqual(v.names, ['x', 'y'])
+		self.assertIs(Names().table, v.table)
+		self.assertEqual(set(v.table), {ast.Mul, ast.Name})
+		self.assertRaises(AttributeError, runac.pretty.PrettyPrinter().visit, v)
+
+class TypeTest(unittest.TestCase):
+	'''Check that types are interned, also when they are loaded from the
+	cache, that compat() results are cached, and that memoized type names
+	still update the scope.'''
+	
+	def runTest(self):
+		
+		types, mod = runac.types, runac.core()
+		arr, s = mod.scope['Array'], mod.scope['Str']
+		self.assertIs(types.ref(s), types.ref(s, False))
+		self.assertIsNot(types.ref(s), types.ref(s, True))
+		self.assertEqual(types.ref(s), types.ref(s, True))
+		self.assertIs(types.apply(arr, (s,)), types.apply(arr, (s,)))
+		self.assertIs(types.build_tuple([s, s]), types.build_tuple((s, s)))
+		
+		self.assertTrue(types.compat(types.owner(s), types.ref(s), 'args'))
+		hits = types.STATS['compat', 'hit']
+		self.assertTrue(types.compat(types.owner(s), types.ref(s), 'args'))
+		self.assertEqual(types.STATS['compat', 'hit'], hits + 1)
+		
+		t = types.owner(types.apply(arr, (types.ref(s),)))
+		known = runac.interface.known(mod.scope)
+		data = runac.cache.dumps([t, types.opt(t)], known)
+		self.assertEqual(runac.cache.loads(data, known), [t, types.opt(t)])
+		self.assertIs(runac.cache.loads(data, known)[0], t)
+		
+		mod = runac.blocks.Module('test', runac.ast.File(), mod.scope)
+		mod.scope.log = []
+		self.assertIs(mod.type('$Array[Str]'), mod.type('$Array[Str]'))
+		self.assertEqual(len(mod.scope.log), 2)
+
+class FlowTest(unittest.TestCase):
+	'''Check origins() lookups through the reaching definitions table on a
+	small loop, including argument origins and owners used up by a call,
+	and the block order and results of the dataflow solver.'''
+	
+	def runTest(self):
+		
+		flow = runac.blocks.FlowGraph()
+		entry, head, body, exit = [flow.blocks[0]] + [flow.block() for i in range(3)]
+		head.preds = [entry.id, body.id]
+		body.preds = [head.id]
+		exit.preds = [head.id]
+		flow.define('x', None, -1)
+		flow.define('x', 2, 1)
+		
+		self.assertEqual(flow.origins('x', (0, 0)), {None})
+		self.assertEqual(flow.origins('x', (1, 0)), {None, 2})
+		self.assertEqual(flow.origins('x', (2, 0)), {None})
+		self.assertEqual(flow.origins('x', (2, 2)), {2})
+		self.assertEqual(flow.origins('x', (3, 0)), {None, 2})
+		
+		flow.clear('x', 2, 3)
+		self.assertEqual(flow.origins('x', (2, 2)), {2})
+		self.assertEqual(flow.origins('x', (1, 0)), {None})
+		self.assertEqual(flow.origins('x', (3, 0)), {None})
+		
+		flow.define('x', 2, 5)
+		flow.settype('x', 2, 5, 'int')
+		self.assertEqual(flow.last('x', 2), (5, 'int'))
+		self.assertEqual(flow.last('x', 2, 5), (1, None))
+		self.assertEqual(flow.last('x', 2, 1), None)
+		self.assertEqual(flow.origins('x', (1, 0)), {None, 2})
+		self.assertEqual((flow.var('x'), flow.var('y'), flow.names), (0, 1, ['x', 'y']))
+		
+		dataflow = runac.dataflow
+		self.assertEqual(dataflow.order(flow), [0, 1, 3, 2])
+		self.assertEqual(list(dataflow.bits(0b101001)), [0, 3, 5])
+		gen = [0, 0, 0, 1 << 3]
+		transfer = lambda id, val: val | gen[id]
+		before, after = dataflow.solve(flow, transfer, False)
+		self.assertEqual(after, [8, 8, 8, 8])
+		self.assertEqual(before[3], 0)
+
+class FusionTest(unittest.TestCase):
+	'''Check that running the passes after typing fused gives the same
+	results as running them separately.'''
+	
+	def runTest(self):
+		
+		runac.core()
+		names = 'early-return-owner', 'owner-reassign', 'for', 'catch'
+		for name in names:
+			fn = os.path.join(TEST_DIR, name + '.rns')
+			fused = runac.show(fn, None)
+			os.environ['RUNA_NO_FUSE'] = '1'
+			try:
+				self.assertEqual(runac.show(fn, None), fused, name)
+			finally:
+				del os.environ['RUNA_NO_FUSE']
+
+class StreamTest(unittest.TestCase):
+	'''Check that compiling one function at a time gives the same IR as
+	compiling the whole module, and that function bodies are released.'''
+	
+	def runTest(self):
+		
+		runac.core()
+		names = 'class', 'for', 'owner-reassign', 'const'
+		for name in names:
+			fn = os.path.join(TEST_DIR, name + '.rns')
+			with tempfile.TemporaryFile('w+') as f:
+				runac.stream(fn, f)
+				f.seek(0)
+				self.assertEqual(f.read(), runac.ir(fn), name)
+		
+		fn = os.path.join(TEST_DIR, 'for.rns')
+		node = runac.parse(fn)
+		mod = runac.blocks.Module('Runa.__main__', node, runac.core().scope, True)
+		self.assertFalse(any(hasattr(f, 'flow') for (k, f) in mod.code))
+		with tempfile.TemporaryFile('w+') as f:
+			runac.streaming.run(mod, f)
+		self.assertEqual([f.flow for (k, f) in mod.code], [None, None])
+
+class ParallelTest(unittest.TestCase):
+	'''Check that processing functions in worker processes gives the same
+	IR as processing them in order, and reports the same errors.'''
+	
+	def runTest(self):
+		
+		runac.core()
+		incremental = runac.incremental
+		for name in 'pretty', 'iter-obj', 'oddeven':
+			fn = os.path.join(TEST_DIR, name + '.rns')
+			mod = runac.module(fn)
+			runac.transform(mod)
+			res = incremental.generate(runac.module(fn), {}, {}, 2)[0]
+			self.assertEqual(res, runac.codegen.generate(mod), name)
+		
+		mod = runac.module(os.path.join(TEST_DIR, 'pretty.rns'))
+		runac.typer.declare(mod)
+		todo = set(k for (k, f) in mod.code)
+		done = runac.parallel.run(mod, incremental.declared(mod), todo, 2)
+		self.assertIn('multi', done)
+		self.assertNotIn('range', done)
+		
+		fn = os.path.join(TEST_DIR, 'num-params.rns')
+		args = runac.module(fn), {}, {}, 2
+		with runac.timing.Timer(False) as timer:
+			self.assertRaises(util.Error, incremental.generate, *args)
+		self.assertIn('fallback', [p[0] for p in timer.phases()])
+
+class TimingTest(unittest.TestCase):
+	'''Check that the compiler phases are recorded while a timer is active,
+	and that the Chrome trace can be read back.'''
+	
+	def runTest(self):
+		
+		timing = runac.timing
+		runac.core() # only time the passes over the test program
+		fn = os.path.join(TEST_DIR, 'class.rns')
+		with timing.Timer() as timer:
+			runac.show(fn, 'typer')
+		self.assertIs(timing.ACTIVE, None)
+		
+		phases = [p[0] for p in timer.phases()]
+		self.assertEqual(phases[:4], ['parse', 'blocks', 'liveness', 'typer'])
+		self.assertNotIn('escapes', phases)
+		funs = [f[0] for f in timer.functions()]
+		self.assertIn('Runa.__main__.main', funs)
+		self.assertEqual(len(timer.report(3)), len(phases) + 5)
+		self.assertTrue(all(p[3] is not None for p in timer.phases()))
+		
+		tmp = tempfile.mkdtemp()
+		try:
+			timer.trace(os.path.join(tmp, 'trace.json'))
+			with open(os.path.join(tmp, 'trace.json')) as f:
+				events = json.load(f)['traceEvents']
+			self.assertEqual(len(events), len(timer.events))
+			self.assertTrue(all(e['ph'] == 'X' for e in events))
+		finally:
+			shutil.rmtree(tmp)
+
+class ConcurrencyTest(unittest.TestCase):
+	'''Compile a number of programs at the same time, in the same working
+	directory and with a fresh cache, then check that every one of them
+	produced a working binary and no stray files were left behind.'''
+	
+	JOBS = 8
+	
+	def programs(self):
+		for fn in sorted(os.listdir(TEST_DIR)):
+			base = os.path.join(TEST_DIR, fn.rsplit('.rns', 1)[0])
+			if not fn.endswith('.rns') or not os.path.exists(base + '.out'):
+				continue
+			if RunaTest(os.path.join(TEST_DIR, fn)).opts:
+				continue
+			yield base
+	
+	def runTest(self):
+		
+		tool = missing('clang', 'ar')
+		if tool is not None:
+			self.skipTest('%s not found' % tool)
+		
+		tmp = tempfile.mkdtemp()
+		env = dict(os.environ, RUNA_CACHE_DIR=os.path.join(tmp, '.cache'))
+		env['PYTHONPATH'] = os.path.abspath(DIR or '.')
+		try:
+			
+			procs, bases = [], list(self.programs())[:self.JOBS]
+			for i, base in enumerate(bases):
+				src = os.path.basename(base) + '.rns'
+				shutil.copy(base + '.rns', os.path.join(tmp, src))
+				cmd = [sys.executable, '-m', 'runac', 'compile', src]
+				cmd += ['-o', 'bin-%i' % i]
+				procs.append(subprocess.Popen(cmd, cwd=tmp, env=env))
+			
+			for proc in procs:
+				self.assertEqual(0, proc.wait())
+			
+			for i, base in enumerate(bases):
+				with open(base + '.out', 'rb') as f:
+					expected = f.read()
+				bin = os.path.join(tmp, 'bin-%i' % i)
+				proc = subprocess.Popen([bin], stdout=subprocess.PIPE)
+				self.assertEqual(expected, proc.communicate()[0])
+			
+			names = {os.path.basename(b) + '.rns' for b in bases}
+			names |= {'bin-%i' % i for i in range(len(bases))}
+			names.add('.cache')
+			self.assertEqual(names, set(os.listdir(tmp)))
+		
+		finally:
+			shutil.rmtree(tmp, True)
+
+class BatchTest(unittest.TestCase):
+	'''Check that compile_many() builds working binaries and reports
+	errors for individual programs without affecting the others.'''
+	
+	FILES = 'hello', 'ast-err', 'class', 'check-rtype'
+	WHOLE = False
+	TOOLS = 'clang', 'ar'
+	
+	def runTest(self):
+		
+		tool = missing(*self.TOOLS)
+		if tool is not None:
+			self.skipTest('%s not found' % tool)
+		
+		tmp = tempfile.mkdtemp()
+		try:
+			
+			files = [os.path.join(TEST_DIR, n + '.rns') for n in self.FILES]
+			res = runac.compile_many(files, 2, tmp, whole=self.WHOLE)
+			self.assertEqual(files, [r[0] for r in res])
+			
+			for name, (fn, elapsed, error) in zip(self.FILES, res):
+				base = os.path.join(TEST_DIR, name)
+				if os.path.exists(base + '.err'):
+					with open(base + '.err') as f:
+						self.assertEqual(f.read(), error)
+					continue
+				
+				self.assertIsNone(error)
+				with open(base + '.out', 'rb') as f:
+					expected = f.read()
+				bin = os.path.join(tmp, name)
+				proc = subprocess.Popen([bin], stdout=subprocess.PIPE)
+				self.assertEqual(expected, proc.communicate()[0])
+		
+		finally:
+			shutil.rmtree(tmp, True)
+
+class WholeProgramTest(BatchTest):
+	'''As BatchTest, but linking the core library into each program.'''
+	WHOLE = True
+	TOOLS = BatchTest.TOOLS + ('llvm-link',)
+
+class OutputNameTest(unittest.TestCase):
+	'''Check that compile_many() rejects programs that would be written to
+	the same binary, before compiling any of them.'''
+	
+	def runTest(self):
+		
+		tmp = tempfile.mkdtemp()
+		try:
+			
+			files = []
+			for sub in 'a', 'b':
+				os.mkdir(os.path.join(tmp, sub))
+				files.append(os.path.join(tmp, sub, 'main.rns'))
+				shutil.copy(os.path.join(TEST_DIR, 'hello.rns'), files[-1])
+			
+			res = runac.compile_many(files, 2, tmp)
+			self.assertEqual(files, [r[0] for r in res])
+			for fn, elapsed, error in res:
+				msg = '%s: output file %s would be written by several programs\n'
+				self.assertEqual(msg % (fn, os.path.join(tmp, 'main')), error)
+			self.assertFalse(os.path.exists(os.path.join(tmp, 'main')))
+		
+		finally:
+			shutil.rmtree(tmp, True)
+
+class ServerTest(unittest.TestCase):
+	'''Run some commands through the compiler server, checking that they
+	produce the same results as running them in-process.'''
+	
+	def runTest(self):
+		
+		from runac import server
+		tmp = tempfile.mkdtemp()
+		path = os.path.join(tmp, 'runac.sock')
+		cmd = [sys.executable, '-m', 'runac', 'serve', path]
+		env = dict(os.environ, PYTHONPATH=os.path.abspath(DIR or '.'))
+		
+		# Use a clang that always fails, to check that output from external
+		# tools is passed on to the client along with a failing status
+		
+		bin = os.path.join(tmp, 'bin')
+		os.mkdir(bin)
+		with open(os.path.join(bin, 'clang'), 'w') as f:
+			f.write('#!/bin/sh\necho clang failed >&2\nexit 1\n')
+		os.chmod(os.path.join(bin, 'clang'), 0o755)
+		env['PATH'] = bin + os.pathsep + env.get('PATH', '')
+		
+		proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env)
+		try:
+			
+			self.assertTrue(proc.stdout.readline().startswith(b'listening'))
+			fn = os.path.join(TEST_DIR, 'hello.rns')
+			res = server.request(['generate', fn], path)
+			self.assertEqual((0, runac.ir(fn) + '\n', ''), (
+				res['status'], res['out'], res['err']
+			))
+			
+			fn = os.path.join(TEST_DIR, 'ast-err.rns')
+			res = server.request(['show', fn], path)
+			with open(fn.replace('.rns', '.err')) as f:
+				self.assertEqual(f.read(), res['err'])
+			
+			fn = os.path.join(TEST_DIR, 'hello.rns')
+			out = os.path.join(tmp, 'hello')
+			res = server.request(['compile', fn, '-o', out], path)
+			self.assertEqual((1, 'clang failed\n'), (res['status'], res['err']))
+			
+			proc.terminate()
+			proc.wait()
+			self.assertFalse(os.path.exists(path))
+			self.assertIsNone(server.request(['generate', fn], path))
+		
+		finally:
+			if proc.poll() is None:
+				proc.kill()
+			proc.stdout.close()
+			shutil.rmtree(tmp, True)
+
+class SocketTest(unittest.TestCase):
+	'''Check that the default server socket is only used in a directory
+	that is private to the current user.'''
+	
+	def runTest(self):
+		
+		from runac import server
+		tmp, env = tempfile.mkdtemp(), os.environ.copy()
+		base = tempfile.tempdir
+		try:
+			
+			tempfile.tempdir = tmp
+			os.environ.pop('RUNA_SOCKET', None)
+			path = server.address()
+			self.assertEqual(server.directory(), os.path.dirname(path))
+			self.assertFalse(server.secure(path))
+			self.assertTrue(server.secure(path, True))
+			self.assertEqual(0o700, os.stat(server.directory()).st_mode & 0o777)
+			
+			os.chmod(server.directory(), 0o755)
+			self.assertFalse(server.secure(path, True))
+			self.assertIsNone(server.request(['generate', 'x.rns']))
+			self.assertTrue(server.secure(os.path.join(tmp, 'other.sock')))
+		
+		finally:
+			tempfile.tempdir = base
+			os.environ.clear()
+			os.environ.update(env)
+			shutil.rmtree(tmp, True)
+
+INCREMENTAL_SRC = '''
+class Pair:
+	
+	a: int
+	b: int
+	
+	def __init__(self, a: int, b: int):
+		self.a = a
+		self.b = b
+
+def pick(x: int) -> (int, int):
+	return x, %s
+
+def make(x: int) -> $Pair:
+	return Pair(x, 1)
+
+def main():
+	a, b = pick(5)
+	print(a + b)
+	print(make(3).a)
+'''
+
+GENERATOR_SRC = '''
+def range(start: int, stop: int) -> iter[int]:
+	i = start%s
+	while i < stop:
+		yield i
+		i = i + 1
+
+def main():
+	for i in range(0, 5):
+		print(i)
+'''
+
+class IncrementalTest(unittest.TestCase):
+	'''Check that after a change to one function, only that function is
+	processed again, and the result matches a full build.'''
+	
+	def ir(self, fn, src):
+		with open(fn, 'w') as f:
+			f.write(src)
+		return runac._ir(fn)
+	
+	def runTest(self):
+		
+		tmp = tempfile.mkdtemp()
+		env = os.environ.copy()
+		try:
+			
+			fn = os.path.join(tmp, 'inc.rns')
+			os.environ['RUNA_CACHE_DIR'] = os.path.join(tmp, 'cache')
+			os.environ.pop('RUNA_NO_CACHE', None)
+			first, dirty = self.ir(fn, INCREMENTAL_SRC % '6')
+			self.assertEqual(4, len(dirty))
+			self.assertEqual((first, []), self.ir(fn, INCREMENTAL_SRC % '6'))
+			
+			changed, dirty = self.ir(fn, INCREMENTAL_SRC % 'x + 1')
+			self.assertEqual(['pick'], dirty)
+			os.environ['RUNA_NO_CACHE'] = '1'
+			self.assertEqual(changed, runac.ir(fn))
+			self.assertNotEqual(first, changed)
+			
+			# The context type of a generator is laid out from its body,
+			# so users of the generator must be processed again.
+			
+			os.environ.pop('RUNA_NO_CACHE')
+			self.ir(fn, GENERATOR_SRC % '')
+			count = '\n\tk = 0\n\tk = k + 1'
+			changed, dirty = self.ir(fn, GENERATOR_SRC % count)
+			self.assertEqual(['range', 'main'], dirty)
+			os.environ['RUNA_NO_CACHE'] = '1'
+			self.assertEqual(changed, runac.ir(fn))
+		
+		finally:
+			os.environ.clear()
+			os.environ.update(env)
+			shutil.rmtree(tmp, True)
+
+SHAPES_SRC = '''
+class Point:
+	
+	x: int
+	y: int
+	
+	def __init__(self, x: int, y: int):
+		self.x = x
+		self.y = y
+
+def area(p: &Point%s) -> int:
+	return %s
+'''
+
+MODULE_SRC = '''
+from shapes import Point, area
+
+def main():
+	print(area(Point(3, 4)%s))
+'''
+
+SHADOW_SRC = '''
+from shapes import area
+
+class Point:
+	
+	z: int
+	
+	def __init__(self, z: int):
+		self.z = z
+
+def main():
+	print(%s)
+'''
+
+GENS_SRC = '''
+def upto(start: int, stop: int) -> iter[int]:
+	i = start
+	while i < stop:
+		yield i
+		i = i + 1
+'''
+
+GENS_LOOP_SRC = '''
+from gens import upto
+
+def main():
+	for x in upto(0, 3):
+		print(x)
+'''
+
+class ModuleTest(unittest.TestCase):
+	'''Check that imported modules are compiled separately, and that
+	importers are only processed again if the interface changes.'''
+	
+	def ir(self, sig, body, arg):
+		
+		with open(os.path.join(self.tmp, 'shapes.rns'), 'w') as f:
+			f.write(SHAPES_SRC % (sig, body))
+		with open(os.path.join(self.tmp, 'app.rns'), 'w') as f:
+			f.write(MODULE_SRC % arg)
+		
+		built, loader = [], runac.Loader(self.tmp)
+		build = loader.build
+		loader.build = lambda name, fn: built.append(name) or build(name, fn)
+		ir, dirty = runac._ir(os.path.join(self.tmp, 'app.rns'), loader)
+		return ir, dirty, built
+	
+	def runTest(self):
+		
+		self.tmp = tempfile.mkdtemp()
+		env = os.environ.copy()
+		try:
+			
+			os.environ['RUNA_CACHE_DIR'] = os.path.join(self.tmp, 'cache')
+			os.environ.pop('RUNA_NO_CACHE', None)
+			first = self.ir('', 'p.x * p.y', '')
+			self.assertIn('declare i64 @Runa.shapes.area(%Runa.shapes.Point*)', first[0])
+			self.assertEqual((['main'], ['shapes']), first[1:])
+			self.assertEqual((first[0], [], []), self.ir('', 'p.x * p.y', ''))
+			
+			body = self.ir('', 'p.x + p.y', '')
+			self.assertEqual((first[0], [], ['shapes']), body)
+			
+			sig = self.ir(', n: int', 'p.x * n', ', 2')
+			self.assertEqual((['main'], ['shapes']), sig[1:])
+			os.environ['RUNA_NO_CACHE'] = '1'
+			self.assertEqual(sig[0], runac.ir(os.path.join(self.tmp, 'app.rns')))
+			
+			# Importers iterate over generators with their context type
+			
+			with open(os.path.join(self.tmp, 'gens.rns'), 'w') as f:
+				f.write(GENS_SRC)
+			fn = os.path.join(self.tmp, 'loop.rns')
+			with open(fn, 'w') as f:
+				f.write(GENS_LOOP_SRC)
+			
+			res = runac.ir(fn)
+			self.assertIn('@Runa.gens.upto$ctx.size = external constant', res)
+			self.assertIn('call %iter$int @Runa.gens.upto(', res)
+			
+			# Classes with the same name in different modules are distinct
+			
+			fn = os.path.join(self.tmp, 'shadow.rns')
+			with open(fn, 'w') as f:
+				f.write(SHADOW_SRC % 'Point(5).z')
+			
+			res = runac.ir(fn)
+			self.assertIn('%Runa.shapes.Point = type { i64, i64 }', res)
+			self.assertIn('@Runa.shapes.Point.size = external constant', res)
+			self.assertIn('%Runa.__main__.Point = type { i64 }', res)
+			self.assertIn('@Runa.__main__.Point.size = constant', res)
+			self.assertNotIn('@Point.size', res)
+			
+			with open(fn, 'w') as f:
+				f.write(SHADOW_SRC % 'area(Point(5), 2)')
+			self.assertRaises(util.Error, runac.ir, fn)
+		
+		finally:
+			os.environ.clear()
+			os.environ.update(env)
+			shutil.rmtree(self.tmp, True)
+
 def tests():
 	tests = []
 	for fn in os.listdir(TEST_DIR):
@@ -77,6 +825,25 @@ def tests():
 def suite():
 	suite = unittest.TestSuite()
 	suite.addTests(tests())
+	suite.addTest(ImportTest())
+	suite.addTest(LexerTest())
+	suite.addTest(ParserTest())
+	suite.addTest(NodeTest())
+	suite.addTest(VisitorTest())
+	suite.addTest(TypeTest())
+	suite.addTest(FlowTest())
+	suite.addTest(FusionTest())
+	suite.addTest(StreamTest())
+	suite.addTest(ParallelTest())
+	suite.addTest(TimingTest())
+	suite.addTest(ConcurrencyTest())
+	suite.addTest(BatchTest())
+	suite.addTest(WholeProgramTest())
+	suite.addTest(OutputNameTest())
+	suite.addTest(ServerTest())
+	suite.addTest(SocketTest())
+	suite.addTest(IncrementalTest())
+	suite.addTest(ModuleTest())
 	return suite
 
 IGNORE = [